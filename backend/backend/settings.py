@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'froutes',
     'schedules',
     'feedback',
+    'live',
 ]
 
 MIDDLEWARE = [
@@ -100,6 +101,17 @@ DATABASES = {
     }
 }
 
+# Shared by every worker and management command on this host: it holds the
+# timetable version that retires cached responses and process-local indexes
+# after an import or admin edit. Use Redis or Memcached to share it across hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -141,3 +153,29 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Compiled timetable written by `manage.py compile_timetable`. Workers map it
+# read-only instead of building the timetable from the ORM while it matches
+# the current timetable version; after an import or edit they fall back to
+# the ORM until it is recompiled.
+TIMETABLE_SNAPSHOT = BASE_DIR / 'timetable.bin'
+
+# find_routes memo: requests are grouped into time buckets of this many
+# minutes, and at most ROUTE_CACHE_MAX_ENTRIES itineraries are kept per process
+ROUTE_CACHE_BUCKET_MINUTES = 5
+ROUTE_CACHE_MAX_ENTRIES = 2048
+ROUTE_CACHE_TTL_SECONDS = 600
+
+# Map tiles served by /api/tiles/<z>/<x>/<y>/ are cached here once built
+TILE_CACHE_DIR = BASE_DIR / 'tile_cache'
+
+# Live vehicle positions: changed vehicles are persisted every
+# LIVE_SNAPSHOT_INTERVAL seconds; feeds authenticate with X-Ingest-Token
+LIVE_SNAPSHOT_INTERVAL = 5.0
+LIVE_INGEST_TOKEN = None
+
+# Feedback sentiment is scored by a background thread in batches of up to
+# FEEDBACK_SENTIMENT_BATCH_SIZE comments, waiting at most
+# FEEDBACK_SENTIMENT_BATCH_WAIT seconds for a batch to fill
+FEEDBACK_SENTIMENT_BATCH_SIZE = 64
+FEEDBACK_SENTIMENT_BATCH_WAIT = 0.5
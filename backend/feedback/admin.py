@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Feedback
+from .models import Feedback, FeedbackRollup
 # Register your models here.
 
 admin.site.register(Feedback)
+admin.site.register(FeedbackRollup)
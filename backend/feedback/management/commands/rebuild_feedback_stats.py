@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from feedback.stats import rebuild_from_table
+
+
+class Command(BaseCommand):
+    help = "Recompute the all-time, hourly and daily feedback rollups from the Feedback table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per fetch and bulk INSERT")
+
+    def handle(self, *args, **options):
+        count = rebuild_from_table(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} feedback rollup(s)"))
@@ -0,0 +1,59 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from feedback.models import Feedback
+from feedback.sentiment import get_analyzer, score_batch, save_labels
+
+# Batches queued per worker beyond the one it is scoring
+PREFETCH_PER_WORKER = 1
+
+
+class Command(BaseCommand):
+    help = "Score feedback sentiment in a process pool: unscored feedback by default, everything with --all"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rescore feedback that already has a sentiment")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Scoring processes")
+        parser.add_argument('--batch-size', type=int, default=500, help="Comments per worker task and bulk UPDATE")
+
+    def handle(self, *args, **options):
+        queryset = Feedback.objects.order_by('id')
+        if not options['all']:
+            queryset = queryset.filter(sentiment__isnull=True)
+        rows = queryset.values_list('id', 'comment')
+
+        scored = 0
+        # At most this many batches are read but not yet written back, so
+        # memory stays bounded however large the table is
+        max_pending = options['workers'] * (1 + PREFETCH_PER_WORKER)
+        pending = set()
+        # Each worker loads the analyzer once and keeps it for every batch it scores
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=get_analyzer) as pool:
+            for batch in self.batches(rows, options['batch_size']):
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    scored += self.save(done)
+                pending.add(pool.submit(score_batch, batch))
+            scored += self.save(pending)
+        self.stdout.write(self.style.SUCCESS(f"Scored {scored} feedback entr{'y' if scored == 1 else 'ies'}"))
+
+    def save(self, futures):
+        count = 0
+        for future in futures:
+            labels = future.result()
+            save_labels(labels)
+            count += len(labels)
+        return count
+
+    def batches(self, rows, size):
+        """
+        Pages of ``rows`` keyed on the last id seen. Each page is its own short
+        query, so no cursor over the table is open while labels are written back.
+        """
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[:size])
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1][0]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Feedback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comment', models.TextField()),
+                ('rating', models.IntegerField(default=0)),
+                ('sentiment', models.CharField(blank=True, max_length=20, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FeedbackRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('total', 'All time'), ('hour', 'Hourly'), ('day', 'Daily')], max_length=5)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day; the epoch for the all-time row')),
+                ('count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('positive', models.IntegerField(default=0)),
+                ('neutral', models.IntegerField(default=0)),
+                ('negative', models.IntegerField(default=0)),
+                ('unscored', models.IntegerField(default=0)),
+                ('rating_1', models.IntegerField(default=0)),
+                ('rating_2', models.IntegerField(default=0)),
+                ('rating_3', models.IntegerField(default=0)),
+                ('rating_4', models.IntegerField(default=0)),
+                ('rating_5', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['period', 'bucket'],
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket'), name='unique_feedback_rollup_bucket')],
+            },
+        ),
+    ]
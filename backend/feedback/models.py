@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from home.models import User
 
 class Feedback(models.Model):
@@ -9,4 +9,54 @@ class Feedback(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Feedback by {self.user.username} ({self.rating}/5)"
\ No newline at end of file
+        return f"Feedback by {self.user.username} ({self.rating}/5)"
+
+    # FeedbackRollup rows change in the same transaction as the feedback itself;
+    # deletes are counted by the post_delete handler in signals.py
+    def save(self, *args, **kwargs):
+        from .stats import record_change, stats_row
+
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = Feedback.objects.filter(pk=self.pk).values_list('created_at', 'rating', 'sentiment').first()
+            super().save(*args, **kwargs)
+            record_change(previous, stats_row(self))
+
+    # post_delete counts the row as loaded; an instance can be older than the
+    # stored row (a label written by save_labels), so re-read it first
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self.refresh_from_db(fields=['created_at', 'rating', 'sentiment'])
+            return super().delete(*args, **kwargs)
+
+
+class FeedbackRollup(models.Model):
+    """Running totals of feedback: one all-time row plus one row per hour and per day (UTC)."""
+    TOTAL, HOUR, DAY = 'total', 'hour', 'day'
+    PERIOD_CHOICES = [(TOTAL, 'All time'), (HOUR, 'Hourly'), (DAY, 'Daily')]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the hour or day; the epoch for the all-time row")
+    # Signed, so a row changed behind the model's back (queryset update) cannot
+    # block later writes; `manage.py rebuild_feedback_stats` corrects the drift
+    count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    positive = models.IntegerField(default=0)
+    neutral = models.IntegerField(default=0)
+    negative = models.IntegerField(default=0)
+    unscored = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['period', 'bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket'], name='unique_feedback_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_period_display()} {self.bucket:%Y-%m-%d %H:%M}: {self.count} feedback"
@@ -1,12 +1,132 @@
+"""
+Sentiment labels for feedback comments, scored off the request thread.
+
+``FeedbackCreateView`` saves the comment without a sentiment and hands its
+id to the process's ``SentimentQueue`` once the transaction commits. A
+daemon thread drains the queue in batches, scores each batch with one
+TextBlob analyzer and writes the labels back in a single ``bulk_update``.
+Comments still unscored when a process exits are picked up by
+``manage.py rescore_feedback``, which scores in a process pool.
+"""
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
 from textblob import TextBlob
+from textblob.en.sentiments import PatternAnalyzer
 
-def analyze_sentiment(comment):
-    analysis = TextBlob(comment)
-    polarity = analysis.sentiment.polarity  # Range: [-1.0, 1.0]
+logger = logging.getLogger(__name__)
+
+POSITIVE_THRESHOLD = 0.1
+NEGATIVE_THRESHOLD = -0.1
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_BATCH_WAIT = 0.5
+
+# One analyzer per worker (thread or pool process), loaded on first use
+_analyzer = None
+
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = PatternAnalyzer()
+    return _analyzer
 
-    if polarity > 0.1:
+
+def label(polarity):
+    if polarity > POSITIVE_THRESHOLD:
         return "Positive"
-    elif polarity < -0.1:
+    elif polarity < NEGATIVE_THRESHOLD:
         return "Negative"
     else:
-        return "Neutral"
\ No newline at end of file
+        return "Neutral"
+
+
+def analyze_sentiment(comment):
+    analysis = TextBlob(comment or "", analyzer=get_analyzer())
+    return label(analysis.sentiment.polarity)  # Range: [-1.0, 1.0]
+
+
+def score_batch(rows):
+    """[(id, label)] for [(id, comment)]; runs in pool workers, so it must stay picklable."""
+    return [(pk, analyze_sentiment(comment)) for pk, comment in rows]
+
+
+def save_labels(labels):
+    """Write labels and their rollup deltas together; bulk_update bypasses Feedback.save()."""
+    # Imported lazily so pool workers can import this module without Django set up
+    from .models import Feedback
+    from .stats import record_changes
+
+    with transaction.atomic():
+        previous = {
+            pk: (created_at, rating, sentiment)
+            for pk, created_at, rating, sentiment in Feedback.objects.select_for_update()
+            .filter(pk__in=[pk for pk, _ in labels]).values_list('id', 'created_at', 'rating', 'sentiment')
+        }
+        labels = [(pk, sentiment) for pk, sentiment in labels if pk in previous]
+        Feedback.objects.bulk_update(
+            [Feedback(pk=pk, sentiment=sentiment) for pk, sentiment in labels], ['sentiment']
+        )
+        record_changes((previous[pk], previous[pk][:2] + (sentiment,)) for pk, sentiment in labels)
+
+
+class SentimentQueue(threading.Thread):
+    """Daemon thread scoring submitted feedback ids in batches of up to ``batch_size``."""
+
+    def __init__(self, batch_size, batch_wait):
+        super().__init__(name='feedback-sentiment', daemon=True)
+        self.ids = queue.Queue()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+
+    def submit(self, feedback_id):
+        self.ids.put(feedback_id)
+
+    def run(self):
+        while True:
+            # Block for the first id, then give the rest of the batch a short window
+            batch = [self.ids.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.ids.get(timeout=self.batch_wait))
+                except queue.Empty:
+                    break
+            self.process(batch)
+
+    def process(self, ids):
+        from .models import Feedback
+
+        try:
+            rows = Feedback.objects.filter(pk__in=ids).values_list('id', 'comment')
+            save_labels(score_batch(rows))
+        except Exception:
+            # Left unscored; `manage.py rescore_feedback` fills them in
+            logger.exception("Scoring sentiment for %d feedback entries failed", len(ids))
+        finally:
+            connection.close()
+
+
+# ----------------------
+# Process-local queue
+# ----------------------
+_lock = threading.Lock()
+_queue = None
+
+
+def get_sentiment_queue():
+    global _queue
+    worker = _queue
+    if worker is None:
+        with _lock:
+            if _queue is None:
+                worker = SentimentQueue(
+                    getattr(settings, 'FEEDBACK_SENTIMENT_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                    getattr(settings, 'FEEDBACK_SENTIMENT_BATCH_WAIT', DEFAULT_BATCH_WAIT),
+                )
+                worker.start()
+                _queue = worker
+            worker = _queue
+    return worker
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Feedback
+from .stats import record_change, stats_row
+
+
+# Sent inside the deleting transaction, including for queryset and cascade deletes
+@receiver(post_delete, sender=Feedback, dispatch_uid='feedback.feedback_deleted')
+def feedback_deleted(sender, instance, **kwargs):
+    record_change(stats_row(instance), None)
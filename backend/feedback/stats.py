@@ -0,0 +1,160 @@
+"""
+Running feedback statistics.
+
+Every change to a ``Feedback`` row adds its contribution to three
+``FeedbackRollup`` rows: the all-time row and the rows of the hour and day
+(UTC) it was created in. A change is counted as the old row's contribution
+taken away plus the new row's contribution added. The deltas are applied
+with ``F()`` expressions in the writer's transaction, so concurrent writers
+never lose each other's updates. Reading the stats is a single-row lookup,
+and a trend chart reads one row per bucket.
+
+Until the all-time row exists (a fresh deploy over existing feedback) the
+first read or write backfills every rollup from the table instead.
+Queryset ``update()`` calls bypass this; ``manage.py rebuild_feedback_stats``
+recomputes every rollup from the table.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Feedback, FeedbackRollup
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+SENTIMENT_FIELDS = {'Positive': 'positive', 'Neutral': 'neutral', 'Negative': 'negative'}
+RATING_FIELDS = {rating: f'rating_{rating}' for rating in range(1, 6)}
+PERIOD_LENGTH = {FeedbackRollup.HOUR: timedelta(hours=1), FeedbackRollup.DAY: timedelta(days=1)}
+
+
+def stats_row(feedback):
+    return feedback.created_at, feedback.rating, feedback.sentiment
+
+
+def buckets(created_at):
+    hour = created_at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return (
+        (FeedbackRollup.TOTAL, EPOCH),
+        (FeedbackRollup.HOUR, hour),
+        (FeedbackRollup.DAY, hour.replace(hour=0)),
+    )
+
+
+def bucket_start(period, at):
+    """Start of the ``period`` bucket containing ``at``."""
+    return dict(buckets(at))[period]
+
+
+def contribution(rating, sentiment, sign):
+    deltas = {
+        'count': sign,
+        'rating_sum': sign * rating,
+        SENTIMENT_FIELDS.get(sentiment, 'unscored'): sign,
+    }
+    if rating in RATING_FIELDS:
+        deltas[RATING_FIELDS[rating]] = sign
+    return deltas
+
+
+def accumulate(changes):
+    """{(period, bucket): Counter of field deltas} for ``(previous, current)`` row pairs."""
+    totals = defaultdict(Counter)
+    for previous, current in changes:
+        for row, sign in ((previous, -1), (current, 1)):
+            if row is None:
+                continue
+            created_at, rating, sentiment = row
+            for key in buckets(created_at):
+                totals[key].update(contribution(rating, sentiment, sign))
+    return totals
+
+
+def record_changes(changes):
+    """
+    Apply ``(previous, current)`` pairs of ``stats_row`` tuples, where
+    ``None`` stands for a row that did not exist before or no longer does.
+    """
+    totals = accumulate(changes)
+    with transaction.atomic():
+        if not totals_exist():
+            # The table already holds this change, so the backfill counts it
+            backfill()
+            return
+        # Buckets are locked in a fixed order so concurrent writers cannot deadlock
+        for (period, bucket), deltas in sorted(totals.items()):
+            deltas = {field: delta for field, delta in deltas.items() if delta}
+            if not deltas:
+                continue
+            rollup, _ = FeedbackRollup.objects.get_or_create(period=period, bucket=bucket)
+            FeedbackRollup.objects.filter(pk=rollup.pk).update(
+                **{field: F(field) + delta for field, delta in deltas.items()}
+            )
+
+
+def record_change(previous, current):
+    record_changes([(previous, current)])
+
+
+def rebuild(rows, batch_size=1000):
+    """Replace every rollup with totals recomputed from ``stats_row`` tuples."""
+    totals = accumulate((None, row) for row in rows)
+    totals.setdefault((FeedbackRollup.TOTAL, EPOCH), Counter())
+    rollups = [
+        FeedbackRollup(period=period, bucket=bucket, **deltas)
+        for (period, bucket), deltas in sorted(totals.items())
+    ]
+    with transaction.atomic():
+        FeedbackRollup.objects.all().delete()
+        FeedbackRollup.objects.bulk_create(rollups, batch_size=batch_size)
+    return len(rollups)
+
+
+def rebuild_from_table(batch_size=1000):
+    rows = Feedback.objects.values_list('created_at', 'rating', 'sentiment').iterator(chunk_size=batch_size)
+    return rebuild(rows, batch_size)
+
+
+def totals_exist():
+    return FeedbackRollup.objects.filter(period=FeedbackRollup.TOTAL, bucket=EPOCH).exists()
+
+
+def backfill():
+    try:
+        rebuild_from_table()
+    except IntegrityError:
+        pass  # another process backfilled first
+
+
+# ----------------------
+# Reads
+# ----------------------
+def get_totals():
+    rollup = FeedbackRollup.objects.filter(period=FeedbackRollup.TOTAL, bucket=EPOCH).first()
+    if rollup is None:
+        backfill()
+        rollup = FeedbackRollup.objects.filter(period=FeedbackRollup.TOTAL, bucket=EPOCH).first()
+    return rollup or FeedbackRollup(period=FeedbackRollup.TOTAL, bucket=EPOCH)
+
+
+def summary(rollup):
+    count = rollup.count
+    return {
+        'total_feedback': count,
+        'average_rating': round(rollup.rating_sum / count, 1) if count else 0,
+        'positive_percentage': round(rollup.positive / count * 100, 1) if count else 0,
+        'sentiments': {label: getattr(rollup, field) for label, field in SENTIMENT_FIELDS.items()}
+                      | {'Unscored': rollup.unscored},
+        'ratings': {rating: getattr(rollup, field) for rating, field in RATING_FIELDS.items()},
+    }
+
+
+def trend(period, count, now):
+    """The last ``count`` ``period`` buckets up to ``now``, oldest first; empty buckets are left out."""
+    if not totals_exist():
+        backfill()
+    start = bucket_start(period, now) - PERIOD_LENGTH[period] * (count - 1)
+    return [
+        {'bucket': rollup.bucket.isoformat(), **summary(rollup)}
+        for rollup in FeedbackRollup.objects.filter(period=period, bucket__gte=start).order_by('bucket')
+    ]
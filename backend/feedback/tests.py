@@ -1,3 +1,267 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .models import Feedback, FeedbackRollup
+from .sentiment import SentimentQueue, analyze_sentiment, save_labels
+from .stats import accumulate, bucket_start, get_totals, summary, stats_row
 
-# Create your tests here.
+POSITIVE, NEGATIVE, NEUTRAL = "I love this great bus", "The bus was terrible and late", "The bus came"
+
+
+def create_feedback(user, comment, rating=3, sentiment=None):
+    return Feedback.objects.create(user=user, comment=comment, rating=rating, sentiment=sentiment)
+
+
+class AnalyzeSentimentTests(TestCase):
+    def test_labels(self):
+        self.assertEqual(analyze_sentiment(POSITIVE), "Positive")
+        self.assertEqual(analyze_sentiment(NEGATIVE), "Negative")
+        self.assertEqual(analyze_sentiment(NEUTRAL), "Neutral")
+        self.assertEqual(analyze_sentiment(None), "Neutral")
+
+
+class SaveLabelsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("rider")
+
+    def test_labels_and_rollups_move_together(self):
+        first = create_feedback(self.user, POSITIVE, rating=5)
+        second = create_feedback(self.user, NEGATIVE, rating=1, sentiment="Positive")
+        save_labels([(first.pk, "Positive"), (second.pk, "Negative"), (second.pk + 100, "Neutral")])
+        self.assertEqual(
+            list(Feedback.objects.order_by('id').values_list('sentiment', flat=True)), ["Positive", "Negative"]
+        )
+        totals = summary(get_totals())
+        self.assertEqual(totals['total_feedback'], 2)
+        self.assertEqual(totals['sentiments'], {'Positive': 1, 'Neutral': 0, 'Negative': 1, 'Unscored': 0})
+
+    def test_saving_the_same_labels_again_changes_nothing(self):
+        feedback = create_feedback(self.user, POSITIVE)
+        save_labels([(feedback.pk, "Positive")])
+        before = list(FeedbackRollup.objects.values())
+        save_labels([(feedback.pk, "Positive")])
+        self.assertEqual(list(FeedbackRollup.objects.values()), before)
+
+
+class FeedbackCreateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("rider"))
+
+    def test_scoring_is_queued_after_commit(self):
+        worker = mock.Mock()
+        with mock.patch('feedback.views.get_sentiment_queue', return_value=worker):
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(reverse('create-feedback'), {'comment': POSITIVE, 'rating': 5})
+                self.assertEqual(response.status_code, 201)
+                self.assertIsNone(response.json()['sentiment'])
+                worker.submit.assert_not_called()
+            for callback in callbacks:
+                callback()
+        worker.submit.assert_called_once_with(response.json()['id'])
+
+
+class SentimentQueueTests(TestCase):
+    def test_ids_are_batched(self):
+        worker = SentimentQueue(batch_size=2, batch_wait=0.05)
+        batches = []
+        done = threading.Event()
+
+        def process(ids):
+            batches.append(ids)
+            if sum(map(len, batches)) == 5:
+                done.set()
+
+        worker.process = process
+        for feedback_id in range(1, 6):
+            worker.submit(feedback_id)
+        worker.start()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(batches, [[1, 2], [3, 4], [5]])
+
+    def test_failed_batch_is_left_unscored(self):
+        worker = SentimentQueue(batch_size=8, batch_wait=0)
+        with mock.patch('feedback.sentiment.save_labels', side_effect=RuntimeError), \
+                mock.patch('feedback.sentiment.connection'), self.assertLogs('feedback.sentiment', 'ERROR'):
+            worker.process([1])
+
+
+class SentimentQueueThreadTests(TransactionTestCase):
+    def test_queue_scores_submitted_feedback(self):
+        user = User.objects.create_user("rider")
+        ids = [create_feedback(user, comment).pk for comment in (POSITIVE, NEGATIVE, NEUTRAL)]
+        processed = []
+        done = threading.Event()
+
+        class Worker(SentimentQueue):
+            def process(self, batch):
+                super().process(batch)
+                # The worker's connection is closed by now, so the test database can be flushed
+                processed.extend(batch)
+                if len(processed) == len(ids):
+                    done.set()
+
+        worker = Worker(batch_size=2, batch_wait=0.05)
+        worker.start()
+        for feedback_id in ids:
+            worker.submit(feedback_id)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(
+            list(Feedback.objects.order_by('id').values_list('sentiment', flat=True)),
+            ["Positive", "Negative", "Neutral"],
+        )
+        self.assertEqual(summary(get_totals())['sentiments']['Unscored'], 0)
+
+
+class RescoreFeedbackTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("rider")
+        self.feedback = [
+            create_feedback(user, POSITIVE),
+            create_feedback(user, NEGATIVE, sentiment="Positive"),
+            create_feedback(user, NEUTRAL),
+            create_feedback(user, NEGATIVE),
+            create_feedback(user, POSITIVE),
+        ]
+
+    def rescore(self, *args):
+        out = StringIO()
+        call_command('rescore_feedback', *args, workers=2, batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def sentiments(self):
+        return list(Feedback.objects.order_by('id').values_list('sentiment', flat=True))
+
+    def test_scores_only_unscored_feedback(self):
+        self.assertIn("Scored 4 feedback entries", self.rescore())
+        self.assertEqual(self.sentiments(), ["Positive", "Positive", "Neutral", "Negative", "Positive"])
+        self.assertIn("Scored 0 feedback entries", self.rescore())
+
+    def test_all_rescores_everything(self):
+        self.assertIn("Scored 5 feedback entries", self.rescore('--all'))
+        self.assertEqual(self.sentiments(), ["Positive", "Negative", "Neutral", "Negative", "Positive"])
+        self.assertEqual(
+            summary(get_totals())['sentiments'], {'Positive': 2, 'Neutral': 1, 'Negative': 2, 'Unscored': 0}
+        )
+
+    def test_pages_do_not_hold_a_cursor_open(self):
+        # Every page is a fresh query after the previous labels were written
+        with mock.patch('django.db.models.query.QuerySet.iterator', side_effect=AssertionError):
+            self.rescore()
+        self.assertNotIn(None, self.sentiments())
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("rider")
+
+    maxDiff = None
+
+    def assertRollupsMatchTable(self):
+        expected = {
+            key: {field: value for field, value in deltas.items() if value}
+            for key, deltas in accumulate((None, stats_row(f)) for f in Feedback.objects.all()).items()
+        }
+        actual = {}
+        for rollup in FeedbackRollup.objects.values():
+            fields = {
+                field: value for field, value in rollup.items()
+                if field not in ('id', 'period', 'bucket') and value
+            }
+            if fields:
+                actual[rollup['period'], rollup['bucket']] = fields
+        self.assertEqual(actual, {key: fields for key, fields in expected.items() if fields})
+
+    def test_rollups_follow_every_change(self):
+        first = create_feedback(self.user, POSITIVE, rating=5)
+        second = create_feedback(self.user, NEGATIVE, rating=1)
+        create_feedback(self.user, NEUTRAL, rating=3, sentiment="Neutral")
+        self.assertRollupsMatchTable()
+
+        first.rating = 4
+        first.save()
+        self.assertRollupsMatchTable()
+        save_labels([(first.pk, "Positive"), (second.pk, "Negative")])
+        self.assertRollupsMatchTable()
+        save_labels([(first.pk, "Negative")])
+        self.assertRollupsMatchTable()
+
+        # `second` still holds the sentiment it was loaded with
+        second.delete()
+        self.assertRollupsMatchTable()
+        Feedback.objects.filter(rating=3).delete()
+        self.assertRollupsMatchTable()
+        self.assertEqual(summary(get_totals())['total_feedback'], 1)
+
+    def test_first_write_backfills_existing_feedback(self):
+        create_feedback(self.user, POSITIVE, rating=5, sentiment="Positive")
+        create_feedback(self.user, NEGATIVE, rating=1)
+        FeedbackRollup.objects.all().delete()
+        # Counted once: the backfill reads the table, which already holds it
+        create_feedback(self.user, NEUTRAL, rating=2)
+        self.assertRollupsMatchTable()
+        self.assertEqual(get_totals().count, 3)
+
+    def test_first_read_backfills_existing_feedback(self):
+        create_feedback(self.user, POSITIVE, rating=5)
+        FeedbackRollup.objects.all().delete()
+        totals = summary(get_totals())
+        self.assertEqual((totals['total_feedback'], totals['average_rating']), (1, 5))
+        self.assertRollupsMatchTable()
+
+    def test_rebuild_corrects_queryset_updates(self):
+        create_feedback(self.user, POSITIVE, rating=5)
+        create_feedback(self.user, NEGATIVE, rating=1)
+        Feedback.objects.update(rating=2, sentiment="Neutral")
+        out = StringIO()
+        call_command('rebuild_feedback_stats', stdout=out)
+        self.assertIn("Rebuilt 3 feedback rollup(s)", out.getvalue())
+        self.assertRollupsMatchTable()
+        self.assertEqual(summary(get_totals())['sentiments']['Neutral'], 2)
+
+    def test_stats_endpoint(self):
+        create_feedback(self.user, POSITIVE, rating=5, sentiment="Positive")
+        create_feedback(self.user, NEGATIVE, rating=2, sentiment="Negative")
+        stats = self.client.get(reverse('feedback-stats')).json()
+        self.assertEqual(stats['total_feedback'], 2)
+        self.assertEqual(stats['average_rating'], 3.5)
+        self.assertEqual(stats['positive_percentage'], 50.0)
+
+
+class FeedbackTrendTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("rider")
+        now = timezone.now()
+        for age, rating in ((timedelta(0), 5), (timedelta(0), 3), (timedelta(days=1), 4), (timedelta(days=5), 1)):
+            feedback = create_feedback(user, NEUTRAL, rating=rating)
+            Feedback.objects.filter(pk=feedback.pk).update(created_at=now - age)
+        call_command('rebuild_feedback_stats', stdout=StringIO())
+        self.today = bucket_start(FeedbackRollup.DAY, now)
+
+    def trend(self, **params):
+        return self.client.get(reverse('feedback-stats-trend'), params)
+
+    def test_daily_buckets_oldest_first(self):
+        response = self.trend(period='day', buckets=3)
+        self.assertEqual(response.status_code, 200)
+        buckets = response.json()['buckets']
+        self.assertEqual(
+            [(row['bucket'], row['total_feedback'], row['average_rating']) for row in buckets],
+            [((self.today - timedelta(days=1)).isoformat(), 1, 4), (self.today.isoformat(), 2, 4)],
+        )
+        self.assertEqual(sum(row['total_feedback'] for row in self.trend(period='day', buckets=6).json()['buckets']), 4)
+
+    def test_hourly_buckets(self):
+        buckets = self.trend(period='hour', buckets=1).json()['buckets']
+        self.assertEqual([row['total_feedback'] for row in buckets], [2])
+
+    def test_invalid_parameters(self):
+        for params in ({'period': 'week'}, {'buckets': 'all'}, {'buckets': 0}, {'period': 'hour', 'buckets': 24 * 31 + 1}):
+            self.assertEqual(self.trend(**params).status_code, 400, params)
@@ -5,5 +5,6 @@ urlpatterns = [
     path('feedback/', views.FeedbackCreateView.as_view(), name='create-feedback'),
     path('feedback/recent/', views.RecentFeedbackListView.as_view(), name='recent-feedback'),
     path('feedback/stats/', views.FeedbackStatsView.as_view(), name='feedback-stats'),
+    path('feedback/stats/trend/', views.FeedbackTrendView.as_view(), name='feedback-stats-trend'),
     path('feedback/user/', views.UserFeedbackView.as_view(), name='user-feedback'),
 ]
\ No newline at end of file
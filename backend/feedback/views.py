@@ -1,11 +1,16 @@
 from django.shortcuts import render
 from rest_framework import generics
-from .models import Feedback
+from .models import Feedback, FeedbackRollup
 from .serializers import FeedbackSerializer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db.models import Avg
-from .sentiment import analyze_sentiment
+from django.db import transaction
+from django.utils import timezone
+from .sentiment import get_sentiment_queue
+from .stats import get_totals, summary, trend
+
+DEFAULT_TREND_BUCKETS = 30
+MAX_TREND_BUCKETS = 24 * 31
 
 # Create your views here.
 
@@ -15,9 +20,9 @@ class FeedbackCreateView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        comment = self.request.data.get("comment", "")
-        sentiment = analyze_sentiment(comment)
-        serializer.save(user=self.request.user, sentiment=sentiment)
+        # Sentiment is scored in the background once the row is committed
+        feedback = serializer.save(user=self.request.user)
+        transaction.on_commit(lambda: get_sentiment_queue().submit(feedback.pk))
 
 
 class RecentFeedbackListView(generics.ListAPIView):
@@ -27,16 +32,25 @@ class RecentFeedbackListView(generics.ListAPIView):
 
 class FeedbackStatsView(generics.GenericAPIView):
     def get(self, request, *args, **kwargs):
-        total_feedback = Feedback.objects.count()
-        avg_rating = Feedback.objects.aggregate(avg_rating=Avg('rating'))['avg_rating'] or 0
-        positive_feedback = Feedback.objects.filter(sentiment='Positive').count()
-        positive_percentage = (positive_feedback / total_feedback * 100) if total_feedback > 0 else 0
-
-        return Response({
-            'total_feedback': total_feedback,
-            'average_rating': round(avg_rating, 1),
-            'positive_percentage': round(positive_percentage, 1),
-        })
+        # One row read: the all-time rollup is kept current on every save
+        return Response(summary(get_totals()))
+
+
+class FeedbackTrendView(generics.GenericAPIView):
+    """Hourly or daily feedback stats for the last ``buckets`` hours or days."""
+
+    def get(self, request, *args, **kwargs):
+        period = request.query_params.get('period', FeedbackRollup.DAY)
+        if period not in (FeedbackRollup.HOUR, FeedbackRollup.DAY):
+            return Response({'error': "period must be 'hour' or 'day'"}, status=400)
+        try:
+            count = int(request.query_params.get('buckets', DEFAULT_TREND_BUCKETS))
+        except ValueError:
+            return Response({'error': 'buckets must be an integer'}, status=400)
+        if not 1 <= count <= MAX_TREND_BUCKETS:
+            return Response({'error': f'buckets must be between 1 and {MAX_TREND_BUCKETS}'}, status=400)
+
+        return Response({'period': period, 'buckets': trend(period, count, timezone.now())})
 
 
 class UserFeedbackView(generics.ListAPIView):
@@ -0,0 +1,85 @@
+from array import array
+from bisect import bisect_left
+
+from .timetable import SECONDS_PER_DAY, seconds_to_hhmm
+
+
+class DepartureIndex:
+    """
+    Departures per stop, in compressed sparse row form.
+
+    Departures from stop ``s`` occupy ``offsets[s]:offsets[s + 1]`` of the
+    parallel arrays, sorted by ``seconds`` (time of day, 0..86399), so the
+    next departures after any time are a bisect away. Terminal stops of a
+    pattern are left out: nothing departs from them.
+    """
+
+    def __init__(self, tt):
+        self.tt = tt
+        per_stop = [[] for _ in tt.stop_ids]
+        for p in range(tt.n_patterns):
+            last = tt.pattern_size(p) - 1
+            for t in range(tt.trip_count(p)):
+                for pos in range(last):
+                    seconds = tt.departure(p, t, pos) % SECONDS_PER_DAY
+                    per_stop[tt.pattern_stop(p, pos)].append((seconds, p, t, pos))
+
+        self.offsets = array('i', [0])
+        self.seconds = array('i')
+        self.patterns = array('i')
+        self.trips = array('i')
+        self.positions = array('i')
+        for rows in per_stop:
+            rows.sort()
+            for seconds, p, t, pos in rows:
+                self.seconds.append(seconds)
+                self.patterns.append(p)
+                self.trips.append(t)
+                self.positions.append(pos)
+            self.offsets.append(len(self.seconds))
+
+    def _scan(self, stop, after, pattern=None):
+        """Yield (row, next_day) from ``after`` onwards, wrapping once past midnight."""
+        lo, hi = self.offsets[stop], self.offsets[stop + 1]
+        start = bisect_left(self.seconds, after % SECONDS_PER_DAY, lo, hi)
+        for rows, next_day in ((range(start, hi), False), (range(lo, start), True)):
+            for row in rows:
+                if pattern is None or self.patterns[row] == pattern:
+                    yield row, next_day
+
+    def next_departures(self, stop, after, limit, pattern=None):
+        """The next ``limit`` departures from dense stop index ``stop`` at or after ``after`` seconds."""
+        result = []
+        if limit <= 0:
+            return result
+        for row in self._scan(stop, after, pattern):
+            result.append(row)
+            if len(result) >= limit:
+                break
+        return result
+
+    def window(self, stop, after, minutes, limit=None, pattern=None):
+        """Departures within ``minutes`` of ``after``, crossing midnight if needed."""
+        end = after % SECONDS_PER_DAY + minutes * 60
+        result = []
+        for row, next_day in self._scan(stop, after, pattern):
+            if self.seconds[row] + (SECONDS_PER_DAY if next_day else 0) >= end:
+                break
+            result.append((row, next_day))
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def describe(self, row, next_day):
+        tt = self.tt
+        p, t, pos = self.patterns[row], self.trips[row], self.positions[row]
+        route_id = tt.pattern_route[p]
+        terminus = tt.pattern_stop(p, tt.pattern_size(p) - 1)
+        return {
+            'trip_id': tt.trip_id(p, t),
+            'route_id': route_id,
+            'route': tt.routes[route_id]['name'],
+            'destination': tt.station_names[tt.stop_station[terminus]],
+            'departure_time': seconds_to_hhmm(self.seconds[row]),
+            'next_day': next_day,
+        }
@@ -0,0 +1,96 @@
+"""
+Memo of planned itineraries for ``find_routes``.
+
+Entries are keyed on the normalized source and destination names, the
+transfer limit and the requested time rounded down to a bucket. Only the
+itineraries (patterns and boarding/alighting positions) planned from the
+start of the bucket are kept, with the earliest departure among them. A
+request at or before that departure re-times them with a few binary
+searches: every journey planned from the bucket start is still catchable,
+so the Pareto set is the same. A later request within the bucket may have
+lost a journey to a slower one it outran, and is planned afresh.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .timetable import normalize_stop_name
+
+DEFAULT_BUCKET_MINUTES = 5
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL_SECONDS = 600
+
+
+class RouteCache:
+    """Thread-safe LRU with a per-entry TTL, emptied whenever the timetable is rebuilt."""
+
+    def __init__(self, max_entries, ttl, bucket_seconds):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.timetable = None
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def bucket(self, seconds):
+        return seconds - seconds % self.bucket_seconds
+
+    def key(self, source_name, destination_name, depart_at, max_transfers):
+        return (
+            normalize_stop_name(source_name),
+            normalize_stop_name(destination_name),
+            self.bucket(depart_at),
+            max_transfers,
+        )
+
+    def get(self, tt, key):
+        with self.lock:
+            if tt is not self.timetable:
+                self.entries.clear()
+                self.timetable = tt
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, tt, key, value):
+        with self.lock:
+            if tt is not self.timetable:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'bucket_minutes': self.bucket_seconds // 60,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+route_cache = RouteCache(
+    max_entries=getattr(settings, 'ROUTE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+    ttl=getattr(settings, 'ROUTE_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS),
+    bucket_seconds=getattr(settings, 'ROUTE_CACHE_BUCKET_MINUTES', DEFAULT_BUCKET_MINUTES) * 60,
+)
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('home', '0001_initial'),
+        ('sroutes', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusTrip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('departure_time', models.TimeField()),
+                ('arrival_time', models.TimeField()),
+                ('gtfs_id', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('pattern', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='trips', to='sroutes.trippattern')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BusTripStopTime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('arrival_time', models.TimeField()),
+                ('departure_time', models.TimeField()),
+                ('stop_order', models.PositiveIntegerField()),
+                ('pattern', models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stop_times', to='sroutes.trippattern')),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.stop')),
+                ('trip', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stop_times', to='froutes.bustrip')),
+            ],
+            options={
+                'ordering': ['stop_order'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Favourite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route_identifier', models.CharField(max_length=100)),
+                ('source', models.CharField(blank=True, max_length=255, null=True)),
+                ('destination', models.CharField(blank=True, max_length=255, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bustrip',
+            index=models.Index(fields=['pattern', 'departure_time'], name='froutes_trip_pattern_dep'),
+        ),
+        migrations.AddIndex(
+            model_name='bustripstoptime',
+            index=models.Index(fields=['pattern', 'stop', 'departure_time'], name='froutes_stoptime_pat_stop_dep'),
+        ),
+        migrations.AddIndex(
+            model_name='bustripstoptime',
+            index=models.Index(fields=['trip', 'stop_order'], name='froutes_stoptime_trip_order'),
+        ),
+    ]
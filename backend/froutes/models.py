@@ -5,15 +5,44 @@ from sroutes.models import TripPattern
 # Create your models here.
 
 class BusTrip(models.Model):
-    pattern = models.ForeignKey(TripPattern, related_name="trips", on_delete=models.CASCADE)
+    # Indexed by the (pattern, departure_time) index below, which leads with it
+    pattern = models.ForeignKey(TripPattern, related_name="trips", on_delete=models.CASCADE, db_index=False)
     departure_time = models.TimeField()
     arrival_time = models.TimeField()
+    # trip_id in the GTFS feed this trip was imported from, so re-imports update it
+    gtfs_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pattern', 'departure_time'], name='froutes_trip_pattern_dep'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        trip = super().from_db(db, field_names, values)
+        trip._saved_pattern_id = trip.pattern_id
+        return trip
+
+    def save(self, *args, **kwargs):
+        # Only a stored trip moving to another pattern has stop times to follow it
+        moved = self.pk is not None and self.pattern_id != getattr(self, '_saved_pattern_id', None)
+        super().save(*args, **kwargs)
+        if moved:
+            # Keep the denormalized BusTripStopTime.pattern in step with the trip
+            self.stop_times.exclude(pattern_id=self.pattern_id).update(pattern_id=self.pattern_id)
+        self._saved_pattern_id = self.pattern_id
 
     def __str__(self):
         return f"{self.pattern} Trip @ {self.departure_time}"
     
 class BusTripStopTime(models.Model):
-    trip = models.ForeignKey(BusTrip, related_name="stop_times", on_delete=models.CASCADE)
+    # Indexed by the (trip, stop_order) index below, which leads with it
+    trip = models.ForeignKey(BusTrip, related_name="stop_times", on_delete=models.CASCADE, db_index=False)
+    # Copy of trip.pattern so departure lookups by pattern and stop skip the BusTrip join
+    pattern = models.ForeignKey(
+        TripPattern, related_name="stop_times", on_delete=models.CASCADE,
+        null=True, blank=True, editable=False, db_index=False
+    )
     stop = models.ForeignKey(Stop, on_delete=models.CASCADE)
     arrival_time = models.TimeField()
     departure_time = models.TimeField()
@@ -21,6 +50,15 @@ class BusTripStopTime(models.Model):
 
     class Meta:
         ordering = ['stop_order']
+        indexes = [
+            models.Index(fields=['pattern', 'stop', 'departure_time'], name='froutes_stoptime_pat_stop_dep'),
+            models.Index(fields=['trip', 'stop_order'], name='froutes_stoptime_trip_order'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.trip_id is not None:
+            self.pattern_id = self.trip.pattern_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.trip} - {self.stop.name} ({self.arrival_time}/{self.departure_time})"
@@ -0,0 +1,159 @@
+"""
+Round-based (RAPTOR) earliest-arrival search over a ``Timetable`` snapshot.
+
+Round ``k`` relaxes every pattern touched by a station improved in round
+``k - 1``, so after ``k`` rounds each station holds the earliest arrival
+reachable with at most ``k`` buses. A journey is kept only when it arrives
+strictly earlier than every journey with fewer buses, which yields the
+Pareto set over (arrival time, number of transfers).
+"""
+from dataclasses import dataclass
+
+INFINITY = 2 ** 31 - 1
+MAX_TRANSFERS = 4
+
+
+@dataclass(frozen=True)
+class Leg:
+    pattern: int
+    trip: int
+    board_pos: int
+    alight_pos: int
+    departure: int
+    arrival: int
+
+
+@dataclass(frozen=True)
+class Journey:
+    legs: tuple
+
+    @property
+    def departure(self):
+        return self.legs[0].departure
+
+    @property
+    def arrival(self):
+        return self.legs[-1].arrival
+
+    @property
+    def transfers(self):
+        return len(self.legs) - 1
+
+
+def plan(tt, source, target, depart_at, max_transfers=MAX_TRANSFERS, min_transfer_seconds=0):
+    """
+    Pareto-optimal journeys from station ``source`` to station ``target`` leaving
+    at or after ``depart_at`` (seconds since midnight), ordered by transfers.
+    """
+    if source == target:
+        return []
+
+    best = [INFINITY] * tt.n_stations
+    previous = [INFINITY] * tt.n_stations
+    previous[source] = best[source] = depart_at
+    marked = {source}
+    labels = [{}]
+    journeys = []
+
+    for k in range(1, max_transfers + 2):
+        queue = {}
+        for station in marked:
+            for p, pos in tt.patterns_at(station):
+                if pos < queue.get(p, INFINITY):
+                    queue[p] = pos
+
+        current = previous[:]
+        round_labels = {}
+        marked = set()
+        slack = min_transfer_seconds if k > 1 else 0
+
+        for p, first_pos in queue.items():
+            trip = board_pos = None
+            for pos in range(first_pos, tt.pattern_size(p)):
+                station = tt.stop_station[tt.pattern_stop(p, pos)]
+
+                if trip is not None:
+                    arrival = tt.arrival(p, trip, pos)
+                    if arrival < best[station] and arrival < best[target]:
+                        current[station] = best[station] = arrival
+                        round_labels[station] = (p, trip, board_pos, pos)
+                        marked.add(station)
+
+                ready = previous[station]
+                if ready == INFINITY:
+                    continue
+                if trip is None or ready + slack <= tt.departure(p, trip, pos):
+                    earlier = tt.earliest_trip(p, pos, ready + slack)
+                    if earlier is not None and (trip is None or earlier < trip):
+                        trip, board_pos = earlier, pos
+
+        labels.append(round_labels)
+        if target in round_labels:
+            journeys.append(_reconstruct(tt, labels, target, k))
+        if not marked:
+            break
+        previous = current
+
+    return journeys
+
+
+def _reconstruct(tt, labels, target, k):
+    legs = []
+    station = target
+    while True:
+        # A station keeps the label of the last round that improved it; the
+        # source is never labelled, which ends the walk back.
+        while k > 0 and station not in labels[k]:
+            k -= 1
+        if k == 0:
+            break
+        p, trip, board_pos, alight_pos = labels[k][station]
+        legs.append(Leg(
+            pattern=p,
+            trip=trip,
+            board_pos=board_pos,
+            alight_pos=alight_pos,
+            departure=tt.departure(p, trip, board_pos),
+            arrival=tt.arrival(p, trip, alight_pos),
+        ))
+        station = tt.stop_station[tt.pattern_stop(p, board_pos)]
+        k -= 1
+    return Journey(legs=tuple(reversed(legs)))
+
+
+# ----------------------
+# Reusing itineraries
+# ----------------------
+def itinerary(journey):
+    """The time-independent part of a journey: (pattern, board_pos, alight_pos) per leg."""
+    return tuple((leg.pattern, leg.board_pos, leg.alight_pos) for leg in journey.legs)
+
+
+def retime(tt, itineraries, depart_at, min_transfer_seconds=0):
+    """
+    Ride each itinerary on the earliest trips catchable from ``depart_at`` and
+    keep the Pareto set, as ``plan`` would. Itineraries that can no longer be
+    completed today are dropped.
+    """
+    journeys = []
+    for stops in sorted(itineraries, key=len):
+        legs = []
+        ready, slack = depart_at, 0
+        for p, board_pos, alight_pos in stops:
+            trip = tt.earliest_trip(p, board_pos, ready + slack)
+            if trip is None:
+                break
+            legs.append(Leg(
+                pattern=p,
+                trip=trip,
+                board_pos=board_pos,
+                alight_pos=alight_pos,
+                departure=tt.departure(p, trip, board_pos),
+                arrival=tt.arrival(p, trip, alight_pos),
+            ))
+            ready, slack = legs[-1].arrival, min_transfer_seconds
+        else:
+            journey = Journey(legs=tuple(legs))
+            if not journeys or journey.arrival < journeys[-1].arrival:
+                journeys.append(journey)
+    return journeys
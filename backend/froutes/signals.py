@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from home.models import Stop
+from home.search import invalidate_stop_search_index
+from sroutes.models import BusRoute, TripPattern, TripPatternStop, RouteShape, Fare, FareBand
+from .models import BusTrip, BusTripStopTime
+from .timetable import invalidate_timetable
+
+TIMETABLE_MODELS = [Stop, BusRoute, TripPattern, TripPatternStop, RouteShape, Fare, FareBand, BusTrip, BusTripStopTime]
+
+
+@receiver([post_save, post_delete], dispatch_uid='froutes.invalidate_timetable')
+def timetable_changed(sender, **kwargs):
+    if sender in TIMETABLE_MODELS:
+        invalidate_timetable()
+    if sender is TripPatternStop:
+        # Search ranking uses the number of routes serving each stop
+        invalidate_stop_search_index()
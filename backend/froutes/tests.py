@@ -1,3 +1,483 @@
-from django.test import TestCase
+import tempfile
+import time as time_module
+from array import array
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from home.models import Stop
+from sroutes.fares import band_fare, DEFAULT_BASE_FARE
+from sroutes.models import BusRoute, TripPattern, TripPatternStop, RouteShape, Fare, FareBand
+from sroutes.shapes import encode_polyline, EARTH_RADIUS_M
+from transport.cache import bump_timetable_version, timetable_version
+from transport.testing import isolated_cache
+from .models import BusTrip, BusTripStopTime
+from .memo import RouteCache, route_cache
+from .raptor import plan, itinerary, retime
+from .timetable import get_timetable, load_timetable, seconds_to_hhmm, Timetable, SNAPSHOT_ARRAYS, SECONDS_PER_DAY
+from .views import leg_shape
 
-# Create your tests here.
+
+def seconds(hhmm):
+    hours, minutes = map(int, hhmm.split(':'))
+    return hours * 3600 + minutes * 60
+
+
+def create_line(name, stop_names, departures, minutes_per_stop=10):
+    """A route over new stops named ``stop_names``, with one trip leaving at each "HH:MM" in ``departures``."""
+    stops = [Stop.objects.create(name=n, latitude=23.0 + i / 100, longitude=72.5) for i, n in enumerate(stop_names)]
+    route = BusRoute.objects.create(name=name, start_stop=stops[0], end_stop=stops[-1])
+    RouteShape.objects.create(route=route, coordinates=[[s.latitude, s.longitude] for s in stops])
+    Fare.objects.create(route=route, amount='10.00')
+    pattern = TripPattern.objects.create(route=route)
+    for order, stop in enumerate(stops, start=1):
+        TripPatternStop.objects.create(pattern=pattern, stop=stop, stop_order=order)
+    for departure in departures:
+        start = datetime.strptime(departure, '%H:%M')
+        times = [(start + timedelta(minutes=minutes_per_stop * i)).time() for i in range(len(stops))]
+        trip = BusTrip.objects.create(pattern=pattern, departure_time=times[0], arrival_time=times[-1])
+        for order, (stop, at) in enumerate(zip(stops, times), start=1):
+            BusTripStopTime.objects.create(trip=trip, stop=stop, stop_order=order, arrival_time=at, departure_time=at)
+    return route
+
+
+def create_network():
+    """
+    Alpha to Delta either directly on the slow 3D (08:05, arriving 09:05) or
+    on 1D to Gamma (08:00, arriving 08:20) and on to Delta by 2D (arriving 08:40).
+    """
+    create_line("1D", ["Alpha", "Beta", "Gamma"], ["08:00", "09:00"])
+    create_line("2D", ["Gamma", "Delta"], ["08:30"])
+    return create_line("3D", ["Alpha", "Delta"], ["08:05"], minutes_per_stop=60)
+
+
+@isolated_cache
+@override_settings(TIMETABLE_SNAPSHOT=None)
+class PlannerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.slow = create_network()
+
+    def plan(self, source, target, depart_at, **kwargs):
+        tt = get_timetable()
+        return plan(tt, tt.find_station(source), tt.find_station(target), seconds(depart_at), **kwargs)
+
+    def test_direct_journey(self):
+        [journey] = self.plan("Alpha", "Beta", "07:30")
+        self.assertEqual(journey.transfers, 0)
+        self.assertEqual((journey.departure, journey.arrival), (seconds("08:00"), seconds("08:10")))
+
+    def test_pareto_set_is_ordered_by_transfers(self):
+        direct, transfer = self.plan("Alpha", "Delta", "07:30")
+        self.assertEqual((direct.transfers, direct.arrival), (0, seconds("09:05")))
+        self.assertEqual((transfer.transfers, transfer.arrival), (1, seconds("08:40")))
+        self.assertEqual([leg.departure for leg in transfer.legs], [seconds("08:00"), seconds("08:30")])
+
+    def test_uncompletable_transfer_is_dropped(self):
+        # Missing the 08:00 1D also misses the only 2D, leaving the direct bus
+        [journey] = self.plan("Alpha", "Delta", "08:01")
+        self.assertEqual(journey.transfers, 0)
+
+    def test_max_transfers_limits_the_search(self):
+        [journey] = self.plan("Alpha", "Delta", "07:30", max_transfers=0)
+        self.assertEqual(journey.transfers, 0)
+        self.assertEqual(self.plan("Beta", "Delta", "07:30", max_transfers=0), [])
+
+    def test_minimum_transfer_time_is_respected(self):
+        self.assertEqual(len(self.plan("Beta", "Delta", "07:30", min_transfer_seconds=600)), 1)
+        self.assertEqual(self.plan("Beta", "Delta", "07:30", min_transfer_seconds=601), [])
+
+    def test_no_service_after_the_last_trip(self):
+        self.assertEqual(self.plan("Alpha", "Delta", "08:10"), [])
+
+    def test_stops_sharing_a_name_form_one_station(self):
+        tt = get_timetable()
+        gammas = Stop.objects.filter(name="Gamma")
+        self.assertEqual(len(gammas), 2)
+        self.assertEqual(len({tt.stop_station[tt.stop_index[stop.pk]] for stop in gammas}), 1)
+
+    def test_find_route_endpoint(self):
+        response = self.client.get(reverse('find_route'), {'source': "alpha", 'destination': "Delta", 'time': "07:30"})
+        self.assertEqual(response.status_code, 200)
+        direct, transfer = response.json()
+        self.assertEqual((direct['name'], direct['departure_time'], direct['arrival_time']), ("3D", "08:05", "09:05"))
+        self.assertFalse(direct['has_transfer'])
+        self.assertEqual(transfer['name'], "1D → 2D")
+        self.assertEqual(transfer['transfer_point'], "Gamma")
+        self.assertEqual((transfer['departure_time'], transfer['arrival_time']), ("08:00", "08:40"))
+        self.assertEqual(float(transfer['fare']), 20.0)
+
+    def test_find_route_requires_both_ends(self):
+        response = self.client.get(reverse('find_route'), {'source': "Alpha"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_model_save_rebuilds_the_timetable(self):
+        tt = get_timetable()
+        create_line("4D", ["Alpha", "Delta"], ["07:40"], minutes_per_stop=20)
+        self.assertIsNot(get_timetable(), tt)
+        [journey] = self.plan("Alpha", "Delta", "07:30")
+        self.assertEqual(journey.arrival, seconds("08:00"))
+
+    def test_version_bump_from_another_process_rebuilds_the_timetable(self):
+        tt = get_timetable()
+        self.client.get(reverse('find_route'), {'source': "Alpha", 'destination': "Delta", 'time': "07:30"})
+        # A bulk import elsewhere sends no signal here; only the shared version moves
+        pattern = self.slow.trip_patterns.get()
+        alpha, delta = [ps.stop for ps in pattern.pattern_stops.order_by('stop_order')]
+        trip = BusTrip.objects.bulk_create([
+            BusTrip(pattern=pattern, departure_time=time(7, 40), arrival_time=time(8, 0)),
+        ])[0]
+        BusTripStopTime.objects.bulk_create([
+            BusTripStopTime(trip=trip, pattern=pattern, stop=stop, stop_order=order, arrival_time=at, departure_time=at)
+            for order, (stop, at) in enumerate(((alpha, trip.departure_time), (delta, trip.arrival_time)), start=1)
+        ])
+        self.assertIs(get_timetable(), tt)
+
+        bump_timetable_version()
+        self.assertIsNot(get_timetable(), tt)
+        [journey] = self.plan("Alpha", "Delta", "07:30")
+        self.assertEqual((journey.departure, journey.arrival), (seconds("07:40"), seconds("08:00")))
+        response = self.client.get(reverse('find_route'), {'source': "Alpha", 'destination': "Delta", 'time': "07:30"})
+        self.assertEqual([route['arrival_time'] for route in response.json()], ["08:00"])
+
+
+@isolated_cache
+class SnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_network()
+        self.path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'timetable.bin'
+        self.enterContext(override_settings(TIMETABLE_SNAPSHOT=self.path))
+
+    def test_round_trip(self):
+        built = Timetable.from_database()
+        built.save(self.path, version=1)
+        loaded = Timetable.load(self.path)
+        self.assertEqual(loaded.version, 1)
+        for name in SNAPSHOT_ARRAYS:
+            self.assertEqual(list(getattr(loaded, name)), list(getattr(built, name)), name)
+        self.assertEqual(loaded.station_names, built.station_names)
+        self.assertEqual(loaded.routes.keys(), built.routes.keys())
+        source, target = loaded.find_station("Alpha"), loaded.find_station("Delta")
+        self.assertEqual(plan(loaded, source, target, seconds("07:30")), plan(built, source, target, seconds("07:30")))
+
+    def test_rejects_other_files(self):
+        self.path.write_bytes(b'not a timetable')
+        with self.assertRaises(ValueError):
+            Timetable.load(self.path)
+
+    def test_current_snapshot_is_mapped(self):
+        call_command('compile_timetable', stdout=StringIO())
+        self.assertIsInstance(get_timetable().arrivals, memoryview)
+
+    def test_stale_snapshot_falls_back_to_the_database(self):
+        call_command('compile_timetable', stdout=StringIO())
+        # Another process changed the timetable after the snapshot was compiled
+        bump_timetable_version()
+        with self.assertLogs('froutes.timetable', 'WARNING'):
+            tt = get_timetable()
+        self.assertIsInstance(tt.arrivals, array)
+        call_command('compile_timetable', stdout=StringIO())
+        self.assertIsInstance(load_timetable(timetable_version()).arrivals, memoryview)
+
+
+@isolated_cache
+@override_settings(TIMETABLE_SNAPSHOT=None)
+class RouteCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_network()
+
+    def test_retimed_itineraries_match_planning_up_to_the_first_departure(self):
+        tt = get_timetable()
+        source, target = tt.find_station("Alpha"), tt.find_station("Delta")
+        memo = RouteCache(max_entries=8, ttl=60, bucket_seconds=300)
+        journeys = plan(tt, source, target, memo.bucket(seconds("07:58")))
+        self.assertEqual(min(j.departure for j in journeys), seconds("08:00"))
+        itineraries = [itinerary(j) for j in journeys]
+        for minute in range(6):
+            depart_at = seconds("07:55") + minute * 60
+            self.assertEqual(retime(tt, itineraries, depart_at), plan(tt, source, target, depart_at))
+
+    def test_trip_leaving_inside_the_bucket_is_not_lost(self):
+        # The fast X at 08:00 dominates the slow Y at 08:03 from the bucket
+        # start, but a rider asking at 08:01 has only Y before X's 09:00 run
+        create_line("X", ["Omega", "Sigma"], ["08:00", "09:00"])
+        create_line("Y", ["Omega", "Sigma"], ["08:03"], minutes_per_stop=30)
+        url = reverse('find_route')
+        for hhmm in ("08:01", "08:00", "08:01"):
+            routes = self.client.get(url, {'source': "Omega", 'destination': "Sigma", 'time': hhmm}).json()
+            expected = ("X", "08:00", "08:10") if hhmm == "08:00" else ("Y", "08:03", "08:33")
+            self.assertEqual([(r['name'], r['departure_time'], r['arrival_time']) for r in routes], [expected], hhmm)
+
+    def test_key_rounds_down_to_the_bucket(self):
+        memo = RouteCache(max_entries=8, ttl=60, bucket_seconds=300)
+        self.assertEqual(memo.key(" alpha ", "DELTA", seconds("08:04"), 4), ("alpha", "delta", seconds("08:00"), 4))
+        self.assertNotEqual(memo.key("Alpha", "Delta", seconds("08:05"), 4), memo.key("Alpha", "Delta", seconds("08:04"), 4))
+
+    def test_entries_are_dropped_with_the_timetable(self):
+        memo = RouteCache(max_entries=8, ttl=60, bucket_seconds=300)
+        tt = get_timetable()
+        self.assertIsNone(memo.get(tt, 'key'))
+        memo.put(tt, 'key', ('itinerary',))
+        self.assertEqual(memo.get(tt, 'key'), ('itinerary',))
+
+        bump_timetable_version()
+        self.assertIsNone(memo.get(get_timetable(), 'key'))
+        # A put for the retired timetable is ignored
+        memo.put(tt, 'key', ('itinerary',))
+        self.assertIsNone(memo.get(get_timetable(), 'key'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        memo = RouteCache(max_entries=2, ttl=60, bucket_seconds=300)
+        tt = get_timetable()
+        for key, value in (('a', 1), ('b', 2)):
+            memo.get(tt, key)
+            memo.put(tt, key, value)
+        memo.get(tt, 'a')
+        memo.put(tt, 'c', 3)
+        self.assertIsNone(memo.get(tt, 'b'))
+        self.assertEqual((memo.get(tt, 'a'), memo.get(tt, 'c')), (1, 3))
+        self.assertEqual(memo.stats()['evictions'], 1)
+
+    def test_expired_entries_are_misses(self):
+        memo = RouteCache(max_entries=8, ttl=0, bucket_seconds=300)
+        tt = get_timetable()
+        memo.get(tt, 'key')
+        memo.put(tt, 'key', 1)
+        with mock.patch('froutes.memo.time.monotonic', return_value=time_module.monotonic() + 1):
+            self.assertIsNone(memo.get(tt, 'key'))
+        self.assertEqual(memo.stats()['expirations'], 1)
+
+    def test_find_route_hit_is_retimed(self):
+        url = reverse('find_route')
+        hits = route_cache.stats()['hits']
+        first = self.client.get(url, {'source': "Alpha", 'destination': "Delta", 'time': "07:55"}).json()
+        second = self.client.get(url, {'source': "Alpha", 'destination': "Delta", 'time': "07:59"}).json()
+        self.assertEqual(route_cache.stats()['hits'], hits + 1)
+        self.assertEqual(first, second)
+        self.assertEqual([r['departure_time'] for r in second], ["08:05", "08:00"])
+
+    def test_find_route_hit_after_the_first_departure_is_replanned(self):
+        url = reverse('find_route')
+        self.client.get(url, {'source': "Alpha", 'destination': "Delta", 'time': "08:00"})
+        routes = self.client.get(url, {'source': "Alpha", 'destination': "Delta", 'time': "08:03"}).json()
+        # 08:03 misses the 1D and with it the only 2D
+        self.assertEqual([r['departure_time'] for r in routes], ["08:05"])
+
+
+@isolated_cache
+@override_settings(TIMETABLE_SNAPSHOT=None)
+class MidnightTests(TestCase):
+    """N1 runs Night A, Night B, Night C ten minutes apart at 23:50 and 00:10."""
+
+    def setUp(self):
+        cache.clear()
+        self.route = create_line("N1", ["Night A", "Night B", "Night C"], ["23:50", "00:10"])
+        self.stops = {stop.name: stop for stop in Stop.objects.all()}
+
+    def departures(self, name, **params):
+        response = self.client.get(reverse('stop-departures', args=[self.stops[name].pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return [(d['departure_time'], d['next_day']) for d in response.json()['departures']]
+
+    def test_trip_past_midnight_keeps_increasing(self):
+        tt = get_timetable()
+        [journey] = plan(tt, tt.find_station("Night A"), tt.find_station("Night C"), seconds("23:45"))
+        self.assertEqual((journey.departure, journey.arrival), (seconds("23:50"), SECONDS_PER_DAY + seconds("00:10")))
+        self.assertEqual(seconds_to_hhmm(journey.arrival), "00:10")
+
+    def test_next_departures_wrap_to_the_next_day(self):
+        self.assertEqual(self.departures("Night A", time="23:55"), [("00:10", True), ("23:50", True)])
+        self.assertEqual(self.departures("Night A", time="23:45"), [("23:50", False), ("00:10", True)])
+        self.assertEqual(self.departures("Night A", time="00:00", limit=1), [("00:10", False)])
+
+    def test_stop_reached_after_midnight(self):
+        # The 23:50 trip leaves Night B at 00:00; the terminus has no departures
+        self.assertEqual(self.departures("Night B", time="23:55"), [("00:00", True), ("00:20", True)])
+        self.assertEqual(self.departures("Night C", time="23:55"), [])
+
+    def test_window_crosses_midnight(self):
+        self.assertEqual(self.departures("Night A", time="23:55", window=30), [("00:10", True)])
+        self.assertEqual(self.departures("Night A", time="23:55", window=10), [])
+        self.assertEqual(self.departures("Night A", time="23:45", window=30), [("23:50", False), ("00:10", True)])
+
+    def test_describe(self):
+        tt = get_timetable()
+        index = tt.departure_index
+        [(row, next_day)] = index.next_departures(tt.stop_index[self.stops["Night A"].pk], seconds("00:00"), 1)
+        self.assertEqual(index.describe(row, next_day), {
+            'trip_id': BusTrip.objects.get(departure_time=time(0, 10)).pk,
+            'route_id': self.route.pk,
+            'route': "N1",
+            'destination': "Night C",
+            'departure_time': "00:10",
+            'next_day': False,
+        })
+
+    def test_unknown_stop(self):
+        response = self.client.get(reverse('stop-departures', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse('stop-departures', args=[self.stops["Night A"].pk]), {'limit': "many"})
+        self.assertEqual(response.status_code, 400)
+
+
+class BusTripPatternTests(TestCase):
+    def setUp(self):
+        route = create_line("1D", ["Alpha", "Beta"], ["08:00"])
+        self.trip = BusTrip.objects.get()
+        self.other = TripPattern.objects.create(route=route)
+
+    def test_stop_times_follow_a_moved_trip(self):
+        self.trip.pattern = self.other
+        self.trip.save()
+        self.assertEqual(set(BusTripStopTime.objects.values_list('pattern_id', flat=True)), {self.other.pk})
+
+    def test_save_without_moving_skips_the_stop_times(self):
+        with self.assertNumQueries(1):
+            self.trip.save()
+        with self.assertNumQueries(1):
+            BusTrip.objects.create(pattern=self.other, departure_time=time(9, 0), arrival_time=time(9, 10))
+
+
+class BandFareTests(TestCase):
+    def test_band_limits_are_inclusive(self):
+        limits, amounts = [1000.0, 3000.0], [Decimal('5.00'), Decimal('12.00')]
+        self.assertEqual(band_fare(limits, amounts, 0), Decimal('5.00'))
+        self.assertEqual(band_fare(limits, amounts, 1000), Decimal('5.00'))
+        self.assertEqual(band_fare(limits, amounts, 1000.01), Decimal('12.00'))
+        self.assertEqual(band_fare(limits, amounts, 3000), Decimal('12.00'))
+        # Longer rides pay the last band
+        self.assertEqual(band_fare(limits, amounts, 50000), Decimal('12.00'))
+
+
+@isolated_cache
+@override_settings(TIMETABLE_SNAPSHOT=None)
+class LegFareTests(TestCase):
+    # Stops of a line are 0.01 degrees of latitude (about 1112 m) apart along its shape
+    def setUp(self):
+        cache.clear()
+        self.routes = {
+            "1D": create_line("1D", ["Alpha", "Beta", "Gamma"], ["08:00"]),
+            "2D": create_line("2D", ["Gamma", "Delta"], ["08:30"]),
+        }
+
+    def fare(self, route, board, alight):
+        tt = get_timetable()
+        [p] = [p for p in range(len(tt.pattern_route)) if tt.pattern_route[p] == self.routes[route].pk]
+        return tt.leg_fare(p, board, alight)
+
+    def test_flat_fare_without_bands(self):
+        self.assertEqual(self.fare("1D", 0, 2), Decimal('10.00'))
+        Fare.objects.filter(route=self.routes["1D"]).delete()
+        self.assertEqual(self.fare("1D", 0, 2), DEFAULT_BASE_FARE)
+
+    def test_network_bands(self):
+        FareBand.objects.create(max_distance_km='1.20', amount='5.00')
+        FareBand.objects.create(max_distance_km='2.00', amount='8.00')
+        self.assertEqual(self.fare("1D", 0, 1), Decimal('5.00'))
+        self.assertEqual(self.fare("1D", 1, 2), Decimal('5.00'))
+        # 2.2 km is past the last band, which caps the fare
+        self.assertEqual(self.fare("1D", 0, 2), Decimal('8.00'))
+        self.assertEqual(self.fare("2D", 0, 1), Decimal('5.00'))
+
+    def test_band_boundaries(self):
+        # Stored offsets put Beta exactly on the first limit
+        pattern = self.routes["1D"].trip_patterns.get()
+        for order, distance in ((1, 0.0), (2, 1000.0), (3, 1000.5)):
+            pattern.pattern_stops.filter(stop_order=order).update(shape_index=order - 1, shape_distance_m=distance)
+        FareBand.objects.create(max_distance_km='1.00', amount='5.00')
+        FareBand.objects.create(max_distance_km='2.00', amount='8.00')
+        self.assertEqual(self.fare("1D", 0, 1), Decimal('5.00'))
+        self.assertEqual(self.fare("1D", 0, 2), Decimal('8.00'))
+        self.assertEqual(self.fare("1D", 1, 2), Decimal('5.00'))
+
+    def test_route_bands_override_network_bands(self):
+        FareBand.objects.create(max_distance_km='5.00', amount='5.00')
+        FareBand.objects.create(route=self.routes["2D"], max_distance_km='5.00', amount='7.00')
+        self.assertEqual(self.fare("1D", 0, 2), Decimal('5.00'))
+        self.assertEqual(self.fare("2D", 0, 1), Decimal('7.00'))
+
+    def test_route_bands_without_network_bands(self):
+        FareBand.objects.create(route=self.routes["2D"], max_distance_km='5.00', amount='7.00')
+        self.assertEqual(self.fare("2D", 0, 1), Decimal('7.00'))
+        self.assertEqual(self.fare("1D", 0, 2), Decimal('10.00'))
+
+    def test_find_route_prices_each_leg(self):
+        FareBand.objects.create(max_distance_km='1.20', amount='5.00')
+        FareBand.objects.create(max_distance_km='3.00', amount='8.00')
+        FareBand.objects.create(route=self.routes["2D"], max_distance_km='5.00', amount='7.00')
+        response = self.client.get(reverse('find_route'), {'source': "Alpha", 'destination': "Delta", 'time': "07:30"})
+        [journey] = response.json()
+        self.assertEqual([Decimal(fare) for fare in journey['leg_fares']], [Decimal('8.00'), Decimal('7.00')])
+        self.assertEqual(Decimal(journey['fare']), Decimal('15.00'))
+
+
+@isolated_cache
+@override_settings(TIMETABLE_SNAPSHOT=None)
+class LegShapeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        route = create_line("1D", ["Alpha", "Beta", "Gamma"], ["08:00"])
+        # Two shape vertices between each pair of stops
+        self.shape = [[23.0 + i / 300, 72.5 + (i % 3) / 10000] for i in range(7)]
+        RouteShape.objects.filter(route=route).update(coordinates=self.shape)
+        self.pattern = route.trip_patterns.get()
+
+    def leg(self, source, target):
+        tt = get_timetable()
+        [journey] = plan(tt, tt.find_station(source), tt.find_station(target), seconds("07:30"))
+        [leg] = journey.legs
+        return tt, leg
+
+    def test_stops_are_projected_onto_the_shape(self):
+        tt, leg = self.leg("Alpha", "Gamma")
+        self.assertEqual([tt.shape_index(leg.pattern, pos) for pos in range(3)], [0, 3, 6])
+        self.assertEqual(leg_shape(tt, leg), self.shape)
+        tt, leg = self.leg("Beta", "Gamma")
+        self.assertEqual(leg_shape(tt, leg), self.shape[3:])
+        self.assertEqual(leg_shape(tt, leg, polyline=True), encode_polyline(np.array(self.shape[3:])))
+
+    def test_stops_out_of_order_along_the_shape(self):
+        # Beta sits past Gamma on the shape, so the Beta to Gamma leg runs backwards along it
+        for order, index in ((1, 0), (2, 5), (3, 2)):
+            self.pattern.pattern_stops.filter(stop_order=order).update(shape_index=index, shape_distance_m=index * 370.0)
+        tt, leg = self.leg("Alpha", "Beta")
+        self.assertEqual(leg_shape(tt, leg), self.shape[:6])
+        tt, leg = self.leg("Beta", "Gamma")
+        self.assertEqual(leg_shape(tt, leg), self.shape[2:6][::-1])
+        self.assertEqual(tt.leg_fare(leg.pattern, leg.board_pos, leg.alight_pos), Decimal('10.00'))
+
+    def test_route_without_a_shape(self):
+        RouteShape.objects.all().delete()
+        tt, leg = self.leg("Alpha", "Gamma")
+        self.assertEqual(leg_shape(tt, leg), [])
+        self.assertEqual(leg_shape(tt, leg, polyline=True), '')
+
+    def test_stored_offsets_are_used_as_is(self):
+        for order, index, distance in ((1, 0, 0.0), (2, 4, 1234.5), (3, 6, 2500.0)):
+            self.pattern.pattern_stops.filter(stop_order=order).update(shape_index=index, shape_distance_m=distance)
+        tt, leg = self.leg("Alpha", "Gamma")
+        self.assertEqual([tt.shape_index(leg.pattern, pos) for pos in range(3)], [0, 4, 6])
+        self.assertEqual(tt.shape_distance(leg.pattern, 1), 1234.5)
+
+    def test_distances_without_a_shape_run_stop_to_stop(self):
+        RouteShape.objects.all().delete()
+        tt, leg = self.leg("Alpha", "Gamma")
+        distances = [tt.shape_distance(leg.pattern, pos) for pos in range(3)]
+        self.assertEqual(distances[0], 0.0)
+        self.assertAlmostEqual(distances[2], 2 * distances[1], places=0)
+        self.assertAlmostEqual(distances[1], EARTH_RADIUS_M * np.radians(0.01))
+
+    def test_find_route_returns_the_leg_shape(self):
+        response = self.client.get(reverse('find_route'), {'source': "Beta", 'destination': "Gamma", 'time': "07:30"})
+        [route] = response.json()
+        self.assertEqual(route['shape'], self.shape[3:])
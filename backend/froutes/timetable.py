@@ -0,0 +1,465 @@
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+from array import array
+from decimal import Decimal
+from functools import cached_property
+
+import numpy as np
+from django.conf import settings
+
+from home.models import Stop
+from sroutes.fares import band_fare, DEFAULT_BASE_FARE
+from sroutes.models import BusRoute, TripPattern, TripPatternStop, RouteShape, Fare, FareBand
+from sroutes.shapes import shape_array, project_stops, cumulative_distances
+from transport.cache import timetable_version
+from .models import BusTrip, BusTripStopTime
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+SNAPSHOT_MAGIC = b'PTTTBL01'
+SNAPSHOT_ALIGN = 8
+# Flat arrays written to (and mapped back from) a compiled snapshot, in file order
+SNAPSHOT_ARRAYS = (
+    'stop_ids', 'stop_station', 'stop_lat', 'stop_lng',
+    'pattern_ids', 'pattern_route', 'pattern_stop_offset', 'pattern_stops',
+    'pattern_shape_index', 'pattern_shape_distance', 'pattern_trip_offset', 'pattern_time_offset',
+    'trip_ids', 'arrivals', 'departures',
+    'station_pattern_offset', 'station_patterns', 'station_positions',
+)
+
+
+def normalize_stop_name(name):
+    return ' '.join(name.lower().split())
+
+
+def time_to_seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def seconds_to_hhmm(seconds):
+    seconds %= SECONDS_PER_DAY
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}"
+
+
+# ----------------------
+# Timetable snapshot
+# ----------------------
+class Timetable:
+    """
+    Read-only, array-backed copy of the timetable used by the journey planner.
+
+    Stops sharing a (normalized) name are grouped into one station, which is
+    where riders may change buses. Every pattern owns a contiguous slice of
+    the pattern-stop arrays and a trip-major block of stop times, so the
+    arrival/departure of local trip ``t`` at position ``i`` of pattern ``p``
+    lives at ``pattern_time_offset[p] + t * n_stops(p) + i``. Times are
+    seconds since midnight and keep increasing along a trip, so a trip that
+    runs past midnight reports values above ``SECONDS_PER_DAY``.
+
+    Route shapes are kept as float64 arrays and every pattern stop carries
+    its vertex on the route's shape and its distance along it, as stored by
+    the importer (or projected here for rows imported without them). Slicing
+    a leg's geometry is a lookup in ``pattern_shape_index`` (-1 when the
+    route has no shape).
+
+    Fares are priced per leg from those distances: ``fare_bands`` maps a
+    route id (or None for the network-wide table) to band limits in meters
+    and their amounts, so a leg costs one bisect. Routes without bands pay
+    their flat ``Fare``.
+
+    ``save`` writes the arrays to a compact binary file and ``load`` maps one
+    back read-only, so worker processes share a compiled snapshot through the
+    page cache instead of each rebuilding it from the ORM.
+    """
+
+    def __init__(self):
+        self.stop_ids = array('i')
+        self.stop_station = array('i')
+        self.stop_lat = array('d')
+        self.stop_lng = array('d')
+        self.stop_index = {}
+
+        self.station_names = []
+        self.station_index = {}
+
+        self.pattern_ids = array('i')
+        self.pattern_route = array('i')
+        self.pattern_stop_offset = array('i', [0])
+        self.pattern_stops = array('i')
+        self.pattern_shape_index = array('i')
+        self.pattern_shape_distance = array('d')
+        self.pattern_trip_offset = array('i', [0])
+        self.pattern_time_offset = array('i', [0])
+
+        self.trip_ids = array('i')
+        self.arrivals = array('i')
+        self.departures = array('i')
+
+        self.station_pattern_offset = array('i', [0])
+        self.station_patterns = array('i')
+        self.station_positions = array('i')
+
+        self.routes = {}
+        self.fare_bands = {}
+
+    # ----------------------
+    # Building
+    # ----------------------
+    @classmethod
+    def from_database(cls):
+        tt = cls()
+
+        for stop_id, name, lat, lng in Stop.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude'):
+            key = normalize_stop_name(name)
+            station = tt.station_index.get(key)
+            if station is None:
+                station = tt.station_index[key] = len(tt.station_names)
+                tt.station_names.append(name)
+            tt.stop_index[stop_id] = len(tt.stop_ids)
+            tt.stop_ids.append(stop_id)
+            tt.stop_station.append(station)
+            tt.stop_lat.append(lat)
+            tt.stop_lng.append(lng)
+
+        fares = {}
+        for route_id, amount in Fare.objects.order_by('id').values_list('route_id', 'amount'):
+            fares.setdefault(route_id, amount)
+        shapes = dict(RouteShape.objects.values_list('route_id', 'coordinates'))
+        for route_id, name in BusRoute.objects.values_list('id', 'name'):
+            tt.routes[route_id] = {
+                'name': name,
+                'fare': fares.get(route_id),
+                'shape': shape_array(shapes.get(route_id) or []),
+            }
+        for route_id, max_km, amount in FareBand.objects.order_by('route_id', 'max_distance_km').values_list(
+            'route_id', 'max_distance_km', 'amount'
+        ):
+            limits, amounts = tt.fare_bands.setdefault(route_id, ([], []))
+            limits.append(float(max_km) * 1000)
+            amounts.append(amount)
+
+        pattern_stops = {}
+        for pattern_id, *row in TripPatternStop.objects.order_by('pattern_id', 'stop_order').values_list(
+            'pattern_id', 'stop_id', 'shape_index', 'shape_distance_m'
+        ):
+            pattern_stops.setdefault(pattern_id, []).append(row)
+
+        trips = {}
+        for trip_id, stop_id, arrival, departure in (
+            BusTripStopTime.objects.order_by('trip_id', 'stop_order')
+            .values_list('trip_id', 'stop_id', 'arrival_time', 'departure_time')
+            .iterator(chunk_size=10000)
+        ):
+            trips.setdefault(trip_id, []).append((stop_id, time_to_seconds(arrival), time_to_seconds(departure)))
+
+        pattern_trips = {}
+        for trip_id, pattern_id in BusTrip.objects.values_list('id', 'pattern_id'):
+            pattern_trips.setdefault(pattern_id, []).append(trip_id)
+
+        for pattern_id, route_id in TripPattern.objects.order_by('id').values_list('id', 'route_id'):
+            rows = [row for row in pattern_stops.get(pattern_id, []) if row[0] in tt.stop_index]
+            if len(rows) < 2:
+                continue
+            stop_ids = [row[0] for row in rows]
+            offsets = [row[1:] for row in rows]
+            trip_rows = []
+            for trip_id in pattern_trips.get(pattern_id, []):
+                times = trips.get(trip_id)
+                # Trips that do not follow the pattern's stop sequence cannot be scanned positionally.
+                if not times or [t[0] for t in times] != stop_ids:
+                    continue
+                trip_rows.append((_unwrap_midnight(times), trip_id))
+            if trip_rows:
+                tt._add_pattern(pattern_id, route_id, stop_ids, offsets, sorted(trip_rows))
+
+        tt._index_stations()
+        return tt
+
+    def _add_pattern(self, pattern_id, route_id, stop_ids, offsets, rows):
+        self.pattern_ids.append(pattern_id)
+        self.pattern_route.append(route_id)
+        self.pattern_stops.extend(self.stop_index[s] for s in stop_ids)
+        if any(index is None for index, _ in offsets):
+            offsets = self._project_on_shape(route_id, stop_ids)
+        if any(distance is None for _, distance in offsets):
+            # No shape to measure along: fall back to straight lines between stops
+            stops = shape_array([self.stop_coordinates(self.stop_index[s]) for s in stop_ids])
+            offsets = [(index, float(d)) for (index, _), d in zip(offsets, cumulative_distances(stops))]
+        for index, distance in offsets:
+            self.pattern_shape_index.append(-1 if index is None else index)
+            self.pattern_shape_distance.append(0.0 if distance is None else distance)
+        self.pattern_stop_offset.append(len(self.pattern_stops))
+        for times, trip_id in rows:
+            self.trip_ids.append(trip_id)
+            self.arrivals.extend(t[0] for t in times)
+            self.departures.extend(t[1] for t in times)
+        self.pattern_trip_offset.append(len(self.trip_ids))
+        self.pattern_time_offset.append(len(self.arrivals))
+
+    def _project_on_shape(self, route_id, stop_ids):
+        stops = [self.stop_coordinates(self.stop_index[s]) for s in stop_ids]
+        return project_stops(self.routes[route_id]['shape'], stops)
+
+    def _index_stations(self):
+        serving = [[] for _ in self.station_names]
+        for p in range(self.n_patterns):
+            start, end = self.pattern_stop_offset[p], self.pattern_stop_offset[p + 1]
+            for pos in range(end - start):
+                serving[self.stop_station[self.pattern_stops[start + pos]]].append((p, pos))
+        for entries in serving:
+            for p, pos in entries:
+                self.station_patterns.append(p)
+                self.station_positions.append(pos)
+            self.station_pattern_offset.append(len(self.station_patterns))
+
+    # ----------------------
+    # Binary snapshot
+    # ----------------------
+    def save(self, path, version=None):
+        """
+        Write the timetable to ``path``: the magic, a little JSON header
+        (timetable version, names, fares, array locations) and then every
+        array, 8-byte aligned and in native byte order. The file is replaced
+        atomically, so workers that mapped the previous snapshot keep reading
+        it undisturbed.
+        """
+        shapes, shape_offsets = [], {}
+        offset = 0
+        for route_id, route in self.routes.items():
+            points = route['shape']
+            shape_offsets[route_id] = (offset, len(points))
+            shapes.append(points)
+            offset += len(points)
+        blobs = [(name, getattr(self, name)) for name in SNAPSHOT_ARRAYS]
+        blobs.append(('shape_points', np.concatenate(shapes) if shapes else np.empty((0, 2))))
+
+        layout, position = {}, 0
+        for name, values in blobs:
+            data = memoryview(values).cast('B')
+            layout[name] = [_typecode(values), position, data.nbytes]
+            position += _padding(data.nbytes)
+        header = json.dumps({
+            'byteorder': sys.byteorder,
+            'version': version,
+            'arrays': layout,
+            'station_names': self.station_names,
+            'fare_bands': [
+                [route_id, limits, [str(a) for a in amounts]]
+                for route_id, (limits, amounts) in self.fare_bands.items()
+            ],
+            'routes': [
+                [route_id, route['name'], None if route['fare'] is None else str(route['fare']), *shape_offsets[route_id]]
+                for route_id, route in self.routes.items()
+            ],
+        }).encode()
+
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            f.write(b'\0' * (_padding(f.tell()) - f.tell()))
+            for name, values in blobs:
+                data = memoryview(values).cast('B')
+                f.write(data)
+                f.write(b'\0' * (_padding(data.nbytes) - data.nbytes))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot written by ``save`` read-only. The arrays become
+        memoryviews over the mapping, so loading copies nothing but the
+        header and the stop and station lookup dicts.
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a timetable snapshot")
+        start = len(SNAPSHOT_MAGIC) + 8
+        size = int.from_bytes(buf[len(SNAPSHOT_MAGIC):start], 'little')
+        header = json.loads(buf[start:start + size])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was compiled on a {header['byteorder']}-endian machine")
+        base = _padding(start + size)
+
+        tt = cls.__new__(cls)
+        tt.version = header.get('version')
+        view = memoryview(buf)
+        for name, (typecode, offset, nbytes) in header['arrays'].items():
+            setattr(tt, name, view[base + offset:base + offset + nbytes].cast(typecode))
+        points = np.frombuffer(tt.__dict__.pop('shape_points'), dtype=np.float64).reshape(-1, 2)
+
+        tt.stop_index = {stop_id: i for i, stop_id in enumerate(tt.stop_ids)}
+        tt.station_names = header['station_names']
+        tt.station_index = {}
+        for i, name in enumerate(tt.station_names):
+            tt.station_index.setdefault(normalize_stop_name(name), i)
+        tt.routes = {
+            route_id: {
+                'name': name,
+                'fare': None if fare is None else Decimal(fare),
+                'shape': points[offset:offset + count],
+            }
+            for route_id, name, fare, offset, count in header['routes']
+        }
+        tt.fare_bands = {
+            route_id: (limits, [Decimal(a) for a in amounts])
+            for route_id, limits, amounts in header['fare_bands']
+        }
+        return tt
+
+    # ----------------------
+    # Lookups
+    # ----------------------
+    @property
+    def n_stations(self):
+        return len(self.station_names)
+
+    @property
+    def n_patterns(self):
+        return len(self.pattern_ids)
+
+    @cached_property
+    def trip_routes(self):
+        """Route id of every trip id in the timetable."""
+        return {
+            self.trip_ids[t]: self.pattern_route[p]
+            for p in range(self.n_patterns)
+            for t in range(self.pattern_trip_offset[p], self.pattern_trip_offset[p + 1])
+        }
+
+    @cached_property
+    def departure_index(self):
+        from .departures import DepartureIndex
+        return DepartureIndex(self)
+
+    def find_station(self, name):
+        return self.station_index.get(normalize_stop_name(name))
+
+    def patterns_at(self, station):
+        start, end = self.station_pattern_offset[station], self.station_pattern_offset[station + 1]
+        return zip(self.station_patterns[start:end], self.station_positions[start:end])
+
+    def pattern_size(self, p):
+        return self.pattern_stop_offset[p + 1] - self.pattern_stop_offset[p]
+
+    def pattern_stop(self, p, pos):
+        """Dense stop index of position ``pos`` in pattern ``p``."""
+        return self.pattern_stops[self.pattern_stop_offset[p] + pos]
+
+    def shape_index(self, p, pos):
+        return self.pattern_shape_index[self.pattern_stop_offset[p] + pos]
+
+    def shape_distance(self, p, pos):
+        return self.pattern_shape_distance[self.pattern_stop_offset[p] + pos]
+
+    def leg_fare(self, p, board_pos, alight_pos):
+        """Fare for riding pattern ``p`` from ``board_pos`` to ``alight_pos``."""
+        route_id = self.pattern_route[p]
+        bands = self.fare_bands.get(route_id) or self.fare_bands.get(None)
+        if bands:
+            distance = self.shape_distance(p, alight_pos) - self.shape_distance(p, board_pos)
+            return band_fare(*bands, abs(distance))
+        return self.routes[route_id]['fare'] or DEFAULT_BASE_FARE
+
+    def trip_count(self, p):
+        return self.pattern_trip_offset[p + 1] - self.pattern_trip_offset[p]
+
+    def trip_id(self, p, t):
+        return self.trip_ids[self.pattern_trip_offset[p] + t]
+
+    def arrival(self, p, t, pos):
+        return self.arrivals[self.pattern_time_offset[p] + t * self.pattern_size(p) + pos]
+
+    def departure(self, p, t, pos):
+        return self.departures[self.pattern_time_offset[p] + t * self.pattern_size(p) + pos]
+
+    def earliest_trip(self, p, pos, not_before, start=0):
+        """First local trip index of ``p`` leaving ``pos`` at or after ``not_before``, or None."""
+        n = self.pattern_size(p)
+        base = self.pattern_time_offset[p] + pos
+        lo, hi = start, self.trip_count(p)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.departures[base + mid * n] < not_before:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.trip_count(p) else None
+
+    def stop_coordinates(self, stop):
+        return [self.stop_lat[stop], self.stop_lng[stop]]
+
+
+def _typecode(values):
+    return values.typecode if isinstance(values, array) else memoryview(values).format
+
+
+def _padding(n):
+    return -(-n // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+
+def _unwrap_midnight(times):
+    unwrapped, offset, last = [], 0, 0
+    for _, arrival, departure in times:
+        if arrival + offset < last:
+            offset += SECONDS_PER_DAY
+        arrival += offset
+        departure += offset
+        if departure < arrival:
+            departure += SECONDS_PER_DAY
+            offset += SECONDS_PER_DAY
+        unwrapped.append((arrival, departure))
+        last = departure
+    return unwrapped
+
+
+# ----------------------
+# Process-local cache
+# ----------------------
+_lock = threading.Lock()
+_timetable = None
+_version = None
+
+
+def get_timetable():
+    """
+    The process's timetable, rebuilt when the shared timetable version moves
+    so imports and edits made by other processes are picked up.
+    """
+    global _timetable, _version
+    version = timetable_version()
+    tt = _timetable
+    if tt is None or _version != version:
+        with _lock:
+            if _timetable is None or _version != version:
+                _timetable = load_timetable(version)
+                _version = version
+            tt = _timetable
+    return tt
+
+
+def load_timetable(version):
+    """
+    The compiled snapshot if it was compiled at timetable ``version``,
+    otherwise a fresh build from the ORM.
+    """
+    path = getattr(settings, 'TIMETABLE_SNAPSHOT', None)
+    if path and os.path.exists(path):
+        tt = Timetable.load(path)
+        if tt.version == version:
+            return tt
+        logger.warning("%s is out of date; building the timetable from the database (run compile_timetable)", path)
+    return Timetable.from_database()
+
+
+def invalidate_timetable(**kwargs):
+    global _timetable
+    _timetable = None
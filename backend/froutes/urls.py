@@ -4,6 +4,8 @@ from . import views
 
 urlpatterns = [
      path('find_route/', views.find_routes, name='find_route'),
+     path('find_route/cache-stats/', views.route_cache_stats, name='find-route-cache-stats'),
+     path('stops/<int:pk>/departures/', views.stop_departures, name='stop-departures'),
      path('favourites/', views.FavouriteListCreateView.as_view(), name='favourites-list-create'),
      path('favourites/<int:pk>/', views.FavouriteDetailView.as_view(), name='favourites-detail'),
      path('favourites/user/', views.UserFavouritesView.as_view(), name='user-favourites'),
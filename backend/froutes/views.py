@@ -1,30 +1,113 @@
 
-from geopy.distance import geodesic
+from home.search import get_stop_search_index
+from sroutes.shapes import shape_format, render_shape
 from rest_framework.decorators import api_view , permission_classes
 from rest_framework.response import Response
 from datetime import datetime
+from decimal import Decimal
 from django.utils import timezone
-from sroutes.models import BusRoute
-from .models import BusTripStopTime ,Favourite
+from .models import Favourite
+from .memo import route_cache
+from .raptor import plan, itinerary, retime, INFINITY, MAX_TRANSFERS
+from .timetable import get_timetable, time_to_seconds, seconds_to_hhmm
 from .serializers import FavouriteSerializer
 from rest_framework import generics
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 # Create your views here.
-def get_shape_segment(shape_coords, source_coord, dest_coord):
-    start_idx = min(range(len(shape_coords)), key=lambda i: geodesic(shape_coords[i], source_coord).meters)
-    end_idx = min(range(len(shape_coords)), key=lambda i: geodesic(shape_coords[i], dest_coord).meters)
-    if start_idx > end_idx:
-        start_idx, end_idx = end_idx, start_idx
-    return shape_coords[start_idx:end_idx + 1]
+NEXT_BUSES_PER_LEG = 3
+
+
+def next_buses(tt, leg, ready_at, count=NEXT_BUSES_PER_LEG):
+    first = tt.earliest_trip(leg.pattern, leg.board_pos, ready_at)
+    if first is None:
+        return []
+    return [
+        {
+            'trip_id': tt.trip_id(leg.pattern, t),
+            'departure_time': seconds_to_hhmm(tt.departure(leg.pattern, t, leg.board_pos)),
+            'arrival_time': seconds_to_hhmm(tt.arrival(leg.pattern, t, leg.board_pos)),
+        }
+        for t in range(first, min(first + count, tt.trip_count(leg.pattern)))
+    ]
+
+
+def leg_shape(tt, leg, polyline=False, tolerance=0.0):
+    points = tt.routes[tt.pattern_route[leg.pattern]]['shape']
+    start_idx = tt.shape_index(leg.pattern, leg.board_pos)
+    end_idx = tt.shape_index(leg.pattern, leg.alight_pos)
+    if start_idx < 0 or end_idx < 0:
+        return '' if polyline else []
+    if start_idx <= end_idx:
+        points = points[start_idx:end_idx + 1]
+    else:
+        # The stops come out of order along the shape; still draw from the boarding stop
+        points = points[end_idx:start_idx + 1][::-1]
+    return render_shape(points, polyline, tolerance)
+
+
+def serialize_journey(tt, journey, depart_at, polyline=False, tolerance=0.0):
+    legs = journey.legs
+    routes = [tt.pattern_route[leg.pattern] for leg in legs]
+    names = [tt.routes[r]['name'] for r in routes]
+    boards = [tt.pattern_stop(leg.pattern, leg.board_pos) for leg in legs]
+    alights = [tt.pattern_stop(leg.pattern, leg.alight_pos) for leg in legs]
+
+    buses = []
+    ready_at = depart_at
+    for leg in legs:
+        buses += next_buses(tt, leg, ready_at)
+        ready_at = leg.arrival
+
+    leg_fares = [tt.leg_fare(leg.pattern, leg.board_pos, leg.alight_pos) for leg in legs]
+    if len(legs) == 1:
+        shape = leg_shape(tt, legs[0], polyline, tolerance)
+    else:
+        shape = [leg_shape(tt, leg, polyline, tolerance) for leg in legs]
+
+    result = {
+        "id": routes[0],
+        "name": " → ".join(names),
+        "fare": sum(leg_fares, Decimal('0.00')),
+        "leg_fares": leg_fares,
+        "has_transfer": len(legs) > 1,
+        "transfers": journey.transfers,
+        "departure_time": seconds_to_hhmm(journey.departure),
+        "arrival_time": seconds_to_hhmm(journey.arrival),
+        "source_coordinates": tt.stop_coordinates(boards[0]),
+        "destination_coordinates": tt.stop_coordinates(alights[-1]),
+        "shape": shape,
+        "transfer_point": None,
+        "next_buses": buses,
+    }
+    if len(legs) > 1:
+        transfer_names = [tt.station_names[tt.stop_station[stop]] for stop in boards[1:]]
+        result.update({
+            "sr_bus": names[0],
+            "dr_name": names[1],
+            "second_leg_id": routes[1],
+            "transfer_point": transfer_names[0],
+            "transfer_points": transfer_names,
+            "transfer_coordinates": tt.stop_coordinates(boards[1]),
+        })
+    return result
+
+
+def resolve_station(tt, name):
+    """Station for an exact stop name, falling back to the best fuzzy match."""
+    station = tt.find_station(name)
+    if station is None:
+        stop = get_stop_search_index().resolve(name)
+        if stop is not None:
+            station = tt.find_station(stop['name'])
+    return station
+
 
 @api_view(['GET'])
 def find_routes(request):
     source_name = request.GET.get('source', '').strip()
     destination_name = request.GET.get('destination', '').strip()
     selected_time_str = request.GET.get('time', '')  # HH:MM
-    
-    print(selected_time_str)
 
     if not source_name or not destination_name:
         return Response({"error": "Source and destination are required."}, status=400)
@@ -33,186 +116,48 @@ def find_routes(request):
     try:
         if selected_time_str:
             selected_time = datetime.strptime(selected_time_str, '%H:%M').time()
-            print('if st',selected_time)
         else:
             selected_time = timezone.localtime(timezone.now()).time()
-            print('else st',selected_time)
-    except:
+    except ValueError:
         selected_time = timezone.localtime(timezone.now()).time()
-        print('except st',selected_time)
-        
 
-    print('st',selected_time)
-    valid_routes = []
+    try:
+        max_transfers = int(request.GET.get('max_transfers', MAX_TRANSFERS))
+    except ValueError:
+        return Response({"error": "max_transfers must be an integer."}, status=400)
 
     try:
-        # STEP 1 — DIRECT ROUTES
-        routes = BusRoute.objects.filter(
-            trip_patterns__pattern_stops__stop__name__icontains=source_name
-        ).filter(
-            trip_patterns__pattern_stops__stop__name__icontains=destination_name
-        ).distinct()
-
-        for route in routes:
-            for pattern in route.trip_patterns.all():
-                stops = list(pattern.pattern_stops.order_by('stop_order'))
-
-                try:
-                    source_index = next(i for i, ps in enumerate(stops) if ps.stop.name.lower() == source_name.lower())
-                    dest_index = next(i for i, ps in enumerate(stops) if ps.stop.name.lower() == destination_name.lower())
-                except StopIteration:
-                    continue
-
-                if source_index < dest_index:
-                    # Find next 2–3 buses after selected_time
-                    upcoming_trips = BusTripStopTime.objects.filter(
-                        trip__pattern=pattern,
-                        stop=stops[source_index].stop,
-                        departure_time__gte=selected_time
-                    ).order_by('departure_time')[:3]
-
-                    next_buses = [
-                        {
-                            'trip_id': trip.trip.id,
-                            'departure_time': trip.departure_time.strftime('%H:%M'),
-                            'arrival_time': trip.arrival_time.strftime('%H:%M')
-                        } for trip in upcoming_trips
-                    ]
-
-                    shape_coords = []
-                    if getattr(route, 'shape', None) and getattr(route.shape, 'coordinates', None):
-                        try:
-                            shape_coords = get_shape_segment(
-                                route.shape.coordinates,
-                                [stops[source_index].stop.latitude, stops[source_index].stop.longitude],
-                                [stops[dest_index].stop.latitude, stops[dest_index].stop.longitude]
-                            )
-                        except:
-                            pass
-
-                    valid_routes.append({
-                        "id": route.id,
-                        "name": route.name,
-                        "fare": route.fares.first().amount if route.fares.exists() else 20.00,
-                        "has_transfer": False,
-                        "source_coordinates": [stops[source_index].stop.latitude, stops[source_index].stop.longitude],
-                        "destination_coordinates": [stops[dest_index].stop.latitude, stops[dest_index].stop.longitude],
-                        "shape": shape_coords,
-                        "transfer_point": None,
-                        "next_buses": next_buses
-                    })
-                    break
-
-        # STEP 2 — ONE TRANSFER ROUTES
-        if not valid_routes:
-            source_routes = BusRoute.objects.filter(
-                trip_patterns__pattern_stops__stop__name__icontains=source_name
-            ).distinct()
-
-            dest_routes = BusRoute.objects.filter(
-                trip_patterns__pattern_stops__stop__name__icontains=destination_name
-            ).distinct()
-
-            found_transfer = False
-
-            for sr in source_routes:
-                for sp in sr.trip_patterns.all():
-                    source_stops = list(sp.pattern_stops.order_by('stop_order'))
-
-                    try:
-                        source_idx = next(i for i, ps in enumerate(source_stops) if ps.stop.name.lower() == source_name.lower())
-                    except StopIteration:
-                        continue
-
-                    for ps in source_stops[source_idx + 1:]:
-                        transfer_stop_name = ps.stop.name.lower()
-
-                        for dr in dest_routes:
-                            for dp in dr.trip_patterns.all():
-                                dest_stops = list(dp.pattern_stops.order_by('stop_order'))
-
-                                try:
-                                    transfer_idx = next(i for i, dps in enumerate(dest_stops) if dps.stop.name.lower() == transfer_stop_name)
-                                    final_idx = next(i for i, dps in enumerate(dest_stops) if dps.stop.name.lower() == destination_name.lower())
-                                except StopIteration:
-                                    continue
-
-                                if transfer_idx < final_idx:
-                                    # Find next buses for first leg
-                                    leg1_trips = BusTripStopTime.objects.filter(
-                                        trip__pattern=sp,
-                                        stop=source_stops[source_idx].stop,
-                                        departure_time__gte=selected_time
-                                    ).order_by('departure_time')[:3]
-
-                                    leg1_buses = [
-                                        {
-                                            'trip_id': t.trip.id,
-                                            'departure_time': t.departure_time.strftime('%H:%M'),
-                                            'arrival_time': t.arrival_time.strftime('%H:%M')
-                                        } for t in leg1_trips
-                                    ]
-
-                                    # Find next buses for second leg
-                                    leg2_trips = BusTripStopTime.objects.filter(
-                                        trip__pattern=dp,
-                                        stop=dest_stops[transfer_idx].stop,
-                                        departure_time__gte=selected_time
-                                    ).order_by('departure_time')[:3]
-
-                                    leg2_buses = [
-                                        {
-                                            'trip_id': t.trip.id,
-                                            'departure_time': t.departure_time.strftime('%H:%M'),
-                                            'arrival_time': t.arrival_time.strftime('%H:%M')
-                                        } for t in leg2_trips
-                                    ]
-
-                                    # Shapes for both legs
-                                    leg1_shape, leg2_shape = [], []
-                                    if getattr(sr, 'shape', None) and getattr(sr.shape, 'coordinates', None):
-                                        try:
-                                            leg1_shape = get_shape_segment(
-                                                sr.shape.coordinates,
-                                                [source_stops[source_idx].stop.latitude, source_stops[source_idx].stop.longitude],
-                                                [ps.stop.latitude, ps.stop.longitude]
-                                            )
-                                        except:
-                                            pass
-
-                                    if getattr(dr, 'shape', None) and getattr(dr.shape, 'coordinates', None):
-                                        try:
-                                            leg2_shape = get_shape_segment(
-                                                dr.shape.coordinates,
-                                                [dest_stops[transfer_idx].stop.latitude, dest_stops[transfer_idx].stop.longitude],
-                                                [dest_stops[final_idx].stop.latitude, dest_stops[final_idx].stop.longitude]
-                                            )
-                                        except:
-                                            pass
-                                    print('FL',sr.name)
-                                    print('SL',dr.name)
-                                    valid_routes.append({
-                                        'sr_bus': sr.name,
-                                        'dr_name' : dr.name,
-                                        "id": sr.id,
-                                        "second_leg_id": dr.id,
-                                        "name": f"{sr.name} → {dr.name}",
-                                        "fare": 40.00,
-                                        "has_transfer": True,
-                                        "source_coordinates": [source_stops[source_idx].stop.latitude, source_stops[source_idx].stop.longitude],
-                                        "destination_coordinates": [dest_stops[final_idx].stop.latitude, dest_stops[final_idx].stop.longitude],
-                                        "transfer_coordinates": [ps.stop.latitude, ps.stop.longitude],
-                                        "transfer_point": ps.stop.name,
-                                        "shape": [leg1_shape, leg2_shape],
-                                        "next_buses": leg1_buses + leg2_buses  # combined list
-                                    })
-                                    found_transfer = True
-                                    break
-                            if found_transfer: break
-                        if found_transfer: break
-                    if found_transfer: break
-
-        return Response(valid_routes)
+        polyline, tolerance = shape_format(request.GET)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    try:
+        tt = get_timetable()
+        depart_at = time_to_seconds(selected_time)
+        max_transfers = max(0, max_transfers)
+        key = route_cache.key(source_name, destination_name, depart_at, max_transfers)
+        entry = route_cache.get(tt, key)
+        if entry is None:
+            source = resolve_station(tt, source_name)
+            target = resolve_station(tt, destination_name)
+            journeys = []
+            if source is not None and target is not None:
+                # Planned from the start of the time bucket so other requests in it can reuse them
+                journeys = plan(tt, source, target, route_cache.bucket(depart_at), max_transfers=max_transfers)
+            entry = (
+                source, target, tuple(itinerary(journey) for journey in journeys),
+                min((journey.departure for journey in journeys), default=INFINITY),
+            )
+            route_cache.put(tt, key, entry)
+
+        source, target, itineraries, first_departure = entry
+        if depart_at <= first_departure:
+            journeys = retime(tt, itineraries, depart_at)
+        else:
+            # A planned journey leaves before the requested time, and a trip it
+            # dominated may now be the best one: plan afresh
+            journeys = plan(tt, source, target, depart_at, max_transfers=max_transfers)
+        return Response([serialize_journey(tt, journey, depart_at, polyline, tolerance) for journey in journeys])
 
     except Exception as e:
         import traceback
@@ -220,6 +165,52 @@ def find_routes(request):
         return Response({"error": str(e)}, status=500)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def route_cache_stats(request):
+    return Response(route_cache.stats())
+
+
+DEFAULT_DEPARTURES = 10
+
+
+@api_view(['GET'])
+def stop_departures(request, pk):
+    """
+    Next departures from a stop. ``limit`` caps the count (default 10) and
+    ``window`` (minutes) restricts them to a time window; both wrap past midnight.
+    """
+    selected_time_str = request.GET.get('time', '')  # HH:MM
+    try:
+        if selected_time_str:
+            selected_time = datetime.strptime(selected_time_str, '%H:%M').time()
+        else:
+            selected_time = timezone.localtime(timezone.now()).time()
+        limit = int(request.GET.get('limit', DEFAULT_DEPARTURES))
+        window = request.GET.get('window')
+        window = int(window) if window else None
+    except ValueError:
+        return Response({"error": "time must be HH:MM; limit and window must be integers."}, status=400)
+
+    tt = get_timetable()
+    stop = tt.stop_index.get(pk)
+    if stop is None:
+        return Response({"error": "Stop not found."}, status=404)
+
+    index = tt.departure_index
+    after = time_to_seconds(selected_time)
+    if window is not None:
+        rows = index.window(stop, after, window, limit=limit)
+    else:
+        rows = index.next_departures(stop, after, limit)
+
+    return Response({
+        "stop": {"id": pk, "name": tt.station_names[tt.stop_station[stop]]},
+        "time": seconds_to_hhmm(after),
+        "departures": [index.describe(row, next_day) for row, next_day in rows],
+    })
+
+
 class FavouriteListCreateView(generics.ListCreateAPIView):
     serializer_class = FavouriteSerializer
     permission_classes = [IsAuthenticated]
@@ -0,0 +1,115 @@
+"""
+Precompiled ``stops/coordinates/`` payloads.
+
+The stop table is encoded once per layout and compressed once per encoding,
+so serving it is a dict lookup. ETags hash the uncompressed JSON, so every
+worker hands out the same tag for the same stop table and clients can
+revalidate against any of them; each content-coding gets its own suffix
+(``"<hash>-gzip"``), as a strong validator must differ per representation.
+A payload is rebuilt when the shared timetable version moves, so bulk
+imports in another process are picked up.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+from transport.cache import timetable_version
+from .models import Stop
+
+RECORDS, COLUMNAR = 'records', 'columnar'
+LAYOUTS = (RECORDS, COLUMNAR)
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def encode_layout(stops, layout):
+    if layout == COLUMNAR:
+        data = {
+            'id': [s[0] for s in stops],
+            'name': [s[1] for s in stops],
+            'latitude': [s[2] for s in stops],
+            'longitude': [s[3] for s in stops],
+        }
+    else:
+        data = [{'id': s[0], 'name': s[1], 'latitude': s[2], 'longitude': s[3]} for s in stops]
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def accepted_encodings(accept_encoding):
+    """Content-codings an ``Accept-Encoding`` header allows, i.e. listed with a ``q`` above zero."""
+    accepted = set()
+    for part in accept_encoding.lower().split(','):
+        coding, *params = (token.strip() for token in part.split(';'))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+class StopCoordinatesPayload:
+    """Every layout of the stop table as ``{encoding: bytes}`` (``None`` is identity) plus their ETags."""
+
+    def __init__(self, stops):
+        self.bodies = {}
+        self.etags = {}
+        for layout in LAYOUTS:
+            content = encode_layout(stops, layout)
+            digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+            self.etags[layout] = {None: f'"{digest}"', **{enc: f'"{digest}-{enc}"' for enc in ENCODINGS}}
+            self.bodies[layout] = {None: content, **{enc: compress(content, enc) for enc in ENCODINGS}}
+
+    @classmethod
+    def from_database(cls):
+        return cls(list(Stop.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude')))
+
+    def negotiate(self, layout, accept_encoding):
+        """(encoding, body) for the best encoding the client accepts."""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in accepted:
+                return encoding, self.bodies[layout][encoding]
+        return None, self.bodies[layout][None]
+
+
+# ----------------------
+# Process-local cache
+# ----------------------
+_lock = threading.Lock()
+_payload = None
+_version = None
+
+
+def get_stop_coordinates_payload():
+    global _payload, _version
+    version = timetable_version()
+    payload = _payload
+    if payload is None or _version != version:
+        with _lock:
+            if _payload is None or _version != version:
+                _payload = StopCoordinatesPayload.from_database()
+                _version = version
+            payload = _payload
+    return payload
+
+
+def invalidate_stop_coordinates_payload(**kwargs):
+    global _payload
+    _payload = None
@@ -5,6 +5,8 @@ class Stop(models.Model):
     name = models.CharField(max_length=100)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    # stop_id in the GTFS feed this stop was imported from, so re-imports update it
+    gtfs_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -0,0 +1,181 @@
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from django.db.models import Count
+
+from transport.cache import timetable_version
+from .models import Stop
+
+MIN_SIMILARITY = 0.4
+DEFAULT_LIMIT = 20
+FUZZY_CANDIDATES_PER_RESULT = 5
+
+# Match classes, best first
+EXACT, PREFIX, TOKEN_PREFIX, FUZZY = 3, 2, 1, 0
+
+_non_alnum = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return _non_alnum.sub(' ', text.lower()).strip()
+
+
+def token_trigrams(token):
+    padded = f"  {token} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def dice(a, b):
+    shared = len(a & b)
+    return 2 * shared / (len(a) + len(b)) if shared else 0.0
+
+
+class StopSearchIndex:
+    """
+    In-memory typeahead index over ``Stop.name``.
+
+    Every token of every normalized name is inserted into a prefix trie whose
+    nodes hold the ids of the stops below them, so a prefix lookup is one walk
+    down the trie. When prefixes alone do not fill the result, stops sharing
+    enough trigrams with the query are added, which tolerates typos. Similarity
+    pairs each query word with its closest word in the stop name (Dice
+    coefficient over trigrams) and averages. Results are ranked by match
+    class, similarity and the number of routes serving the stop.
+    """
+
+    def __init__(self, stops, route_counts):
+        self.stops = {}
+        self.names = {}
+        self.token_grams = {}
+        self.route_counts = route_counts
+        self.trie = {}
+        self.by_gram = {}
+
+        for stop in stops:
+            stop_id = stop['id']
+            name = normalize(stop['name'])
+            self.stops[stop_id] = stop
+            self.names[stop_id] = name
+            tokens = set(name.split())
+            self.token_grams[stop_id] = [token_trigrams(token) for token in tokens]
+            for token in tokens:
+                self._insert(token, stop_id)
+                for gram in token_trigrams(token):
+                    self.by_gram.setdefault(gram, set()).add(stop_id)
+
+    @classmethod
+    def from_database(cls):
+        # Imported lazily: sroutes depends on home, not the other way round
+        from sroutes.models import TripPatternStop
+
+        route_counts = dict(
+            TripPatternStop.objects.values('stop_id')
+            .annotate(routes=Count('pattern__route', distinct=True))
+            .values_list('stop_id', 'routes')
+        )
+        return cls(Stop.objects.values('id', 'name', 'latitude', 'longitude'), route_counts)
+
+    def _insert(self, token, stop_id):
+        node = self.trie
+        for char in token:
+            node = node.setdefault(char, {})
+            node.setdefault('', set()).add(stop_id)
+
+    def prefix(self, token):
+        node = self.trie
+        for char in token:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get('', set())
+
+    def similarity(self, query_token_grams, stop_id):
+        stop_grams = self.token_grams[stop_id]
+        if not stop_grams:
+            return 0.0
+        return sum(max(dice(q, g) for g in stop_grams) for q in query_token_grams) / len(query_token_grams)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Best matching stop dicts for a (possibly partial, possibly misspelt) query."""
+        query = normalize(query)
+        if not query:
+            return []
+        tokens = query.split()
+
+        matches = None
+        for token in tokens:
+            ids = self.prefix(token)
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                break
+
+        query_token_grams = [token_trigrams(token) for token in tokens]
+        query_grams = frozenset().union(*query_token_grams)
+        candidates = {stop_id: self._match_class(query, stop_id) for stop_id in matches or ()}
+        if len(candidates) < limit:
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.by_gram.get(gram, ()))
+            # Only the stops sharing the most trigrams are scored, and too few
+            # shared trigrams cannot reach MIN_SIMILARITY at all
+            floor = MIN_SIMILARITY * len(query_grams) / 2
+            for stop_id, count in shared.most_common(limit * FUZZY_CANDIDATES_PER_RESULT):
+                if count < floor:
+                    break
+                if stop_id not in candidates and self.similarity(query_token_grams, stop_id) >= MIN_SIMILARITY:
+                    candidates[stop_id] = FUZZY
+
+        ranked = sorted(
+            candidates.items(),
+            key=lambda item: (
+                -item[1],
+                -self.similarity(query_token_grams, item[0]),
+                -self.route_counts.get(item[0], 0),
+                self.names[item[0]],
+            ),
+        )
+        return [self.stops[stop_id] for stop_id, _ in ranked[:limit]]
+
+    def _match_class(self, query, stop_id):
+        name = self.names[stop_id]
+        if name == query:
+            return EXACT
+        if name.startswith(query):
+            return PREFIX
+        return TOKEN_PREFIX
+
+    def resolve(self, query):
+        """The single best stop for a free-text name, or None."""
+        best = self.search(query, limit=1)
+        return best[0] if best else None
+
+
+# ----------------------
+# Process-local cache
+# ----------------------
+_lock = threading.Lock()
+_index = None
+_version = None
+
+
+def get_stop_search_index():
+    """The process's index, rebuilt when the shared timetable version moves (imports in other processes)."""
+    global _index, _version
+    version = timetable_version()
+    index = _index
+    if index is None or _version != version:
+        with _lock:
+            if _index is None or _version != version:
+                _index = StopSearchIndex.from_database()
+                _version = version
+            index = _index
+    return index
+
+
+def invalidate_stop_search_index(**kwargs):
+    global _index
+    _index = None
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Stop
+from .coordinates import invalidate_stop_coordinates_payload
+from .search import invalidate_stop_search_index
+from .spatial import invalidate_stop_grid
+
+
+@receiver([post_save, post_delete], sender=Stop, dispatch_uid='home.stop_changed')
+def stop_changed(sender, **kwargs):
+    invalidate_stop_grid()
+    invalidate_stop_search_index()
+    invalidate_stop_coordinates_payload()
@@ -0,0 +1,117 @@
+import math
+import threading
+from bisect import insort
+
+from geographiclib.geodesic import Geodesic
+
+from transport.cache import timetable_version
+from .models import Stop
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+CELL_DEGREES = 0.01  # ~1.1 km of latitude per grid cell
+# Haversine on the mean sphere is within 0.5% of the WGS-84 geodesic.
+HAVERSINE_TOLERANCE = 0.005
+WGS84 = Geodesic.WGS84
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class StopGrid:
+    """
+    Fixed-size lat/lng grid over every stop.
+
+    A radius query only visits the cells overlapping the circle's bounding
+    box, drops candidates with a haversine check and computes the exact
+    geodesic distance for the survivors.
+    """
+
+    def __init__(self, stops):
+        self.stops = []
+        self.cells = {}
+        for stop in stops:
+            index = len(self.stops)
+            self.stops.append(stop)
+            self.cells.setdefault(self._cell(stop['latitude'], stop['longitude']), []).append(index)
+
+    @classmethod
+    def from_database(cls):
+        return cls(Stop.objects.values('id', 'name', 'latitude', 'longitude'))
+
+    @staticmethod
+    def _cell(lat, lng):
+        return math.floor(lat / CELL_DEGREES), math.floor(lng / CELL_DEGREES)
+
+    def _candidates(self, lat, lng, radius):
+        dlat = radius / METERS_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        dlng = min(180.0, dlat / cos_lat)
+        lat_lo, lng_lo = self._cell(lat - dlat, lng - dlng)
+        lat_hi, lng_hi = self._cell(lat + dlat, lng + dlng)
+        if (lat_hi - lat_lo + 1) * (lng_hi - lng_lo + 1) > len(self.cells):
+            for bucket in self.cells.values():
+                yield from bucket
+            return
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lng_lo, lng_hi + 1):
+                yield from self.cells.get((i, j), ())
+
+    def nearby(self, lat, lng, radius, limit=None):
+        """Stops within ``radius`` meters as (stop, distance_m) pairs, nearest first."""
+        if limit is not None and limit <= 0:
+            return []
+        cutoff = radius * (1 + HAVERSINE_TOLERANCE)
+        rough = []
+        for index in self._candidates(lat, lng, radius):
+            stop = self.stops[index]
+            d = haversine_m(lat, lng, stop['latitude'], stop['longitude'])
+            if d <= cutoff:
+                rough.append((d, index))
+        rough.sort()
+
+        matches = []
+        for d, index in rough:
+            # Once the list is full, a candidate whose lower bound is beyond the
+            # current worst match cannot make the cut.
+            if limit is not None and len(matches) >= limit and d * (1 - HAVERSINE_TOLERANCE) > matches[-1][0]:
+                break
+            stop = self.stops[index]
+            exact = WGS84.Inverse(lat, lng, stop['latitude'], stop['longitude'], Geodesic.DISTANCE)['s12']
+            if exact <= radius:
+                insort(matches, (exact, index))
+                if limit is not None:
+                    del matches[limit:]
+        return [(self.stops[index], exact) for exact, index in matches]
+
+
+# ----------------------
+# Process-local cache
+# ----------------------
+_lock = threading.Lock()
+_grid = None
+_version = None
+
+
+def get_stop_grid():
+    """The process's grid, rebuilt when the shared timetable version moves (imports in other processes)."""
+    global _grid, _version
+    version = timetable_version()
+    grid = _grid
+    if grid is None or _version != version:
+        with _lock:
+            if _grid is None or _version != version:
+                _grid = StopGrid.from_database()
+                _version = version
+            grid = _grid
+    return grid
+
+
+def invalidate_stop_grid(**kwargs):
+    global _grid
+    _grid = None
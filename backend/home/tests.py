@@ -1,3 +1,215 @@
+import gzip
+import json
+import random
+from unittest import skipUnless
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from transport.cache import bump_timetable_version
+from transport.testing import isolated_cache
+from .coordinates import COLUMNAR, ENCODINGS, RECORDS, StopCoordinatesPayload, accepted_encodings
+from .models import Stop
+from .search import StopSearchIndex, DEFAULT_LIMIT
+from .spatial import StopGrid, WGS84
 
-# Create your tests here.
+
+class StopGridTests(TestCase):
+    def test_matches_a_full_scan(self):
+        rng = random.Random(7)
+        stops = [
+            {'id': i, 'name': f"Stop {i}", 'latitude': 23.0 + rng.uniform(-0.05, 0.05), 'longitude': 72.5 + rng.uniform(-0.05, 0.05)}
+            for i in range(500)
+        ]
+        grid = StopGrid(stops)
+        for _ in range(20):
+            lat, lng = 23.0 + rng.uniform(-0.05, 0.05), 72.5 + rng.uniform(-0.05, 0.05)
+            radius = rng.choice([100, 800, 2500])
+            distances = sorted(
+                (WGS84.Inverse(lat, lng, s['latitude'], s['longitude'])['s12'], s['id']) for s in stops
+            )
+            expected = [stop_id for d, stop_id in distances if d <= radius]
+            self.assertEqual([s['id'] for s, _ in grid.nearby(lat, lng, radius)], expected)
+            self.assertEqual([s['id'] for s, _ in grid.nearby(lat, lng, radius, limit=3)], expected[:3])
+
+    def test_cell_edges_and_the_antimeridian(self):
+        grid = StopGrid([
+            {'id': 1, 'name': "West", 'latitude': 0.0, 'longitude': 179.9995},
+            {'id': 2, 'name': "East", 'latitude': 0.0, 'longitude': -179.9995},
+            {'id': 3, 'name': "Edge", 'latitude': 23.0099999, 'longitude': 72.5},
+        ])
+        self.assertEqual([s['id'] for s, _ in grid.nearby(0.0, 180.0, 100)], [1, 2])
+        self.assertEqual([s['id'] for s, _ in grid.nearby(23.01, 72.5, 10)], [3])
+
+    def test_non_positive_limit(self):
+        grid = StopGrid([{'id': 1, 'name': "A", 'latitude': 23.0, 'longitude': 72.5}])
+        self.assertEqual(grid.nearby(23.0, 72.5, 100, limit=0), [])
+
+
+@isolated_cache
+class NearbyStopsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Stop.objects.create(name="Near", latitude=23.0, longitude=72.5)
+        Stop.objects.create(name="Far", latitude=23.05, longitude=72.5)
+
+    def nearby(self, **params):
+        response = self.client.get(reverse('nearby-stops'), {'lat': 23.0, 'lng': 72.5001, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(row['stop']['name'], row['distance_m']) for row in response.json()]
+
+    def test_nearby(self):
+        self.assertEqual(self.nearby(), [("Near", 10)])
+        self.assertEqual([name for name, _ in self.nearby(radius=10000)], ["Near", "Far"])
+        self.assertEqual([name for name, _ in self.nearby(radius=10000, limit=1)], ["Near"])
+
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse('nearby-stops'), {'lat': 'north'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_stop_save_rebuilds_the_grid(self):
+        self.nearby()
+        Stop.objects.create(name="New", latitude=23.0, longitude=72.5002)
+        self.assertEqual([name for name, _ in self.nearby()], ["Near", "New"])
+
+    def test_version_bump_from_another_process_rebuilds_the_grid(self):
+        self.nearby()
+        # A bulk import elsewhere sends no signal here; only the shared version moves
+        Stop.objects.bulk_create([Stop(name="New", latitude=23.0, longitude=72.5002)])
+        self.assertEqual([name for name, _ in self.nearby()], ["Near"])
+        bump_timetable_version()
+        self.assertEqual([name for name, _ in self.nearby()], ["Near", "New"])
+
+
+class StopSearchIndexTests(TestCase):
+    def setUp(self):
+        names = ["Paldi", "Paldi Char Rasta", "Old Paldi", "Pal Gam", "Naranpura", "Shivranjani", "Jodhpur Gam", "Café Bazaar"]
+        self.index = StopSearchIndex(
+            [{'id': i, 'name': name, 'latitude': 23.0, 'longitude': 72.5} for i, name in enumerate(names)],
+            route_counts={},
+        )
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        return [stop['name'] for stop in self.index.search(query, limit)]
+
+    def test_exact_then_prefix_then_token_prefix_then_fuzzy(self):
+        self.assertEqual(self.search("paldi"), ["Paldi", "Paldi Char Rasta", "Old Paldi", "Pal Gam"])
+
+    def test_every_word_must_prefix_a_token(self):
+        self.assertEqual(self.search("pal"), ["Pal Gam", "Paldi", "Paldi Char Rasta", "Old Paldi"])
+        self.assertEqual(self.search("gam pal")[:1], ["Pal Gam"])
+        self.assertEqual(self.search("pal", limit=2), ["Pal Gam", "Paldi"])
+
+    def test_route_count_breaks_ties(self):
+        stops = [{'id': i, 'name': name} for i, name in enumerate(["Zoo North", "Zoo South"])]
+        self.assertEqual([s['name'] for s in StopSearchIndex(stops, {}).search("zoo")], ["Zoo North", "Zoo South"])
+        self.assertEqual([s['name'] for s in StopSearchIndex(stops, {1: 3}).search("zoo")], ["Zoo South", "Zoo North"])
+
+    def test_typos(self):
+        self.assertEqual(self.search("shivranjni"), ["Shivranjani"])
+        self.assertEqual(self.index.resolve("naranpra")['name'], "Naranpura")
+        self.assertIsNone(self.index.resolve("xyzzy"))
+
+    def test_accents_and_punctuation(self):
+        self.assertEqual(self.search("cafe"), ["Café Bazaar"])
+        self.assertEqual(self.search("  Paldi-Char ")[:1], ["Paldi Char Rasta"])
+        self.assertEqual(self.search("!!"), [])
+
+
+@isolated_cache
+class SearchStopsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Stop.objects.create(name="Paldi", latitude=23.0, longitude=72.5)
+
+    def search(self, query):
+        response = self.client.get(reverse('search-stops'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [stop['name'] for stop in response.json()]
+
+    def test_invalid_limit(self):
+        response = self.client.get(reverse('search-stops'), {'q': "pal", 'limit': "all"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_stop_save_rebuilds_the_index(self):
+        self.assertEqual(self.search("pal"), ["Paldi"])
+        Stop.objects.create(name="Pal Gam", latitude=23.0, longitude=72.5)
+        self.assertEqual(self.search("pal"), ["Pal Gam", "Paldi"])
+
+    def test_version_bump_from_another_process_rebuilds_the_index(self):
+        self.assertEqual(self.search("pal"), ["Paldi"])
+        # A bulk import elsewhere sends no signal here; only the shared version moves
+        Stop.objects.bulk_create([Stop(name="Pal Gam", latitude=23.0, longitude=72.5)])
+        self.assertEqual(self.search("pal"), ["Paldi"])
+        bump_timetable_version()
+        self.assertEqual(self.search("pal"), ["Pal Gam", "Paldi"])
+
+
+class AcceptEncodingTests(TestCase):
+    def test_q_values(self):
+        self.assertEqual(accepted_encodings("gzip, br"), {'gzip', 'br'})
+        self.assertEqual(accepted_encodings("GZIP;q=0.5;foo, br"), {'gzip', 'br'})
+        self.assertEqual(accepted_encodings("gzip; q=0.00, deflate;q=1"), {'deflate'})
+        self.assertEqual(accepted_encodings("gzip;q=0.0"), set())
+        self.assertEqual(accepted_encodings("gzip;q=0.001"), {'gzip'})
+        self.assertEqual(accepted_encodings("gzip;q=high, br;q=-1"), set())
+        self.assertEqual(accepted_encodings(""), set())
+
+
+@isolated_cache
+class StopCoordinatesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Stop.objects.create(name="Paldi", latitude=23.0, longitude=72.5)
+        Stop.objects.create(name="Naranpura", latitude=23.05, longitude=72.55)
+
+    def get(self, accept_encoding='', **params):
+        return self.client.get(reverse('all-stops-coordinates'), params, HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_layouts(self):
+        records = json.loads(self.get().content)
+        self.assertEqual([stop['name'] for stop in records], ["Paldi", "Naranpura"])
+        columnar = json.loads(self.get(layout=COLUMNAR).content)
+        self.assertEqual(columnar['name'], ["Paldi", "Naranpura"])
+        self.assertEqual(columnar['latitude'], [23.0, 23.05])
+        self.assertEqual(self.get(layout='rows').status_code, 400)
+
+    def test_gzip(self):
+        plain = self.get()
+        response = self.get("gzip;q=0.5;foo")
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], plain['ETag'][:-1] + '-gzip"')
+
+    def test_refused_encodings_are_not_used(self):
+        for header in ("gzip;q=0", "gzip;q=0.0", "gzip; q=0.00", "identity", "br;q=0, gzip;q=0"):
+            response = self.get(header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+            self.assertEqual(json.loads(response.content)[0]['name'], "Paldi")
+
+    @skipUnless('br' in ENCODINGS, "brotli is not installed")
+    def test_brotli_is_preferred(self):
+        self.assertEqual(self.get("gzip, br")['Content-Encoding'], 'br')
+        self.assertEqual(self.get("gzip, br;q=0")['Content-Encoding'], 'gzip')
+
+    def test_etag_revalidation(self):
+        for accept_encoding in ('', 'gzip'):
+            etag = self.get(accept_encoding)['ETag']
+            response = self.client.get(
+                reverse('all-stops-coordinates'), HTTP_ACCEPT_ENCODING=accept_encoding, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        # A tag for one representation does not validate another
+        etag = self.get()['ETag']
+        response = self.client.get(reverse('all-stops-coordinates'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.get(layout=COLUMNAR)['ETag'], etag)
+
+    def test_etag_is_stable_until_the_stops_change(self):
+        etag = self.get()['ETag']
+        self.assertEqual(StopCoordinatesPayload.from_database().etags[RECORDS][None], etag)
+        Stop.objects.create(name="Pal Gam", latitude=23.0, longitude=72.5)
+        response = self.client.get(reverse('all-stops-coordinates'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), 3)
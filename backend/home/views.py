@@ -1,10 +1,14 @@
 from rest_framework import generics
 from rest_framework.decorators import api_view ,permission_classes
 from rest_framework.response import Response
-from geopy.distance import geodesic
+from django.http import HttpResponse, HttpResponseNotModified
 from rest_framework.permissions import AllowAny , IsAuthenticated
 from .models import Stop
 from .serializers import StopSerializer,UserSerializer
+from .search import get_stop_search_index, DEFAULT_LIMIT
+from .spatial import get_stop_grid
+from .coordinates import get_stop_coordinates_payload, LAYOUTS, RECORDS
+from transport.cache import etag_matches
 
 class RegisterView(generics.CreateAPIView):
     serializer_class = UserSerializer
@@ -21,8 +25,11 @@ class StopDetailView(generics.RetrieveUpdateDestroyAPIView):
 @api_view(['GET'])
 def search_stops(request):
     query = request.GET.get('q', '')
-    stops = Stop.objects.filter(name__icontains=query).distinct()
-    return Response(StopSerializer(stops, many=True).data)
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=400)
+    return Response(get_stop_search_index().search(query, limit))
 
 @api_view(['GET'])
 def nearby_stops(request):
@@ -30,18 +37,16 @@ def nearby_stops(request):
         lat = float(request.GET.get('lat'))
         lng = float(request.GET.get('lng'))
         radius = float(request.GET.get('radius', 1000))  # meters
+        limit = request.GET.get('limit')
+        limit = int(limit) if limit else None
 
-        user_location = (lat, lng)
-        stops = []
-
-        for stop in Stop.objects.all():
-            stop_location = (stop.latitude, stop.longitude)
-            distance = geodesic(user_location, stop_location).meters
-            if distance <= radius:
-                stops.append({
-                    'stop': StopSerializer(stop).data,
-                    'distance_m': round(distance)
-                })
+        stops = [
+            {
+                'stop': stop,
+                'distance_m': round(distance)
+            }
+            for stop, distance in get_stop_grid().nearby(lat, lng, radius, limit)
+        ]
 
         return Response(stops)
 
@@ -50,17 +55,28 @@ def nearby_stops(request):
 
 @api_view(['GET'])
 def all_stops_coordinates(request):
-    stops = Stop.objects.all()
-    data = [
-        {
-            'id': stop.id,
-            'name': stop.name,
-            'latitude': stop.latitude,
-            'longitude': stop.longitude
-        }
-        for stop in stops
-    ]
-    return Response(data)
+    """
+    Every stop's coordinates as precompiled JSON, compressed when the client
+    accepts it. ``layout=columnar`` returns parallel id/name/latitude/longitude
+    arrays instead of one object per stop.
+    """
+    layout = request.GET.get('layout', RECORDS)
+    if layout not in LAYOUTS:
+        return Response({'error': f"layout must be one of {', '.join(LAYOUTS)}"}, status=400)
+
+    payload = get_stop_coordinates_payload()
+    encoding, body = payload.negotiate(layout, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = payload.etags[layout][encoding]
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    response['Vary'] = 'Accept-Encoding'
+    return response
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
@@ -0,0 +1,147 @@
+"""
+Fan-out of live position updates to streaming clients.
+
+Every ingested batch is encoded and matched against the subscribers once,
+in the ingesting thread, and handed to each event loop with a single
+callback. Subscribers do not queue deltas: pending updates are coalesced
+per vehicle, so a slow client simply receives the newest position of each
+vehicle on its next read and its memory stays bounded by the fleet size.
+
+Events carry the route of their trip. Routes are looked up for the trips
+of each batch that have not been seen since the timetable version last
+moved, so ingestion never waits for a timetable rebuild.
+"""
+import asyncio
+import threading
+
+from froutes.models import BusTrip
+from transport.cache import timetable_version
+
+
+def position_event(pos, route_id):
+    return {
+        'vehicle_id': pos.vehicle_id,
+        'trip_id': pos.trip_id,
+        'route_id': route_id,
+        'latitude': pos.latitude,
+        'longitude': pos.longitude,
+        'bearing': pos.bearing,
+        'speed': pos.speed,
+        'timestamp': pos.timestamp,
+    }
+
+
+class Subscriber:
+    """One streaming client; ``push`` and ``next_batch`` run on its event loop."""
+
+    def __init__(self, loop, routes=None, bbox=None):
+        self.loop = loop
+        self.routes = routes
+        self.bbox = bbox
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def wants(self, event):
+        if self.routes is not None and event['route_id'] not in self.routes:
+            return False
+        if self.bbox is not None:
+            south, west, north, east = self.bbox
+            return south <= event['latitude'] <= north and west <= event['longitude'] <= east
+        return True
+
+    def select(self, everything, by_route):
+        """This subscriber's share of a batch, reusing the shared dicts where no filtering is needed."""
+        if self.routes is None:
+            events = everything
+        elif len(self.routes) == 1:
+            events = by_route.get(next(iter(self.routes)), {})
+        else:
+            events = {}
+            for route_id in self.routes:
+                events.update(by_route.get(route_id, {}))
+        if self.bbox is not None:
+            events = {vehicle_id: e for vehicle_id, e in events.items() if self.wants(e)}
+        return events
+
+    def push(self, events):
+        self.pending.update(events)
+        self.ready.set()
+
+    async def next_batch(self, timeout):
+        """Pending events, or an empty list after ``timeout`` seconds of quiet."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        events, self.pending = list(self.pending.values()), {}
+        return events
+
+
+def _deliver(deliveries):
+    for subscriber, events in deliveries:
+        subscriber.push(events)
+
+
+class Broadcaster:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.trip_routes = {}
+        self.trip_routes_version = None
+
+    def subscribe(self, routes=None, bbox=None):
+        subscriber = Subscriber(asyncio.get_running_loop(), routes, bbox)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def route_ids(self, trip_ids):
+        """{trip id: route id} for ``trip_ids``; trips the timetable does not know map to None."""
+        version = timetable_version()
+        with self.lock:
+            if self.trip_routes_version != version:
+                self.trip_routes, self.trip_routes_version = {}, version
+            trip_routes = self.trip_routes
+            missing = {trip_id for trip_id in trip_ids if trip_id is not None and trip_id not in trip_routes}
+        if missing:
+            found = dict(BusTrip.objects.filter(pk__in=missing).values_list('id', 'pattern__route_id'))
+            with self.lock:
+                # Filled in place, so a version bump meanwhile drops these with the old dict
+                trip_routes.update((trip_id, found.get(trip_id)) for trip_id in missing)
+        return trip_routes
+
+    def encode(self, positions):
+        trip_routes = self.route_ids({pos.trip_id for pos in positions})
+        return [position_event(pos, trip_routes.get(pos.trip_id)) for pos in positions]
+
+    def publish(self, positions):
+        """Hand ``positions`` to every matching subscriber; safe to call from any thread."""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        if not subscribers or not positions:
+            return
+        everything, by_route = {}, {}
+        for event in self.encode(positions):
+            everything[event['vehicle_id']] = event
+            by_route.setdefault(event['route_id'], {})[event['vehicle_id']] = event
+
+        by_loop = {}
+        for subscriber in subscribers:
+            selected = subscriber.select(everything, by_route)
+            if selected:
+                by_loop.setdefault(subscriber.loop, []).append((subscriber, selected))
+        for loop, deliveries in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, deliveries)
+            except RuntimeError:
+                # The loop has shut down; its clients are gone
+                for subscriber, _ in deliveries:
+                    self.unsubscribe(subscriber)
+
+
+broadcaster = Broadcaster()
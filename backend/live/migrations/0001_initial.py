@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('froutes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveBusLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_id', models.CharField(max_length=50, unique=True)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('bearing', models.FloatField(blank=True, null=True)),
+                ('speed', models.FloatField(blank=True, help_text='Meters per second', null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('trip', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='froutes.bustrip')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import models
+from froutes.models import BusTrip
+
+
+# ----------------------
+# Live Bus Location
+# ----------------------
+class LiveBusLocation(models.Model):
+    """Last persisted position of a vehicle; the live store writes these snapshots in the background."""
+    vehicle_id = models.CharField(max_length=50, unique=True)
+    # No FK constraint: feeds may report trips before (or after) the timetable knows them
+    trip = models.ForeignKey(BusTrip, null=True, blank=True, on_delete=models.SET_NULL, db_constraint=False)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    bearing = models.FloatField(null=True, blank=True)
+    speed = models.FloatField(null=True, blank=True, help_text="Meters per second")
+    timestamp = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.vehicle_id} @ {self.latitude}, {self.longitude}"
@@ -0,0 +1,200 @@
+"""
+Latest known position of every vehicle, held in process memory.
+
+Pings are applied under one lock: a ping older than the stored position of
+its vehicle is ignored, so out-of-order delivery cannot move a bus back.
+Each vehicle also keeps its last few positions in a fixed-size ring for
+drawing trails. Changed vehicles are written to ``LiveBusLocation`` by a
+background thread every few seconds, and a restarted process starts from
+those snapshots. Reads never touch the database.
+
+The store is per process: run the server with a single process (threads
+are fine) or route ingestion and reads to the same one.
+"""
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connection
+
+from .models import LiveBusLocation
+
+logger = logging.getLogger(__name__)
+
+TRAIL_LENGTH = 10
+STALE_SECONDS = 5 * 60
+DEFAULT_SNAPSHOT_INTERVAL = 5.0
+
+Position = namedtuple('Position', 'vehicle_id trip_id latitude longitude bearing speed timestamp')
+
+
+def parse_timestamp(value):
+    """Epoch seconds from a number or an ISO 8601 string; now when missing."""
+    if value is None or value == '':
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def optional_float(value):
+    return None if value is None or value == '' else float(value)
+
+
+def parse_ping(data):
+    """A Position from one ping dict; raises ValueError, TypeError or KeyError when malformed."""
+    latitude = float(data['latitude'] if 'latitude' in data else data['lat'])
+    longitude = float(data['longitude'] if 'longitude' in data else data['lng'])
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("coordinates out of range")
+    vehicle_id = str(data['vehicle_id']).strip()
+    if not vehicle_id:
+        raise ValueError("vehicle_id is required")
+    trip_id = data.get('trip_id')
+    return Position(
+        vehicle_id=vehicle_id,
+        trip_id=None if trip_id in (None, '') else int(trip_id),
+        latitude=latitude,
+        longitude=longitude,
+        bearing=optional_float(data.get('bearing')),
+        speed=optional_float(data.get('speed')),
+        timestamp=parse_timestamp(data.get('timestamp')),
+    )
+
+
+class LivePositionStore:
+    def __init__(self, trail_length=TRAIL_LENGTH):
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.trails = {}
+        self.dirty = set()
+        self.trail_length = trail_length
+
+    def ingest(self, positions, persist=True):
+        """Apply ``positions``; returns those newer than what the store held."""
+        applied = []
+        with self.lock:
+            for pos in positions:
+                current = self.latest.get(pos.vehicle_id)
+                if current is not None and pos.timestamp <= current.timestamp:
+                    continue
+                self.latest[pos.vehicle_id] = pos
+                trail = self.trails.get(pos.vehicle_id)
+                if trail is None:
+                    trail = self.trails[pos.vehicle_id] = deque(maxlen=self.trail_length)
+                trail.append((pos.latitude, pos.longitude, pos.timestamp))
+                if persist:
+                    self.dirty.add(pos.vehicle_id)
+                applied.append(pos)
+        return applied
+
+    def positions(self, max_age=None):
+        with self.lock:
+            positions = list(self.latest.values())
+        if max_age is not None:
+            oldest = time.time() - max_age
+            positions = [pos for pos in positions if pos.timestamp >= oldest]
+        return positions
+
+    def trail(self, vehicle_id):
+        with self.lock:
+            return list(self.trails.get(vehicle_id, ()))
+
+    def take_dirty(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            return [self.latest[vehicle_id] for vehicle_id in dirty]
+
+    def mark_dirty(self, positions):
+        with self.lock:
+            self.dirty.update(pos.vehicle_id for pos in positions)
+
+
+# ----------------------
+# Snapshot persistence
+# ----------------------
+def persist(positions):
+    LiveBusLocation.objects.bulk_create(
+        [
+            LiveBusLocation(
+                vehicle_id=pos.vehicle_id,
+                trip_id=pos.trip_id,
+                latitude=pos.latitude,
+                longitude=pos.longitude,
+                bearing=pos.bearing,
+                speed=pos.speed,
+                timestamp=datetime.fromtimestamp(pos.timestamp, tz=timezone.utc),
+            )
+            for pos in positions
+        ],
+        update_conflicts=True,
+        unique_fields=['vehicle_id'],
+        update_fields=['trip', 'latitude', 'longitude', 'bearing', 'speed', 'timestamp'],
+    )
+
+
+class SnapshotWriter(threading.Thread):
+    """Daemon thread writing changed vehicles to the database every ``interval`` seconds."""
+
+    def __init__(self, store, interval):
+        super().__init__(name='live-snapshot-writer', daemon=True)
+        self.store = store
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        positions = self.store.take_dirty()
+        if not positions:
+            return 0
+        try:
+            persist(positions)
+        except Exception:
+            logger.exception("Persisting %d live positions failed; retrying next round", len(positions))
+            self.store.mark_dirty(positions)
+            return 0
+        finally:
+            connection.close()
+        return len(positions)
+
+
+def load_snapshot(store):
+    rows = LiveBusLocation.objects.values_list(
+        'vehicle_id', 'trip_id', 'latitude', 'longitude', 'bearing', 'speed', 'timestamp'
+    )
+    store.ingest((Position(*row[:6], row[6].timestamp()) for row in rows), persist=False)
+
+
+# ----------------------
+# Process-local store
+# ----------------------
+_lock = threading.Lock()
+_store = None
+_writer = None
+
+
+def get_live_store():
+    """The process's store, restored from the last snapshot and with its writer running."""
+    global _store, _writer
+    store = _store
+    if store is None:
+        with _lock:
+            if _store is None:
+                store = LivePositionStore()
+                load_snapshot(store)
+                _writer = SnapshotWriter(
+                    store, getattr(settings, 'LIVE_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL)
+                )
+                _writer.start()
+                _store = store
+            store = _store
+    return store
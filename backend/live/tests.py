@@ -0,0 +1,260 @@
+import asyncio
+import json
+import time
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from froutes.models import BusTrip
+from sroutes.tests import create_route
+from transport.cache import bump_timetable_version
+from transport.testing import isolated_cache
+from . import store as store_module
+from .broadcast import Broadcaster
+from .models import LiveBusLocation
+from .store import LivePositionStore, SnapshotWriter, Position, parse_ping, load_snapshot
+
+
+def position(vehicle_id="V1", timestamp=1000.0, latitude=23.0, longitude=72.5, trip_id=None):
+    return Position(vehicle_id, trip_id, latitude, longitude, None, None, timestamp)
+
+
+class ParsePingTests(TestCase):
+    def test_full_ping(self):
+        pos = parse_ping({
+            'vehicle_id': " V1 ", 'trip_id': "7", 'lat': "23.5", 'lng': 72.5,
+            'bearing': "90", 'speed': '', 'timestamp': "2024-01-01T00:00:00Z",
+        })
+        self.assertEqual(pos, Position("V1", 7, 23.5, 72.5, 90.0, None, 1704067200.0))
+
+    def test_defaults(self):
+        before = time.time()
+        pos = parse_ping({'vehicle_id': 1, 'latitude': 0, 'longitude': 0, 'timestamp': 12})
+        self.assertEqual((pos.vehicle_id, pos.trip_id, pos.timestamp), ("1", None, 12.0))
+        self.assertGreaterEqual(parse_ping({'vehicle_id': 1, 'lat': 0, 'lng': 0}).timestamp, before)
+        # Naive ISO timestamps are UTC
+        self.assertEqual(parse_ping({'vehicle_id': 1, 'lat': 0, 'lng': 0, 'timestamp': "1970-01-01T00:01:00"}).timestamp, 60.0)
+
+    def test_malformed(self):
+        for ping in (
+            {'lat': 0, 'lng': 0},
+            {'vehicle_id': " ", 'lat': 0, 'lng': 0},
+            {'vehicle_id': "V1", 'lat': 91, 'lng': 0},
+            {'vehicle_id': "V1", 'lat': 0, 'lng': -181},
+            {'vehicle_id': "V1", 'lat': "north", 'lng': 0},
+            {'vehicle_id': "V1", 'lng': 0},
+            {'vehicle_id': "V1", 'lat': 0, 'lng': 0, 'trip_id': "seven"},
+            {'vehicle_id': "V1", 'lat': 0, 'lng': 0, 'timestamp': "yesterday"},
+        ):
+            with self.assertRaises((KeyError, TypeError, ValueError), msg=ping):
+                parse_ping(ping)
+
+
+class LivePositionStoreTests(TestCase):
+    def test_older_and_duplicate_pings_are_ignored(self):
+        store = LivePositionStore()
+        applied = store.ingest([position(timestamp=10), position(timestamp=5), position(timestamp=10, latitude=1)])
+        self.assertEqual(applied, [position(timestamp=10)])
+        self.assertEqual(store.positions(), [position(timestamp=10)])
+        self.assertEqual(store.ingest([position(timestamp=9)]), [])
+
+    def test_trail_keeps_the_latest_positions(self):
+        store = LivePositionStore(trail_length=3)
+        store.ingest([position(timestamp=t, latitude=t) for t in range(1, 6)])
+        self.assertEqual(store.trail("V1"), [(3, 72.5, 3), (4, 72.5, 4), (5, 72.5, 5)])
+        self.assertEqual(store.trail("V2"), [])
+
+    def test_stale_vehicles_are_left_out(self):
+        store = LivePositionStore()
+        now = time.time()
+        store.ingest([position("Old", now - 600), position("New", now - 60)])
+        self.assertEqual([pos.vehicle_id for pos in store.positions(300)], ["New"])
+        self.assertEqual(len(store.positions()), 2)
+
+    def test_snapshot_round_trip(self):
+        store = LivePositionStore()
+        store.ingest([position("V1", 100.0), position("V2", 200.0, trip_id=5)])
+        self.assertEqual(SnapshotWriter(store, 60).flush(), 2)
+        self.assertEqual(LiveBusLocation.objects.count(), 2)
+
+        store.ingest([position("V1", 150.0, latitude=24.0)])
+        self.assertEqual(SnapshotWriter(store, 60).flush(), 1)
+        self.assertEqual(LiveBusLocation.objects.get(vehicle_id="V1").latitude, 24.0)
+
+        restored = LivePositionStore()
+        load_snapshot(restored)
+        self.assertEqual(sorted(restored.positions()), sorted(store.positions()))
+        # Restored positions are already stored
+        self.assertEqual(restored.take_dirty(), [])
+
+    def test_failed_flush_is_retried(self):
+        store = LivePositionStore()
+        store.ingest([position()])
+        writer = SnapshotWriter(store, 60)
+        with mock.patch.object(store_module, 'persist', side_effect=RuntimeError), self.assertLogs('live.store'):
+            self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.flush(), 0)
+        self.assertTrue(LiveBusLocation.objects.filter(vehicle_id="V1").exists())
+
+
+@isolated_cache
+class BroadcasterRouteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route("1D")
+        self.trip = BusTrip.objects.create(
+            pattern=self.route.trip_patterns.first(), departure_time="08:00", arrival_time="08:30"
+        )
+
+    def test_routes_are_looked_up_per_batch_without_the_timetable(self):
+        broadcaster = Broadcaster()
+        with mock.patch('froutes.timetable.Timetable.from_database') as build:
+            with self.assertNumQueries(1):
+                events = broadcaster.encode([position(trip_id=self.trip.pk), position("V2", trip_id=999), position("V3")])
+            with self.assertNumQueries(0):
+                broadcaster.encode([position(trip_id=self.trip.pk, timestamp=2000)])
+        build.assert_not_called()
+        self.assertEqual([e['route_id'] for e in events], [self.route.pk, None, None])
+
+    def test_version_bump_forgets_unknown_trips(self):
+        broadcaster = Broadcaster()
+        broadcaster.encode([position(trip_id=999)])
+        # Another process imports the trip the feed was already reporting
+        BusTrip.objects.bulk_create([BusTrip(pk=999, pattern=self.trip.pattern, departure_time="09:00", arrival_time="09:30")])
+        self.assertIsNone(broadcaster.encode([position(trip_id=999)])[0]['route_id'])
+        bump_timetable_version()
+        self.assertEqual(broadcaster.encode([position(trip_id=999)])[0]['route_id'], self.route.pk)
+
+
+@isolated_cache
+class LiveEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = LivePositionStore()
+        self.enterContext(mock.patch.object(store_module, '_store', self.store))
+
+    def ingest(self, data, **headers):
+        return self.client.post(reverse('bus-location-ingest'), data, content_type='application/json', headers=headers)
+
+    @override_settings(LIVE_INGEST_TOKEN="secret")
+    def test_ingest(self):
+        now = time.time()
+        response = self.ingest({'pings': [
+            {'vehicle_id': "V1", 'lat': 23.0, 'lng': 72.5, 'timestamp': now - 10},
+            {'vehicle_id': "V1", 'lat': 23.1, 'lng': 72.5, 'timestamp': now - 20},
+            {'vehicle_id': "V2"},
+        ]}, X_Ingest_Token="secret")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'received': 3, 'applied': 1, 'rejected': 1})
+        self.assertEqual([pos.latitude for pos in self.store.positions()], [23.0])
+
+    @override_settings(LIVE_INGEST_TOKEN="secret")
+    def test_ingest_accepts_a_bare_list(self):
+        response = self.ingest([{'vehicle_id': "V1", 'lat': 23.0, 'lng': 72.5}], X_Ingest_Token="secret")
+        self.assertEqual(response.json()['applied'], 1)
+        self.assertEqual(self.ingest({'pings': "V1"}, X_Ingest_Token="secret").status_code, 400)
+
+    @override_settings(LIVE_INGEST_TOKEN="secret")
+    def test_ingest_token(self):
+        ping = [{'vehicle_id': "V1", 'lat': 23.0, 'lng': 72.5}]
+        self.assertIn(self.ingest(ping).status_code, (401, 403))
+        self.assertIn(self.ingest(ping, X_Ingest_Token="wrong").status_code, (401, 403))
+        self.assertEqual(self.store.positions(), [])
+
+    def test_without_a_token_only_debug_accepts_pings(self):
+        ping = [{'vehicle_id': "V1", 'lat': 23.0, 'lng': 72.5}]
+        with override_settings(LIVE_INGEST_TOKEN=None, DEBUG=False):
+            self.assertIn(self.ingest(ping).status_code, (401, 403))
+        with override_settings(LIVE_INGEST_TOKEN=None, DEBUG=True):
+            self.assertEqual(self.ingest(ping).status_code, 202)
+
+    def test_read(self):
+        now = time.time()
+        self.store.ingest([position("V1", now - 20), position("V1", now - 10, latitude=23.1), position("Old", now - 600)])
+        response = self.client.get(reverse('bus-location'), {'trail': 1})
+        self.assertEqual(response.status_code, 200)
+        [vehicle] = response.json()
+        self.assertEqual((vehicle['vehicle_id'], vehicle['latitude']), ("V1", 23.1))
+        self.assertEqual([point[0] for point in vehicle['trail']], [23.0, 23.1])
+        self.assertEqual(len(self.client.get(reverse('bus-location'), {'max_age': 3600}).json()), 2)
+        self.assertEqual(self.client.get(reverse('bus-location'), {'max_age': "old"}).status_code, 400)
+
+
+def event(vehicle_id, route_id=1, latitude=23.0, longitude=72.5):
+    return {'vehicle_id': vehicle_id, 'route_id': route_id, 'latitude': latitude, 'longitude': longitude}
+
+
+class SubscriberTests(TestCase):
+    async def test_route_and_bbox_filters(self):
+        everything = {"V1": event("V1", 1), "V2": event("V2", 2, latitude=24.0), "V3": event("V3", 3)}
+        by_route = {1: {"V1": everything["V1"]}, 2: {"V2": everything["V2"]}, 3: {"V3": everything["V3"]}}
+        broadcaster = Broadcaster()
+        self.assertEqual(broadcaster.subscribe().select(everything, by_route), everything)
+        self.assertEqual(list(broadcaster.subscribe(routes={2}).select(everything, by_route)), ["V2"])
+        self.assertEqual(list(broadcaster.subscribe(routes={1, 2, 9}).select(everything, by_route)), ["V1", "V2"])
+        near = (22.9, 72.4, 23.1, 72.6)
+        self.assertEqual(list(broadcaster.subscribe(bbox=near).select(everything, by_route)), ["V1", "V3"])
+        self.assertEqual(list(broadcaster.subscribe(routes={2}, bbox=near).select(everything, by_route)), [])
+
+    async def test_pending_updates_are_coalesced_per_vehicle(self):
+        subscriber = Broadcaster().subscribe()
+        subscriber.push({"V1": event("V1", latitude=1)})
+        subscriber.push({"V1": event("V1", latitude=2), "V2": event("V2")})
+        batch = await subscriber.next_batch(1)
+        self.assertEqual([(e['vehicle_id'], e['latitude']) for e in batch], [("V1", 2), ("V2", 23.0)])
+        self.assertEqual(await subscriber.next_batch(0.01), [])
+
+    async def test_publish_from_another_thread(self):
+        broadcaster = Broadcaster()
+        subscriber = broadcaster.subscribe()
+        await asyncio.to_thread(broadcaster.publish, [position("V1"), position("V2")])
+        batch = await subscriber.next_batch(1)
+        self.assertEqual({e['vehicle_id'] for e in batch}, {"V1", "V2"})
+        broadcaster.unsubscribe(subscriber)
+        self.assertEqual(broadcaster.subscribers, set())
+
+
+@isolated_cache
+class LiveStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = LivePositionStore()
+        self.enterContext(mock.patch.object(store_module, '_store', self.store))
+        self.broadcaster = Broadcaster()
+        self.enterContext(mock.patch('live.views.broadcaster', self.broadcaster))
+
+    def test_wsgi_requests_are_refused(self):
+        response = self.client.get(reverse('bus-location-stream'))
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(self.broadcaster.subscribers, set())
+
+    async def test_stream(self):
+        self.store.ingest([position("V1", time.time()), position("Far", time.time(), latitude=40.0)])
+        response = await self.async_client.get(reverse('bus-location-stream'), {'bbox': "22,72,24,73"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+
+        snapshot = (await anext(chunks)).decode()
+        self.assertTrue(snapshot.startswith("event: snapshot\n"))
+        self.assertEqual([e['vehicle_id'] for e in json.loads(snapshot.split("data: ")[1])], ["V1"])
+
+        await asyncio.to_thread(self.broadcaster.publish, [position("V2", time.time()), position("Far2", time.time(), latitude=40.0)])
+        delta = (await anext(chunks)).decode()
+        self.assertTrue(delta.startswith("event: delta\n"))
+        self.assertEqual([e['vehicle_id'] for e in json.loads(delta.split("data: ")[1])], ["V2"])
+
+        # On disconnect the ASGI handler cancels the read waiting for the next event
+        self.assertEqual(len(self.broadcaster.subscribers), 1)
+        waiting = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(self.broadcaster.subscribers, set())
+
+    async def test_invalid_filters(self):
+        for params in ({'route': "one"}, {'bbox': "1,2,3"}):
+            response = await self.async_client.get(reverse('bus-location-stream'), params)
+            self.assertEqual(response.status_code, 400, params)
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('bus-location/', views.live_bus_location, name='bus-location'),
+    path('bus-location/ingest/', views.ingest_positions, name='bus-location-ingest'),
+    path('bus-location/stream/', views.live_bus_stream, name='bus-location-stream'),
+]
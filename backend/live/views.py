@@ -0,0 +1,136 @@
+import hmac
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from .broadcast import broadcaster
+from .store import get_live_store, parse_ping, STALE_SECONDS
+
+HEARTBEAT_SECONDS = 15
+
+
+class HasIngestToken(BasePermission):
+    """Feeds send ``X-Ingest-Token: <settings.LIVE_INGEST_TOKEN>``; without a token configured only DEBUG accepts pings."""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'LIVE_INGEST_TOKEN', None)
+        if not token:
+            return settings.DEBUG
+        return hmac.compare_digest(request.headers.get('X-Ingest-Token', ''), token)
+
+
+def serialize_position(pos):
+    return {
+        'vehicle_id': pos.vehicle_id,
+        'trip_id': pos.trip_id,
+        'latitude': pos.latitude,
+        'longitude': pos.longitude,
+        'bearing': pos.bearing,
+        'speed': pos.speed,
+        'timestamp': pos.timestamp,
+    }
+
+
+@api_view(['GET'])
+def live_bus_location(request):
+    """
+    Latest position of every vehicle heard from in the last ``max_age``
+    seconds (default 300), straight from memory. ``trail=1`` adds each
+    vehicle's recent positions.
+    """
+    try:
+        max_age = float(request.GET.get('max_age', STALE_SECONDS))
+    except ValueError:
+        return Response({'error': 'max_age must be a number of seconds'}, status=400)
+    with_trail = request.GET.get('trail') in ('1', 'true')
+
+    store = get_live_store()
+    data = []
+    for pos in store.positions(max_age):
+        item = serialize_position(pos)
+        if with_trail:
+            item['trail'] = store.trail(pos.vehicle_id)
+        data.append(item)
+    return Response(data)
+
+
+@api_view(['POST'])
+@permission_classes([HasIngestToken])
+def ingest_positions(request):
+    """
+    Accept a batch of GPS pings, either a JSON list or ``{"pings": [...]}``.
+    Each ping has ``vehicle_id``, ``latitude``/``lat``, ``longitude``/``lng``
+    and optionally ``timestamp`` (epoch seconds or ISO 8601), ``trip_id``,
+    ``bearing`` and ``speed``. Malformed pings are counted and skipped.
+    """
+    pings = request.data.get('pings') if isinstance(request.data, dict) else request.data
+    if not isinstance(pings, list):
+        return Response({'error': 'Expected a list of pings'}, status=400)
+
+    positions, rejected = [], 0
+    for ping in pings:
+        try:
+            positions.append(parse_ping(ping))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            rejected += 1
+    applied = get_live_store().ingest(positions)
+    broadcaster.publish(applied)
+    return Response({'received': len(pings), 'applied': len(applied), 'rejected': rejected}, status=202)
+
+
+# ----------------------
+# Streaming (ASGI)
+# ----------------------
+def parse_stream_filters(params):
+    """(routes, bbox) from ``route=1,2`` and ``bbox=south,west,north,east``; raises ValueError."""
+    routes = params.get('route')
+    routes = {int(r) for r in routes.split(',') if r.strip()} if routes else None
+    bbox = params.get('bbox')
+    if bbox:
+        bbox = tuple(float(v) for v in bbox.split(','))
+        if len(bbox) != 4:
+            raise ValueError
+    return routes, bbox or None
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def live_bus_stream(request):
+    """
+    Server-sent events of live positions: one ``snapshot`` event with the
+    current matching vehicles, then ``delta`` events as pings arrive,
+    optionally filtered by ``route`` ids and/or a ``bbox``. Needs an ASGI
+    server (uvicorn, daphne, serving ``backend.asgi``): under WSGI an endless
+    stream would hold a worker forever, so those requests get a 501.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Live streaming needs the ASGI server'}, status=501)
+    try:
+        routes, bbox = parse_stream_filters(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'route must be ids separated by commas; bbox must be south,west,north,east'}, status=400)
+
+    store = await sync_to_async(get_live_store)()
+    subscriber = broadcaster.subscribe(routes, bbox)
+    snapshot = await sync_to_async(broadcaster.encode)(store.positions(STALE_SECONDS))
+
+    async def events():
+        try:
+            yield sse('snapshot', [e for e in snapshot if subscriber.wants(e)])
+            while True:
+                batch = await subscriber.next_batch(HEARTBEAT_SECONDS)
+                # Comments keep proxies from closing an idle stream
+                yield sse('delta', batch) if batch else ": keep-alive\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,3 +1,84 @@
+from datetime import time
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from froutes.models import BusTrip, BusTripStopTime
+from sroutes.models import TripPattern
+from sroutes.tests import create_route
+from transport.testing import isolated_cache
 
-# Create your tests here.
+
+def add_trips(route, count):
+    pattern = TripPattern.objects.filter(route=route).first()
+    stops = [ps.stop for ps in pattern.pattern_stops.all()]
+    for i in range(count):
+        trip = BusTrip.objects.create(pattern=pattern, departure_time=time(6 + i, 0), arrival_time=time(6 + i, 30))
+        for order, stop in enumerate(stops, start=1):
+            BusTripStopTime.objects.create(
+                trip=trip, stop=stop, stop_order=order, arrival_time=time(6 + i, order), departure_time=time(6 + i, order)
+            )
+
+
+@isolated_cache
+class RouteTripsQueryCountTests(TestCase):
+    def get_query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_route_trips_query_count_is_constant(self):
+        small = create_route("1D", n_stops=2, n_patterns=1)
+        large = create_route("2D", n_stops=10, n_patterns=1)
+        add_trips(small, 1)
+        add_trips(large, 8)
+        baseline = self.get_query_count(reverse('route-trips', args=[small.pk]))
+
+        with self.assertNumQueries(baseline):
+            self.client.get(reverse('route-trips', args=[large.pk]))
+
+    def test_bus_schedules_query_count_is_constant(self):
+        add_trips(create_route("1D"), 2)
+        baseline = self.get_query_count(reverse('bus_schedules'))
+
+        for i in range(4):
+            add_trips(create_route(f"{i}X"), 3)
+        with self.assertNumQueries(baseline):
+            self.client.get(reverse('bus_schedules'))
+
+
+@isolated_cache
+class BusSchedulesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route("1D", n_stops=2, n_patterns=1)
+        self.pattern = TripPattern.objects.get(route=self.route)
+
+    def add_trip(self, departure, arrival):
+        BusTrip.objects.create(pattern=self.pattern, departure_time=departure, arrival_time=arrival)
+
+    def schedules(self):
+        response = self.client.get(reverse('bus_schedules'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_end_time_is_the_arrival_of_the_last_departure(self):
+        self.add_trip(time(6, 0), time(6, 30))
+        self.add_trip(time(23, 20), time(23, 55))
+        self.add_trip(time(23, 40), time(0, 10))
+        [schedule] = self.schedules()
+        self.assertEqual((schedule['routeNo'], schedule['startTime'], schedule['endTime']), ("1D", "06:00", "00:10"))
+
+    def test_headways(self):
+        for hhmm in ("06:00", "06:30", "07:00", "07:10", "07:20", "07:30", "12:00"):
+            departure = time(*map(int, hhmm.split(':')))
+            self.add_trip(departure, time(departure.hour, departure.minute + 20))
+        [schedule] = self.schedules()
+        self.assertEqual(schedule['frequency'], "60 mins")
+        self.assertEqual(schedule['headways'], [
+            {'period': "Early morning", 'start': "00:00", 'end': "07:00", 'trips': 2, 'frequency': "30 mins"},
+            {'period': "Morning peak", 'start': "07:00", 'end': "10:00", 'trips': 4, 'frequency': "10 mins"},
+            {'period': "Midday", 'start': "10:00", 'end': "16:00", 'trips': 1, 'frequency': "N/A"},
+        ])
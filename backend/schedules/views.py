@@ -1,47 +1,92 @@
 from django.shortcuts import render
 from rest_framework.decorators import api_view
-from sroutes.models import BusRoute
-from froutes.models import BusTrip
+from django.db.models import Count, Max, Min, Prefetch
+from froutes.models import BusTrip, BusTripStopTime
+from sroutes.models import TripPattern
 from rest_framework.response import Response
 from rest_framework import generics
 from froutes.serializers import BusTripSerializer
+from transport.cache import cached_response
 
 
 
 # Create your views here.
+
+# (label, start hour, end hour) bands used for per-period headways
+HEADWAY_PERIODS = [
+    ("Early morning", 0, 7),
+    ("Morning peak", 7, 10),
+    ("Midday", 10, 16),
+    ("Evening peak", 16, 20),
+    ("Night", 20, 24),
+]
+
+
+def minutes_of(t):
+    return t.hour * 60 + t.minute
+
+
+def format_frequency(span_minutes, trips):
+    return f"{round(span_minutes / (trips - 1))} mins" if trips > 1 else "N/A"
+
+
+def period_headways(departures):
+    """Headway per time band for one route's departures (sorted minutes after midnight)."""
+    headways = []
+    for label, start_hour, end_hour in HEADWAY_PERIODS:
+        band = [m for m in departures if start_hour * 60 <= m < end_hour * 60]
+        if not band:
+            continue
+        headways.append({
+            "period": label,
+            "start": f"{start_hour:02d}:00",
+            "end": f"{end_hour % 24:02d}:00",
+            "trips": len(band),
+            "frequency": format_frequency(band[-1] - band[0], len(band)),
+        })
+    return headways
+
+
+@cached_response
 @api_view(['GET'])
 def bus_schedules(request):
     """
-    Returns bus schedule with routeNo, startTime, endTime, frequency
+    Returns bus schedule with routeNo, startTime, endTime, frequency and
+    per-period headways, using one grouped aggregate and one departure scan.
     """
-    schedules = []
+    summaries = (
+        BusTrip.objects.values('pattern__route_id', 'pattern__route__name')
+        .annotate(
+            first_departure=Min('departure_time'),
+            last_departure=Max('departure_time'),
+            total_trips=Count('id'),
+        )
+        .order_by('pattern__route_id')
+    )
+
+    departures = {}
+    # endTime is when the last departing trip arrives; Max('arrival_time')
+    # would pick 23:55 over a last trip arriving at 00:10
+    last_arrivals = {}
+    for route_id, departure_time, arrival_time in (
+        BusTrip.objects.order_by('pattern__route_id', 'departure_time')
+        .values_list('pattern__route_id', 'departure_time', 'arrival_time')
+    ):
+        departures.setdefault(route_id, []).append(minutes_of(departure_time))
+        last_arrivals[route_id] = arrival_time
 
-    routes = BusRoute.objects.all()
-
-    for route in routes:
-        # Fetch all trips for this route
-        trips = BusTrip.objects.filter(pattern__route=route).order_by("departure_time")
-
-        if trips.exists():
-            first_trip = trips.first()
-            last_trip = trips.last()
-
-            # Calculate frequency (rough estimate: total duration / number of trips)
-            total_trips = trips.count()
-            if total_trips > 1:
-                start = first_trip.departure_time
-                end = last_trip.departure_time
-                total_minutes = (end.hour * 60 + end.minute) - (start.hour * 60 + start.minute)
-                frequency = f"{round(total_minutes / (total_trips - 1))} mins"
-            else:
-                frequency = "N/A"
-            schedules.append({
-                'route_id':route.id,
-                "routeNo": route.name,
-                "startTime": first_trip.departure_time.strftime("%H:%M"),
-                "endTime": last_trip.arrival_time.strftime("%H:%M"),
-                "frequency": frequency
-            })
+    schedules = []
+    for summary in summaries:
+        route_id = summary['pattern__route_id']
+        start, end = summary['first_departure'], summary['last_departure']
+        schedules.append({
+            'route_id': route_id,
+            "routeNo": summary['pattern__route__name'],
+            "startTime": start.strftime("%H:%M"),
+            "endTime": last_arrivals[route_id].strftime("%H:%M"),
+            "frequency": format_frequency(minutes_of(end) - minutes_of(start), summary['total_trips']),
+            "headways": period_headways(departures.get(route_id, [])),
+        })
 
     return Response(schedules)
 
@@ -50,4 +95,9 @@ class RouteTripsView(generics.ListAPIView):
 
     def get_queryset(self):
         route_id = self.kwargs['pk']
-        return BusTrip.objects.filter(pattern__route_id=route_id)
+        # Filtering on pattern_id (not through the pattern join) walks the
+        # (pattern, departure_time) index in order, without a sort
+        patterns = TripPattern.objects.filter(route_id=route_id).values('id')
+        return BusTrip.objects.filter(pattern_id__in=patterns).order_by('pattern_id', 'departure_time').prefetch_related(
+            Prefetch('stop_times', queryset=BusTripStopTime.objects.select_related('stop'))
+        )
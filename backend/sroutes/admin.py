@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BusRoute,TripPattern,TripPatternStop,Fare,RouteShape,PassPlan,UserTypeDiscount
+from .models import BusRoute,TripPattern,TripPatternStop,Fare,RouteShape,PassPlan,UserTypeDiscount,FareBand
 # Register your models here.
 
 admin.site.register(BusRoute)
@@ -8,4 +8,5 @@ admin.site.register(TripPatternStop)
 admin.site.register(Fare)
 admin.site.register(RouteShape)
 admin.site.register(PassPlan)
-admin.site.register(UserTypeDiscount)
\ No newline at end of file
+admin.site.register(UserTypeDiscount)
+admin.site.register(FareBand)
\ No newline at end of file
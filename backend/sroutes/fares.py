@@ -0,0 +1,108 @@
+"""
+Process-local fare, discount and pass plan tables.
+
+The tables are tiny and read on every fare estimate or pass quote, so they
+are loaded once and rebuilt after a ``Fare``, ``UserTypeDiscount`` or
+``PassPlan`` save in this process, or when the shared timetable version
+moves (bulk imports). All arithmetic stays in ``Decimal``.
+"""
+import threading
+from bisect import bisect_left
+from decimal import Decimal
+
+from transport.cache import timetable_version
+from .models import Fare, UserTypeDiscount, PassPlan
+
+DEFAULT_BASE_FARE = Decimal('20.00')
+MINIMUM_FARE = Decimal('10.00')
+TRANSFER_FEE = Decimal('10.00')  # policy: per transfer (can be 0 for first transfer free)
+FIRST_TRANSFER_FREE = True
+NO_DISCOUNT = Decimal('0.00')
+CENT = Decimal('0.01')
+
+
+def band_fare(limits, amounts, distance_m):
+    """Fare of the first band whose limit (meters) covers ``distance_m``; the last band caps longer rides."""
+    return amounts[min(bisect_left(limits, distance_m), len(amounts) - 1)]
+
+
+class FareTables:
+    def __init__(self, fares, discounts, plans=()):
+        self.plans = list(plans)
+        self.fares = {}
+        for route_id, amount in fares:
+            # The first fare of a route wins, as Fare.objects.filter(route=...).first() did
+            self.fares.setdefault(route_id, amount)
+        self.discounts = dict(discounts)
+
+    @classmethod
+    def from_database(cls):
+        return cls(
+            Fare.objects.order_by('id').values_list('route_id', 'amount'),
+            UserTypeDiscount.objects.values_list('user_type', 'discount_pct'),
+            PassPlan.objects.order_by('price', 'id').values_list('name', 'period', 'price'),
+        )
+
+    def base_fare(self, route_id):
+        return self.fares.get(route_id, DEFAULT_BASE_FARE)
+
+    def discount(self, user_type):
+        return self.discounts.get(user_type, NO_DISCOUNT)
+
+    def trip_cost(self, user_type, per_trip_cost=DEFAULT_BASE_FARE):
+        """Pay-as-you-go price of one trip after the user type's discount."""
+        return (per_trip_cost * (Decimal('1.00') - self.discount(user_type))).quantize(CENT)
+
+    def estimate(self, route_id, transfers=0, user_type='default'):
+        """The fare_estimate response body for one ride."""
+        base = self.base_fare(route_id)
+
+        transfer_charge = Decimal('0.00')
+        if transfers > 0:
+            effective_transfers = transfers - 1 if FIRST_TRANSFER_FREE else transfers
+            if effective_transfers > 0:
+                transfer_charge = TRANSFER_FEE * Decimal(effective_transfers)
+
+        subtotal = base + transfer_charge
+        discount_pct = self.discount(user_type)
+        discount_amt = (subtotal * discount_pct).quantize(CENT)
+        total = max(MINIMUM_FARE, (subtotal - discount_amt).quantize(CENT))
+
+        return {
+            'route_id': route_id,
+            'user_type': user_type,
+            'breakdown': {
+                'base_fare': str(base),
+                'transfer_fare': str(transfer_charge),
+                'discount_pct': str(discount_pct),
+                'discount_amount': str(discount_amt),
+                'subtotal': str(subtotal),
+            },
+            'total': str(total)
+        }
+
+
+# ----------------------
+# Process-local cache
+# ----------------------
+_lock = threading.Lock()
+_tables = None
+_version = None
+
+
+def get_fare_tables():
+    global _tables, _version
+    version = timetable_version()
+    tables = _tables
+    if tables is None or _version != version:
+        with _lock:
+            if _tables is None or _version != version:
+                _tables = FareTables.from_database()
+                _version = version
+            tables = _tables
+    return tables
+
+
+def invalidate_fare_tables(**kwargs):
+    global _tables
+    _tables = None
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('home', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PassPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('period', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=10)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=7)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserTypeDiscount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_type', models.CharField(choices=[('default', 'Default'), ('student', 'Student'), ('senior', 'Senior')], max_length=20, unique=True)),
+                ('discount_pct', models.DecimalField(decimal_places=2, help_text='0.50 for 50%', max_digits=4)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BusRoute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('gtfs_id', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('end_stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='routes_ending', to='home.stop')),
+                ('start_stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='routes_starting', to='home.stop')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Fare',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fares', to='sroutes.busroute')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RouteShape',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('coordinates', models.JSONField(help_text='List of [lat, lng] pairs representing route shape')),
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='shape', to='sroutes.busroute')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TripPattern',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trip_patterns', to='sroutes.busroute')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TripPatternStop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stop_order', models.PositiveIntegerField()),
+                ('shape_index', models.PositiveIntegerField(blank=True, help_text="Nearest vertex in the route's RouteShape", null=True)),
+                ('shape_distance_m', models.FloatField(blank=True, help_text='Distance along the route shape to shape_index, in meters', null=True)),
+                ('pattern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pattern_stops', to='sroutes.trippattern')),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.stop')),
+            ],
+            options={
+                'ordering': ['stop_order'],
+            },
+        ),
+        migrations.AddField(
+            model_name='trippattern',
+            name='stops',
+            field=models.ManyToManyField(through='sroutes.TripPatternStop', to='home.stop'),
+        ),
+        migrations.CreateModel(
+            name='FareBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_distance_km', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('route', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fare_bands', to='sroutes.busroute')),
+            ],
+            options={
+                'ordering': ['route_id', 'max_distance_km'],
+                'constraints': [models.UniqueConstraint(fields=('route', 'max_distance_km'), name='sroutes_fareband_route_distance')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='trippatternstop',
+            index=models.Index(fields=['pattern', 'stop_order'], name='sroutes_patstop_pattern_order'),
+        ),
+    ]
@@ -8,6 +8,8 @@ class BusRoute(models.Model):
     name = models.CharField(max_length=100)
     start_stop = models.ForeignKey(Stop, related_name="routes_starting", on_delete=models.CASCADE)
     end_stop = models.ForeignKey(Stop, related_name="routes_ending", on_delete=models.CASCADE)
+    # route_id in the GTFS feed this route was imported from, so re-imports update it
+    gtfs_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -28,9 +30,14 @@ class TripPatternStop(models.Model):
     pattern = models.ForeignKey(TripPattern, related_name="pattern_stops", on_delete=models.CASCADE)
     stop = models.ForeignKey(Stop, on_delete=models.CASCADE)
     stop_order = models.PositiveIntegerField()
+    shape_index = models.PositiveIntegerField(null=True, blank=True, help_text="Nearest vertex in the route's RouteShape")
+    shape_distance_m = models.FloatField(null=True, blank=True, help_text="Distance along the route shape to shape_index, in meters")
 
     class Meta:
         ordering = ['stop_order']
+        indexes = [
+            models.Index(fields=['pattern', 'stop_order'], name='sroutes_patstop_pattern_order'),
+        ]
 
     def __str__(self):
         return f"{self.pattern} - {self.stop.name} ({self.stop_order})"
@@ -43,6 +50,11 @@ class RouteShape(models.Model):
     route = models.OneToOneField(BusRoute, related_name='shape', on_delete=models.CASCADE)
     coordinates = models.JSONField(help_text="List of [lat, lng] pairs representing route shape")
 
+    def save(self, *args, **kwargs):
+        # Stored as numbers, whatever the source handed us (older imports wrote strings)
+        self.coordinates = [[float(lat), float(lng)] for lat, lng in self.coordinates or []]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Shape for {self.route.name}"
 
@@ -58,6 +70,27 @@ class Fare(models.Model):
         return f"{self.route.name} - ₹{self.amount}"
 
 
+class FareBand(models.Model):
+    """
+    Distance-based fare stage: a ride of up to ``max_distance_km`` along the
+    route costs ``amount``. Bands without a route apply to every route that
+    has none of its own; rides longer than the last band pay the last band.
+    """
+    route = models.ForeignKey(BusRoute, related_name="fare_bands", on_delete=models.CASCADE, null=True, blank=True)
+    max_distance_km = models.DecimalField(max_digits=6, decimal_places=2)
+    amount = models.DecimalField(max_digits=5, decimal_places=2)
+
+    class Meta:
+        ordering = ['route_id', 'max_distance_km']
+        constraints = [
+            models.UniqueConstraint(fields=['route', 'max_distance_km'], name='sroutes_fareband_route_distance'),
+        ]
+
+    def __str__(self):
+        scope = self.route.name if self.route_id else "All routes"
+        return f"{scope} - up to {self.max_distance_km} km: ₹{self.amount}"
+
+
 # ----------------------
 # Fare: Passes and Discounts
 # ----------------------
@@ -0,0 +1,140 @@
+"""
+Pass recommendations over a rider's usage.
+
+Usage is a per-day trip history, or a histogram of trips per day over a
+month. Each plan's break-even and stand-alone cost are computed for all
+plans at once with numpy. The cheapest mix of passes and pay-as-you-go days
+comes from a dynamic program over the days: covering day ``i`` costs
+either that day's fares, or a pass bought ``period`` days earlier. Plans
+are only *chosen* in floating point; the returned amounts are recomputed in
+``Decimal``.
+"""
+from decimal import Decimal
+
+import numpy as np
+
+PERIOD_DAYS = {'daily': 1, 'weekly': 7, 'monthly': 30}
+MONTH_DAYS = 30
+MAX_HISTORY_DAYS = 366
+CENT = Decimal('0.01')
+
+
+def usage_history(trips_per_day=None, history=None, distribution=None):
+    """
+    Trips per day as a float array from exactly one of: a constant daily
+    rate over a month, a per-day ``history`` list, or a ``distribution``
+    mapping trips per day to a number of days. Raises ValueError.
+    """
+    if history is not None:
+        days = np.asarray([float(t) for t in history], dtype=np.float64)
+    elif distribution is not None:
+        items = distribution.items() if isinstance(distribution, dict) else distribution
+        counts = [(float(trips), int(days)) for trips, days in items]
+        if any(days < 0 for _, days in counts):
+            raise ValueError("distribution day counts must not be negative")
+        days = spread(np.repeat([t for t, _ in counts], [d for _, d in counts]))
+    elif trips_per_day is not None:
+        days = np.full(MONTH_DAYS, float(trips_per_day))
+    else:
+        raise ValueError("Send trips_per_day, trip_history or trip_distribution")
+
+    if not 0 < len(days) <= MAX_HISTORY_DAYS:
+        raise ValueError(f"Usage must cover between 1 and {MAX_HISTORY_DAYS} days")
+    if (days < 0).any() or not np.isfinite(days).all():
+        raise ValueError("Trip counts must be non-negative numbers")
+    return days
+
+
+def spread(days):
+    """
+    Lay a histogram's days out so every week gets a similar mix of busy and
+    quiet days: the busiest days go to the first day of each week, the next
+    busiest to the second, and so on.
+    """
+    n = len(days)
+    slots = sorted(range(n), key=lambda i: (i % 7, i))
+    laid_out = np.empty(n, dtype=np.float64)
+    laid_out[slots] = np.sort(days)[::-1]
+    return laid_out
+
+
+def cheapest_cover(history, trip_cost, periods, prices):
+    """(cost, {plan index: passes bought}, indexes of days with trips paid per trip) of the cheapest cover."""
+    n = len(history)
+    fares = history * trip_cost
+    cost = np.zeros(n + 1)
+    choice = np.full(n, -1)
+    for i in range(1, n + 1):
+        cost[i] = cost[i - 1] + fares[i - 1]
+        if len(prices):
+            options = cost[np.maximum(i - periods, 0)] + prices
+            k = int(np.argmin(options))
+            if options[k] < cost[i]:
+                cost[i] = options[k]
+                choice[i - 1] = k
+
+    passes, paid_days = {}, []
+    i = n
+    while i > 0:
+        k = int(choice[i - 1])
+        if k < 0:
+            if history[i - 1]:
+                paid_days.append(i - 1)
+            i -= 1
+        else:
+            passes[k] = passes.get(k, 0) + 1
+            i = max(i - int(periods[k]), 0)
+    return cost[n], passes, paid_days
+
+
+def quote_passes(plans, history, trip_cost):
+    """
+    Compare ``plans`` ((name, period, price) rows) and pay-as-you-go at
+    ``trip_cost`` per trip over ``history``. Plans with an unknown period
+    are ignored.
+    """
+    plans = [plan for plan in plans if plan[1] in PERIOD_DAYS]
+    periods = np.array([PERIOD_DAYS[period] for _, period, _ in plans], dtype=np.int64)
+    prices = np.array([float(price) for _, _, price in plans], dtype=np.float64)
+    n = len(history)
+    unit = float(trip_cost)
+
+    break_even = prices / (unit * periods) if unit > 0 else np.full(len(plans), np.inf)
+    alone = np.ceil(n / periods) * prices if len(plans) else prices
+
+    _, passes, paid_days = cheapest_cover(history, unit, periods, prices)
+    paid_trips = Decimal(str(float(history[paid_days].sum()))) if paid_days else Decimal('0')
+    paid = (paid_trips * trip_cost).quantize(CENT)
+    pass_cost = sum((plans[k][2] * count for k, count in passes.items()), Decimal('0.00'))
+    pay_as_you_go = (Decimal(str(float(history.sum()))) * trip_cost).quantize(CENT)
+    total = (pass_cost + paid).quantize(CENT)
+
+    rows = [
+        {
+            'plan': name,
+            'period': period,
+            'price': str(price),
+            'break_even_trips_per_day': str(Decimal(str(break_even[k])).quantize(CENT)) if np.isfinite(break_even[k]) else None,
+            'cost_alone': str(Decimal(str(alone[k])).quantize(CENT)),
+        }
+        for k, (name, period, price) in enumerate(plans)
+    ]
+    # The pass covering the most days of the cheapest mix, if any
+    covering = max(passes, key=lambda k: passes[k] * periods[k], default=None)
+    return {
+        'days': n,
+        'total_trips': float(history.sum()),
+        'plans': rows,
+        'pay_as_you_go': str(pay_as_you_go),
+        'best': {
+            'total_cost': str(total),
+            'passes': [
+                {'plan': plans[k][0], 'period': plans[k][1], 'count': count}
+                for k, count in sorted(passes.items())
+            ],
+            'pay_as_you_go_days': len(paid_days),
+            'pay_as_you_go_cost': str(paid),
+            'savings': str(pay_as_you_go - total),
+        },
+        'recommendation': rows[covering] if covering is not None else None,
+    }
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from home.serializers import StopSerializer
 from .models import BusRoute, TripPattern, TripPatternStop, RouteShape, Fare, PassPlan, UserTypeDiscount
+from .shapes import shape_array, render_shape
 
 
 class TripPatternStopSerializer(serializers.ModelSerializer):
@@ -26,10 +27,16 @@ class FareSerializer(serializers.ModelSerializer):
 
 
 class RouteShapeSerializer(serializers.ModelSerializer):
+    """``coordinates`` as float pairs, or a polyline string, per the view's ``shape_format`` context."""
+
     class Meta:
         model = RouteShape
         fields = ['coordinates']
 
+    def to_representation(self, instance):
+        polyline, tolerance = self.context.get('shape_format', (False, 0.0))
+        return {'coordinates': render_shape(shape_array(instance.coordinates or []), polyline, tolerance)}
+
 
 class PassPlanSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,138 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+POLYLINE_PRECISION = 5
+SHAPE_FORMATS = ('coordinates', 'polyline')
+# Query parameters read by shape_format, with their cache key normalizers
+SHAPE_PARAMS = {'shape_format': str, 'tolerance': float}
+
+
+def shape_array(coordinates):
+    """``RouteShape.coordinates`` as a contiguous (n, 2) float64 array of lat/lng."""
+    points = np.ascontiguousarray(np.asarray(coordinates, dtype=np.float64))
+    return points.reshape(-1, 2)
+
+
+def nearest_vertices(points, stops):
+    """Nearest vertex index for each (lat, lng) row of ``stops`` in one pass."""
+    stops = np.asarray(stops, dtype=np.float64).reshape(-1, 2)
+    if not len(points) or not len(stops):
+        return np.zeros(len(stops), dtype=np.int32)
+    dy = points[None, :, 0] - stops[:, None, 0]
+    dx = (points[None, :, 1] - stops[:, None, 1]) * np.cos(np.radians(stops[:, None, 0]))
+    return np.argmin(dx * dx + dy * dy, axis=1).astype(np.int32)
+
+
+def cumulative_distances(points):
+    """Haversine distance in meters from the first vertex to every vertex along the shape."""
+    if len(points) < 2:
+        return np.zeros(len(points), dtype=np.float64)
+    lat = np.radians(points[:, 0])
+    lng = np.radians(points[:, 1])
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lng) / 2) ** 2
+    steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def project_stops(points, stops):
+    """
+    (shape_index, shape_distance_m) for each (lat, lng) in ``stops``, or
+    (None, None) pairs when the shape is empty.
+    """
+    if not len(points):
+        return [(None, None)] * len(stops)
+    indices = nearest_vertices(points, stops)
+    distances = cumulative_distances(points)[indices]
+    return [(int(i), float(d)) for i, d in zip(indices, distances)]
+
+
+def simplify(points, tolerance):
+    """
+    Douglas–Peucker simplification of an (n, 2) lat/lng array. ``tolerance``
+    is in degrees of latitude; longitudes are scaled by the cosine of the
+    mean latitude so the test is isotropic at city scale.
+    """
+    n = len(points)
+    if n < 3:
+        return points
+    scale = np.cos(np.radians(points[:, 0].mean()))
+    xy = np.column_stack((points[:, 1] * scale, points[:, 0]))
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = xy[b] - xy[a]
+        rel = xy[a + 1:b] - xy[a]
+        length = np.hypot(*seg)
+        if length == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = a + 1 + i
+            keep[mid] = True
+            stack.append((a, mid))
+            stack.append((mid, b))
+    return points[keep]
+
+
+# ----------------------
+# Encoded polylines
+# ----------------------
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    """Google encoded polyline string for an (n, 2) lat/lng array."""
+    if not len(points):
+        return ''
+    scaled = np.floor(np.asarray(points, dtype=np.float64) * 10 ** precision + 0.5).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    values, value, shift = [], 0, 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    points = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0)
+    return points / 10 ** precision
+
+
+def shape_format(params):
+    """
+    (polyline, tolerance) from the ``shape_format`` and ``tolerance`` (meters)
+    query parameters; the tolerance is returned in degrees for ``simplify``.
+    Raises ValueError for bad values.
+    """
+    fmt = params.get('shape_format') or SHAPE_FORMATS[0]
+    if fmt not in SHAPE_FORMATS:
+        raise ValueError(f"shape_format must be one of {', '.join(SHAPE_FORMATS)}")
+    try:
+        tolerance = float(params.get('tolerance') or 0)
+    except ValueError:
+        raise ValueError("tolerance must be a number of meters")
+    if tolerance < 0:
+        raise ValueError("tolerance must not be negative")
+    return fmt == 'polyline', tolerance / METERS_PER_DEGREE_LAT
+
+
+def render_shape(points, polyline=False, tolerance=0.0):
+    """A shape array as served by the API: simplified if asked, then a polyline or [lat, lng] pairs."""
+    if tolerance > 0:
+        points = simplify(points, tolerance)
+    return encode_polyline(points) if polyline else points.tolist()
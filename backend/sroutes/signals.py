@@ -0,0 +1,61 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from home.models import Stop
+from .fares import invalidate_fare_tables
+from .models import BusRoute, RouteShape, Fare, UserTypeDiscount, PassPlan
+from .shapes import shape_array
+from .tiles import bbox_of, discard_tiles, STOP_MIN_ZOOM
+
+
+def shape_bbox(coordinates):
+    return bbox_of(shape_array(coordinates or []))
+
+
+def stop_bbox(lat, lng):
+    return lat, lng, lat, lng
+
+
+# ----------------------
+# Map tiles
+# ----------------------
+@receiver(pre_save, sender=RouteShape, dispatch_uid='sroutes.remember_shape_bbox')
+def remember_shape_bbox(sender, instance, **kwargs):
+    old = RouteShape.objects.filter(pk=instance.pk).values_list('coordinates', flat=True).first() if instance.pk else None
+    instance._tile_bbox = shape_bbox(old)
+
+
+@receiver([post_save, post_delete], sender=RouteShape, dispatch_uid='sroutes.shape_changed')
+def shape_changed(sender, instance, **kwargs):
+    discard_tiles([getattr(instance, '_tile_bbox', None), shape_bbox(instance.coordinates)])
+
+
+@receiver(post_save, sender=BusRoute, dispatch_uid='sroutes.route_changed')
+def route_changed(sender, instance, **kwargs):
+    # Tiles carry the route name; a deleted route's shape goes through shape_changed
+    coordinates = RouteShape.objects.filter(route_id=instance.pk).values_list('coordinates', flat=True).first()
+    if coordinates:
+        discard_tiles([shape_bbox(coordinates)])
+
+
+@receiver(pre_save, sender=Stop, dispatch_uid='sroutes.remember_stop_bbox')
+def remember_stop_bbox(sender, instance, **kwargs):
+    old = Stop.objects.filter(pk=instance.pk).values_list('latitude', 'longitude').first() if instance.pk else None
+    instance._tile_bbox = stop_bbox(*old) if old else None
+
+
+@receiver([post_save, post_delete], sender=Stop, dispatch_uid='sroutes.stop_changed')
+def stop_changed(sender, instance, **kwargs):
+    discard_tiles(
+        [getattr(instance, '_tile_bbox', None), stop_bbox(instance.latitude, instance.longitude)],
+        min_zoom=STOP_MIN_ZOOM,
+    )
+
+
+# ----------------------
+# Fare tables
+# ----------------------
+@receiver([post_save, post_delete], sender=Fare, dispatch_uid='sroutes.fare_changed')
+@receiver([post_save, post_delete], sender=UserTypeDiscount, dispatch_uid='sroutes.discount_changed')
+@receiver([post_save, post_delete], sender=PassPlan, dispatch_uid='sroutes.pass_plan_changed')
+def fares_changed(sender, **kwargs):
+    invalidate_fare_tables()
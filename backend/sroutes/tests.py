@@ -1,3 +1,341 @@
-from django.test import TestCase
+import itertools
+import tempfile
+from decimal import Decimal
+from unittest import mock
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from home.models import Stop
+from transport.cache import bump_timetable_version
+from transport.testing import isolated_cache
+from .models import BusRoute, TripPattern, TripPatternStop, RouteShape, Fare, PassPlan, UserTypeDiscount
+from .passes import cheapest_cover, quote_passes, usage_history
+from .shapes import (
+    encode_polyline, decode_polyline, simplify, shape_format, nearest_vertices, cumulative_distances, project_stops,
+    shape_array, EARTH_RADIUS_M, METERS_PER_DEGREE_LAT,
+)
+from .tiles import tile_of, tile_path, TileSource, STOP_MIN_ZOOM
+from .views import MAX_BATCH_ESTIMATES
 
-# Create your tests here.
+
+def create_route(name, n_stops=5, n_patterns=2):
+    stops = [Stop.objects.create(name=f"{name} {i}", latitude=23.0 + i / 100, longitude=72.5) for i in range(n_stops)]
+    route = BusRoute.objects.create(name=name, start_stop=stops[0], end_stop=stops[-1])
+    RouteShape.objects.create(route=route, coordinates=[[s.latitude, s.longitude] for s in stops])
+    Fare.objects.create(route=route, amount='20.00')
+    for _ in range(n_patterns):
+        pattern = TripPattern.objects.create(route=route)
+        for order, stop in enumerate(stops, start=1):
+            TripPatternStop.objects.create(pattern=pattern, stop=stop, stop_order=order)
+    return route
+
+
+@isolated_cache
+class BusRouteQueryCountTests(TestCase):
+    """The route endpoints must not issue per-row queries as the network grows."""
+
+    def get_query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_query_count_is_constant(self):
+        create_route("1D")
+        baseline = self.get_query_count(reverse('bus-route-list'))
+
+        for i in range(5):
+            create_route(f"{i}X", n_stops=8, n_patterns=3)
+        with self.assertNumQueries(baseline):
+            self.client.get(reverse('bus-route-list'))
+
+    def test_detail_query_count_is_constant(self):
+        small = create_route("1D", n_stops=2, n_patterns=1)
+        large = create_route("2D", n_stops=12, n_patterns=4)
+        baseline = self.get_query_count(reverse('bus-route-detail', args=[small.pk]))
+
+        with self.assertNumQueries(baseline):
+            self.client.get(reverse('bus-route-detail', args=[large.pk]))
+
+
+class PolylineTests(TestCase):
+    # The worked example from Google's encoded polyline format documentation
+    POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    ENCODED = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+    def test_encode(self):
+        self.assertEqual(encode_polyline(np.array(self.POINTS)), self.ENCODED)
+        self.assertEqual(encode_polyline(np.empty((0, 2))), '')
+
+    def test_round_trip(self):
+        points = np.array([[23.02251, 72.57136], [23.02251, 72.57136], [22.99999, 72.6], [-0.00001, -179.99999]])
+        np.testing.assert_allclose(decode_polyline(encode_polyline(points)), points, atol=1e-9)
+        np.testing.assert_allclose(decode_polyline(self.ENCODED), self.POINTS, atol=1e-9)
+
+    def test_precision(self):
+        encoded = encode_polyline(np.array(self.POINTS), precision=6)
+        np.testing.assert_allclose(decode_polyline(encoded, precision=6), self.POINTS, atol=1e-9)
+
+    def test_simplify_keeps_the_ends(self):
+        points = np.array([[23.0, 72.5], [23.00001, 72.505], [23.0, 72.51], [23.01, 72.52]])
+        simplified = simplify(points, 1 / METERS_PER_DEGREE_LAT * 5)
+        np.testing.assert_array_equal(simplified, points[[0, 2, 3]])
+
+    def test_shape_format(self):
+        self.assertEqual(shape_format({}), (False, 0.0))
+        polyline, tolerance = shape_format({'shape_format': 'polyline', 'tolerance': '10'})
+        self.assertTrue(polyline)
+        self.assertAlmostEqual(tolerance, 10 / METERS_PER_DEGREE_LAT)
+        for params in ({'shape_format': 'svg'}, {'tolerance': 'far'}, {'tolerance': '-1'}):
+            with self.assertRaises(ValueError):
+                shape_format(params)
+
+
+@isolated_cache
+class NearestVertexTests(TestCase):
+    def setUp(self):
+        self.points = np.array([[23.0 + i / 1000, 72.5] for i in range(10)])
+
+    def test_matches_a_scan(self):
+        rng = np.random.default_rng(3)
+        stops = np.column_stack((rng.uniform(23.0, 23.009, 50), rng.uniform(72.499, 72.501, 50)))
+        expected = [int(np.argmin(np.hypot(self.points[:, 0] - lat, self.points[:, 1] - lng))) for lat, lng in stops]
+        self.assertEqual(nearest_vertices(self.points, stops).tolist(), expected)
+
+    def test_longitude_is_scaled_by_latitude(self):
+        # 0.008 degrees of longitude at 60N is 0.004 degrees of latitude, nearer than 0.005
+        points = np.array([[60.005, 10.0], [60.0, 10.008]])
+        self.assertEqual(nearest_vertices(points, [(60.0, 10.0)]).tolist(), [1])
+
+    def test_out_of_order_stops(self):
+        stops = [(23.0081, 72.5), (23.0002, 72.5001), (23.0049, 72.4999)]
+        self.assertEqual(nearest_vertices(self.points, stops).tolist(), [8, 0, 5])
+
+    def test_empty_inputs(self):
+        self.assertEqual(nearest_vertices(self.points, []).tolist(), [])
+        self.assertEqual(nearest_vertices(np.zeros((0, 2)), [(23.0, 72.5), (23.1, 72.5)]).tolist(), [0, 0])
+
+
+class ShapeDistanceTests(TestCase):
+    def test_cumulative_distances(self):
+        step = EARTH_RADIUS_M * np.radians(0.01)
+        points = shape_array([[23.0, 72.5], [23.01, 72.5], [23.01, 72.5], [23.03, 72.5]])
+        np.testing.assert_allclose(cumulative_distances(points), [0, step, step, 3 * step])
+        # Along a parallel the haversine shrinks with the cosine of the latitude
+        east = cumulative_distances(shape_array([[60.0, 10.0], [60.0, 10.01]]))
+        self.assertAlmostEqual(east[1] / step, 0.5, places=4)
+
+    def test_short_shapes(self):
+        self.assertEqual(cumulative_distances(shape_array([])).tolist(), [])
+        self.assertEqual(cumulative_distances(shape_array([[23.0, 72.5]])).tolist(), [0.0])
+
+    def test_project_stops(self):
+        points = shape_array([[23.0 + i / 1000, 72.5] for i in range(5)])
+        distances = cumulative_distances(points)
+        offsets = project_stops(points, [(23.0041, 72.5001), (22.99, 72.5), (23.0019, 72.5)])
+        self.assertEqual(offsets, [(4, distances[4]), (0, 0.0), (2, distances[2])])
+        self.assertIsInstance(offsets[0][0], int)
+        self.assertIsInstance(offsets[0][1], float)
+
+    def test_project_stops_without_a_shape(self):
+        self.assertEqual(project_stops(shape_array([]), [(23.0, 72.5)] * 2), [(None, None)] * 2)
+
+
+class RouteShapeFormatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route("1D")
+
+    def test_coordinates_by_default(self):
+        shape = self.client.get(reverse('bus-route-detail', args=[self.route.pk])).json()['shape']
+        self.assertEqual(shape['coordinates'], self.route.shape.coordinates)
+
+    def test_polyline(self):
+        response = self.client.get(reverse('bus-route-detail', args=[self.route.pk]), {'shape_format': 'polyline'})
+        encoded = response.json()['shape']['coordinates']
+        np.testing.assert_allclose(decode_polyline(encoded), self.route.shape.coordinates, atol=1e-9)
+
+    def test_invalid_format(self):
+        response = self.client.get(reverse('bus-route-list'), {'shape_format': 'svg'})
+        self.assertEqual(response.status_code, 400)
+
+
+def brute_force_cover(history, trip_cost, periods, prices):
+    """Cheapest cover found by trying every choice of pass (or none) starting on every day."""
+    n = len(history)
+    best = float(history.sum() * trip_cost)
+    for starts in itertools.product(range(-1, len(prices)), repeat=n):
+        covered = np.zeros(n, dtype=bool)
+        cost = 0.0
+        for day, k in enumerate(starts):
+            if k >= 0:
+                covered[day:day + periods[k]] = True
+                cost += prices[k]
+        best = min(best, cost + float(history[~covered].sum() * trip_cost))
+    return best
+
+
+class PassMixTests(TestCase):
+    PERIODS = np.array([1, 3])
+    PRICES = np.array([25.0, 55.0])
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        for _ in range(40):
+            history = rng.integers(0, 4, size=int(rng.integers(1, 7))).astype(np.float64)
+            cost, passes, paid_days = cheapest_cover(history, 10.0, self.PERIODS, self.PRICES)
+            self.assertAlmostEqual(cost, brute_force_cover(history, 10.0, self.PERIODS, self.PRICES), msg=history)
+            # The chosen passes and pay-as-you-go days add up to the cost
+            chosen = sum(self.PRICES[k] * count for k, count in passes.items()) + history[paid_days].sum() * 10.0
+            self.assertAlmostEqual(chosen, cost, msg=history)
+
+    def test_no_plans_pays_per_trip(self):
+        history = np.array([2.0, 0.0, 1.0])
+        cost, passes, paid_days = cheapest_cover(history, 10.0, np.array([], dtype=np.int64), np.array([]))
+        self.assertEqual((cost, passes, sorted(paid_days)), (30.0, {}, [0, 2]))
+
+    def test_usage_history(self):
+        np.testing.assert_array_equal(usage_history(trips_per_day=2), np.full(30, 2.0))
+        np.testing.assert_array_equal(usage_history(history=[1, 0, 3]), [1.0, 0.0, 3.0])
+        days = usage_history(distribution={'4': 2, '0': 12})
+        self.assertEqual(len(days), 14)
+        # The two busy days land in different weeks
+        self.assertEqual(list(np.flatnonzero(days)), [0, 7])
+        for kwargs in ({}, {'history': []}, {'history': [-1]}, {'history': [1] * 367}, {'distribution': {'1': -1}}):
+            with self.assertRaises(ValueError):
+                usage_history(**kwargs)
+
+    def test_quote(self):
+        plans = [("Day", 'daily', Decimal('25.00')), ("Week", 'weekly', Decimal('100.00')), ("Year", 'yearly', Decimal('1'))]
+        quote = quote_passes(plans, np.array([3.0] * 7 + [1.0] * 3), Decimal('10.00'))
+        self.assertEqual([row['plan'] for row in quote['plans']], ["Day", "Week"])
+        self.assertEqual(quote['pay_as_you_go'], '240.00')
+        self.assertEqual(quote['best']['total_cost'], '130.00')
+        self.assertEqual(quote['best']['passes'], [{'plan': "Week", 'period': 'weekly', 'count': 1}])
+        self.assertEqual(quote['best']['pay_as_you_go_days'], 3)
+        self.assertEqual(quote['best']['savings'], '110.00')
+        self.assertEqual(quote['recommendation']['plan'], "Week")
+
+
+@isolated_cache
+class PassQuoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        PassPlan.objects.create(name="Day", period='daily', price='25.00')
+        PassPlan.objects.create(name="Week", period='weekly', price='100.00')
+        UserTypeDiscount.objects.create(user_type='student', discount_pct='0.50')
+
+    def quote(self, **data):
+        return self.client.post(reverse('passes-quote'), data, content_type='application/json')
+
+    def test_history(self):
+        response = self.quote(trip_history=[3, 3, 3, 3, 3, 3, 3, 1, 1, 1], per_trip_cost='10.00')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['best']['total_cost'], '130.00')
+
+    def test_distribution_with_discount(self):
+        response = self.quote(trip_distribution={'2': 7}, per_trip_cost='10.00', user_type='student')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['per_trip_cost'], '5.00')
+        self.assertEqual(response.json()['best']['total_cost'], '70.00')
+        self.assertEqual(response.json()['best']['passes'], [])
+
+    def test_invalid_usage(self):
+        for data in ({}, {'trip_history': [-1]}, {'trips_per_day': 0}, {'trip_distribution': {'2': -3}}):
+            self.assertEqual(self.quote(**data).status_code, 400, data)
+
+
+@isolated_cache
+class MapTileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(override_settings(TILE_CACHE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.route = create_route("1D")
+        self.tile = (STOP_MIN_ZOOM, *tile_of(STOP_MIN_ZOOM, 23.0, 72.5))
+
+    def get_tile(self):
+        response = self.client.get(reverse('map-tile', args=self.tile))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def stop_names(self):
+        return {stop[1] for stop in self.get_tile()['stops']}
+
+    def test_tile_holds_stops_and_shapes(self):
+        tile = self.get_tile()
+        self.assertIn("1D 0", {stop[1] for stop in tile['stops']})
+        self.assertEqual([route['name'] for route in tile['routes']], ["1D"])
+        self.assertTrue(tile_path(*self.tile).exists())
+
+    def test_stop_save_discards_the_tile(self):
+        self.get_tile()
+        Stop.objects.create(name="New stop", latitude=23.0001, longitude=72.5001)
+        self.assertFalse(tile_path(*self.tile).exists())
+        self.assertIn("New stop", self.stop_names())
+
+    def test_version_bump_from_another_process_rebuilds_the_source(self):
+        self.get_tile()
+        # Another process bulk-created a stop and discarded the tile from the shared cache directory
+        Stop.objects.bulk_create([Stop(name="New stop", latitude=23.0001, longitude=72.5001)])
+        tile_path(*self.tile).unlink()
+        self.assertNotIn("New stop", self.stop_names())
+
+        tile_path(*self.tile).unlink()
+        bump_timetable_version()
+        self.assertIn("New stop", self.stop_names())
+
+    def test_tile_built_across_a_change_is_not_stored(self):
+        build = TileSource.tile
+
+        def build_during_change(source, *args):
+            bump_timetable_version()
+            return build(source, *args)
+
+        with mock.patch.object(TileSource, 'tile', build_during_change):
+            self.get_tile()
+        self.assertFalse(tile_path(*self.tile).exists())
+
+    def test_invalid_tile(self):
+        response = self.client.get(reverse('map-tile', args=[1, 2, 0]))
+        self.assertEqual(response.status_code, 404)
+
+
+@isolated_cache
+class FareEstimateBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route("1D")
+        UserTypeDiscount.objects.create(user_type='student', discount_pct='0.50')
+
+    def estimate(self, data):
+        return self.client.post(reverse('fare-estimate-batch'), data, content_type='application/json')
+
+    def test_results_follow_the_items(self):
+        response = self.estimate({'items': [
+            {'route_id': self.route.pk},
+            {'route_id': str(self.route.pk), 'transfers': 2, 'user_type': 'student'},
+            {'route_id': 0},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['total'] for r in response.json()['results']], ['20.00', '15.00', '20.00'])
+
+    def test_invalid_items_get_an_error_entry(self):
+        response = self.estimate([
+            {'transfers': 1},
+            {'route_id': "one"},
+            {'route_id': self.route.pk, 'transfers': -1},
+            {'route_id': self.route.pk, 'user_type': ["student"]},
+            "1D",
+            {'route_id': self.route.pk},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([set(r) for r in results[:5]], [{'error'}] * 5)
+        self.assertEqual(results[5]['total'], '20.00')
+
+    def test_batch_shape(self):
+        self.assertEqual(self.estimate({'items': "all"}).status_code, 400)
+        self.assertEqual(self.estimate([{'route_id': self.route.pk}] * (MAX_BATCH_ESTIMATES + 1)).status_code, 400)
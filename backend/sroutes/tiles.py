@@ -0,0 +1,244 @@
+"""
+Map tiles of stops and simplified route shapes.
+
+Tiles use the usual Web Mercator ``z/x/y`` scheme and are JSON documents::
+
+    {"stops": [[id, name, lat, lng], ...],
+     "routes": [{"id": ..., "name": ..., "lines": [[[lat, lng], ...], ...]}, ...]}
+
+Shapes are simplified with Douglas–Peucker to about a pixel at each zoom
+and cut to the tile (plus the neighbouring vertex on each side, so lines
+run off the edge instead of stopping short). Built tiles are written to
+``settings.TILE_CACHE_DIR``; a change to a shape, route or stop deletes
+only the cached tiles its geometry touched. The in-memory source follows
+the shared timetable version, so a worker never writes back tiles that
+another process has discarded.
+"""
+import json
+import math
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from home.models import Stop
+from transport.cache import timetable_version
+from .models import BusRoute, RouteShape
+from .shapes import shape_array, simplify
+
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+STOP_MIN_ZOOM = 13
+TILE_SIZE = 256
+TOLERANCE_PIXELS = 1.0
+
+
+# ----------------------
+# Tile math
+# ----------------------
+def is_valid_tile(z, x, y):
+    return MIN_ZOOM <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) of a tile in degrees."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+
+def tile_of(z, lat, lng):
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lng + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_range(z, bbox):
+    """Inclusive (x0, x1, y0, y1) of the tiles covering ``bbox``, padded by one tile."""
+    south, west, north, east = bbox
+    x0, y0 = tile_of(z, north, west)
+    x1, y1 = tile_of(z, south, east)
+    last = 2 ** z - 1
+    return max(x0 - 1, 0), min(x1 + 1, last), max(y0 - 1, 0), min(y1 + 1, last)
+
+
+def bbox_of(points):
+    if not len(points):
+        return None
+    (south, west), (north, east) = points.min(axis=0), points.max(axis=0)
+    return float(south), float(west), float(north), float(east)
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def tolerance_for(z):
+    return TOLERANCE_PIXELS * 360 / (TILE_SIZE * 2 ** z)
+
+
+# ----------------------
+# Tile building
+# ----------------------
+class TileSource:
+    """Stops and route shapes held in memory, with shapes simplified once per zoom."""
+
+    def __init__(self, stops, routes):
+        self.stop_ids = [s[0] for s in stops]
+        self.stop_names = [s[1] for s in stops]
+        self.stop_points = np.array([[s[2], s[3]] for s in stops], dtype=np.float64).reshape(-1, 2)
+        self.routes = []
+        for route_id, name, coordinates in routes:
+            points = shape_array(coordinates or [])
+            if len(points) >= 2:
+                self.routes.append((route_id, name, points, bbox_of(points)))
+        self.simplified = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls):
+        names = dict(BusRoute.objects.values_list('id', 'name'))
+        return cls(
+            list(Stop.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude')),
+            [(route_id, names.get(route_id, ''), coordinates)
+             for route_id, coordinates in RouteShape.objects.order_by('route_id').values_list('route_id', 'coordinates')],
+        )
+
+    def simplified_shape(self, route_id, points, z):
+        key = (route_id, z)
+        shape = self.simplified.get(key)
+        if shape is None:
+            shape = simplify(points, tolerance_for(z))
+            with self.lock:
+                self.simplified[key] = shape
+        return shape
+
+    def tile(self, z, x, y):
+        bounds = tile_bounds(z, x, y)
+        south, west, north, east = bounds
+
+        stops = []
+        if z >= STOP_MIN_ZOOM and len(self.stop_points):
+            lat, lng = self.stop_points[:, 0], self.stop_points[:, 1]
+            inside = np.flatnonzero((lat >= south) & (lat < north) & (lng >= west) & (lng < east))
+            stops = [
+                [self.stop_ids[i], self.stop_names[i], float(lat[i]), float(lng[i])]
+                for i in inside
+            ]
+
+        routes = []
+        for route_id, name, points, bbox in self.routes:
+            if not intersects(bbox, bounds):
+                continue
+            lines = clip(self.simplified_shape(route_id, points, z), bounds)
+            if lines:
+                routes.append({'id': route_id, 'name': name, 'lines': lines})
+        return {'z': z, 'x': x, 'y': y, 'stops': stops, 'routes': routes}
+
+
+def clip(points, bounds):
+    """Runs of ``points`` inside ``bounds``, each extended by one vertex at both ends."""
+    south, west, north, east = bounds
+    lat, lng = points[:, 0], points[:, 1]
+    inside = (lat >= south) & (lat <= north) & (lng >= west) & (lng <= east)
+    # A segment crossing the tile without a vertex in it still has to be drawn
+    seg_lat = (np.minimum(lat[:-1], lat[1:]) <= north) & (np.maximum(lat[:-1], lat[1:]) >= south)
+    seg_lng = (np.minimum(lng[:-1], lng[1:]) <= east) & (np.maximum(lng[:-1], lng[1:]) >= west)
+    crossing = seg_lat & seg_lng
+    keep = inside.copy()
+    keep[:-1] |= crossing
+    keep[1:] |= crossing
+    if not keep.any():
+        return []
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], keep.view(np.int8), [0]))))
+    return [
+        np.round(points[start:end], 6).tolist()
+        for start, end in zip(edges[::2], edges[1::2])
+        if end - start >= 2
+    ]
+
+
+# ----------------------
+# Disk cache
+# ----------------------
+_lock = threading.Lock()
+_source = None
+_version = None
+_generation = 0
+
+
+def get_tile_source():
+    """The process's tile source, rebuilt when the shared timetable version moves."""
+    global _source, _version
+    version = timetable_version()
+    source = _source
+    if source is None or _version != version:
+        with _lock:
+            if _source is None or _version != version:
+                _source = TileSource.from_database()
+                _version = version
+            source = _source
+    return source
+
+
+def tile_path(z, x, y):
+    return Path(settings.TILE_CACHE_DIR) / str(z) / str(x) / f"{y}.json"
+
+
+def get_tile(z, x, y):
+    """The encoded tile, read from the disk cache or built and written there."""
+    path = tile_path(z, x, y)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    generation, version = _generation, timetable_version()
+    content = json.dumps(get_tile_source().tile(z, x, y), separators=(',', ':'), ensure_ascii=False).encode()
+    # A tile built from data changed meanwhile, in this process or another
+    # (whose discards may already have run), is served but not stored
+    if generation == _generation and version == timetable_version():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, path)
+    return content
+
+
+def discard_tiles(bboxes, min_zoom=MIN_ZOOM):
+    """Drop the in-memory source and every cached tile touching one of ``bboxes``."""
+    global _source, _generation
+    with _lock:
+        _source = None
+        _generation += 1
+    root = Path(settings.TILE_CACHE_DIR)
+    bboxes = [bbox for bbox in bboxes if bbox is not None]
+    for z in range(min_zoom, MAX_ZOOM + 1):
+        zoom_dir = root / str(z)
+        if not bboxes or not zoom_dir.is_dir():
+            continue
+        ranges = [tile_range(z, bbox) for bbox in bboxes]
+        for x_dir in zoom_dir.iterdir():
+            x = int(x_dir.name)
+            rows = [(y0, y1) for x0, x1, y0, y1 in ranges if x0 <= x <= x1]
+            if not rows:
+                continue
+            for tile in x_dir.glob('*.json'):
+                y = int(tile.stem)
+                if any(y0 <= y <= y1 for y0, y1 in rows):
+                    tile.unlink(missing_ok=True)
+
+
+def clear_tile_cache():
+    global _source, _generation
+    with _lock:
+        _source = None
+        _generation += 1
+    shutil.rmtree(settings.TILE_CACHE_DIR, ignore_errors=True)
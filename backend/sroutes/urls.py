@@ -1,11 +1,15 @@
 from django.urls import path
+from transport.cache import cached_response
 from . import views
+from .shapes import SHAPE_PARAMS
 
 urlpatterns = [
-    path('bus-routes/', views.BusRouteListView.as_view(), name='bus-route-list'),
-    path('bus-routes/<int:pk>/', views.BusRouteDetailView.as_view(), name='bus-route-detail'),
+    path('bus-routes/', cached_response(views.BusRouteListView.as_view(), params=SHAPE_PARAMS), name='bus-route-list'),
+    path('bus-routes/<int:pk>/', cached_response(views.BusRouteDetailView.as_view(), params=SHAPE_PARAMS), name='bus-route-detail'),
+    path('tiles/<int:z>/<int:x>/<int:y>/', views.map_tile, name='map-tile'),
     # Fare & Passes
     path('fares/estimate/', views.fare_estimate, name='fare-estimate'),
+    path('fares/estimate/batch/', views.fare_estimate_batch, name='fare-estimate-batch'),
     path('passes/options/', views.passes_options, name='passes-options'),
     path('passes/quote/', views.passes_quote, name='passes-quote'),
 ]
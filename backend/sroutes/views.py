@@ -1,45 +1,75 @@
 from rest_framework import generics
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from decimal import Decimal
-from .models import BusRoute, Fare, PassPlan, UserTypeDiscount
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from .models import BusRoute, TripPattern, TripPatternStop, PassPlan
 from .serializers import BusRouteSerializer, PassPlanSerializer
+from .fares import get_fare_tables, DEFAULT_BASE_FARE
+from .passes import usage_history, quote_passes
+from .shapes import shape_format
+from .tiles import get_tile, is_valid_tile
+from transport.cache import cached_response
+
+
+def bus_route_queryset():
+    """Routes with everything BusRouteSerializer nests loaded in a fixed number of queries."""
+    return BusRoute.objects.select_related('start_stop', 'end_stop', 'shape').prefetch_related(
+        Prefetch(
+            'trip_patterns',
+            queryset=TripPattern.objects.prefetch_related(
+                Prefetch('pattern_stops', queryset=TripPatternStop.objects.select_related('stop'))
+            ),
+        ),
+        'fares',
+    )
+
+
+class ShapeFormatMixin:
+    """Passes the ``shape_format``/``tolerance`` query parameters on to RouteShapeSerializer."""
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        try:
+            context['shape_format'] = shape_format(self.request.query_params)
+        except ValueError as e:
+            raise ValidationError({'error': str(e)})
+        return context
+
+
+class BusRouteListView(ShapeFormatMixin, generics.ListCreateAPIView):
+    queryset = bus_route_queryset()
+    serializer_class = BusRouteSerializer
 
 
-class BusRouteListView(generics.ListCreateAPIView):
-    queryset = BusRoute.objects.all()
+class BusRouteDetailView(ShapeFormatMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = bus_route_queryset()
     serializer_class = BusRouteSerializer
 
 
-class BusRouteDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = BusRoute.objects.all()
-    serializer_class = BusRouteSerializer
+@api_view(['GET'])
+def map_tile(request, z, x, y):
+    """Stops and simplified route shapes inside one ``z/x/y`` map tile."""
+    if not is_valid_tile(z, x, y):
+        return Response({'error': 'No such tile'}, status=404)
+    return HttpResponse(get_tile(z, x, y), content_type='application/json')
 
 
 # ----------------------
 # Fare Estimation & Passes
 # ----------------------
 
-DEFAULT_BASE_FARE = Decimal('20.00')
-MINIMUM_FARE = Decimal('10.00')
-TRANSFER_FEE = Decimal('10.00')  # policy: per transfer (can be 0 for first transfer free)
-FIRST_TRANSFER_FREE = True
+MAX_BATCH_ESTIMATES = 500
 
 
 def get_route_base_fare(route_id: int) -> Decimal:
-    try:
-        f = Fare.objects.filter(route_id=route_id).first()
-        return f.amount if f else DEFAULT_BASE_FARE
-    except Exception:
-        return DEFAULT_BASE_FARE
+    return get_fare_tables().base_fare(route_id)
 
 
 def get_user_discount(user_type: str) -> Decimal:
-    try:
-        d = UserTypeDiscount.objects.filter(user_type=user_type).first()
-        return d.discount_pct if d else Decimal('0.00')
-    except Exception:
-        return Decimal('0.00')
+    return get_fare_tables().discount(user_type)
 
 
 @api_view(['GET'])
@@ -52,35 +82,44 @@ def fare_estimate(request):
         if not route_id:
             return Response({'error': 'route_id is required'}, status=400)
 
-        base = get_route_base_fare(route_id)
-
-        transfer_charge = Decimal('0.00')
-        if transfers > 0:
-            effective_transfers = transfers - 1 if FIRST_TRANSFER_FREE else transfers
-            if effective_transfers > 0:
-                transfer_charge = TRANSFER_FEE * Decimal(effective_transfers)
-
-        subtotal = base + transfer_charge
-        discount_pct = get_user_discount(user_type)
-        discount_amt = (subtotal * discount_pct).quantize(Decimal('0.01'))
-        total = max(MINIMUM_FARE, (subtotal - discount_amt).quantize(Decimal('0.01')))
-
-        return Response({
-            'route_id': int(route_id),
-            'user_type': user_type,
-            'breakdown': {
-                'base_fare': str(base),
-                'transfer_fare': str(transfer_charge),
-                'discount_pct': str(discount_pct),
-                'discount_amount': str(discount_amt),
-                'subtotal': str(subtotal),
-            },
-            'total': str(total)
-        })
+        return Response(get_fare_tables().estimate(int(route_id), transfers, user_type))
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
 
+@api_view(['POST'])
+def fare_estimate_batch(request):
+    """
+    Price many rides at once. The body is a list (or ``{"items": [...]}``)
+    of ``{"route_id", "transfers", "user_type"}`` objects; results come back
+    in the same order, with an ``error`` entry for any item that is invalid.
+    """
+    items = request.data.get('items') if isinstance(request.data, dict) else request.data
+    if not isinstance(items, list):
+        return Response({'error': 'Expected a list of items'}, status=400)
+    if len(items) > MAX_BATCH_ESTIMATES:
+        return Response({'error': f'At most {MAX_BATCH_ESTIMATES} items per request'}, status=400)
+
+    tables = get_fare_tables()
+    results = []
+    for item in items:
+        try:
+            route_id = int(item['route_id'])
+            transfers = int(item.get('transfers', 0))
+            user_type = item.get('user_type', 'default')
+            if transfers < 0 or not isinstance(user_type, str):
+                raise ValueError
+        except (KeyError, TypeError, ValueError, AttributeError):
+            results.append({
+                'error': 'route_id (integer) is required; transfers must be a non-negative integer; '
+                         'user_type must be a string'
+            })
+            continue
+        results.append(tables.estimate(route_id, transfers, user_type))
+    return Response({'results': results})
+
+
+@cached_response
 @api_view(['GET'])
 def passes_options(request):
     try:
@@ -92,47 +131,33 @@ def passes_options(request):
 
 @api_view(['POST'])
 def passes_quote(request):
+    """
+    Cheapest mix of passes and pay-as-you-go for a rider's usage, given as
+    ``trips_per_day`` (a month at that rate), ``trip_history`` (trips on each
+    day) or ``trip_distribution`` (``{trips per day: number of days}``).
+    """
     try:
-        trips_per_day = Decimal(str(request.data.get('trips_per_day', '0')))
         user_type = request.data.get('user_type', 'default')
         per_trip_cost = Decimal(str(request.data.get('per_trip_cost', DEFAULT_BASE_FARE)))
-
-        if trips_per_day <= 0:
+        trips_per_day = request.data.get('trips_per_day')
+
+        try:
+            history = usage_history(
+                trips_per_day=trips_per_day,
+                history=request.data.get('trip_history'),
+                distribution=request.data.get('trip_distribution'),
+            )
+        except (TypeError, ValueError) as e:
+            return Response({'error': str(e)}, status=400)
+        if trips_per_day is not None and Decimal(str(trips_per_day)) <= 0:
             return Response({'error': 'trips_per_day must be > 0'}, status=400)
 
-        discount_pct = get_user_discount(user_type)
-        effective_trip_cost = (per_trip_cost * (Decimal('1.00') - discount_pct)).quantize(Decimal('0.01'))
-
-        # Compute break-even for each pass
-        rec = []
-        for plan in PassPlan.objects.all():
-            if plan.period == 'daily':
-                daily_cost = plan.price
-                be_trips = (daily_cost / effective_trip_cost).quantize(Decimal('0.01'))
-                rec.append({'plan': plan.name, 'period': plan.period, 'price': str(plan.price), 'break_even_trips_per_day': str(be_trips)})
-            elif plan.period == 'weekly':
-                weekly_cost = plan.price
-                be_trips_per_day = (weekly_cost / (effective_trip_cost * Decimal('7'))).quantize(Decimal('0.01'))
-                rec.append({'plan': plan.name, 'period': plan.period, 'price': str(plan.price), 'break_even_trips_per_day': str(be_trips_per_day)})
-            elif plan.period == 'monthly':
-                monthly_cost = plan.price
-                be_trips_per_day = (monthly_cost / (effective_trip_cost * Decimal('30'))).quantize(Decimal('0.01'))
-                rec.append({'plan': plan.name, 'period': plan.period, 'price': str(plan.price), 'break_even_trips_per_day': str(be_trips_per_day)})
-
-        # Pick recommendation closest to user's trips_per_day
-        def pick(plan):
-            try:
-                return abs(Decimal(plan['break_even_trips_per_day']) - trips_per_day)
-            except Exception:
-                return Decimal('9999')
-
-        best = min(rec, key=pick) if rec else None
-
+        tables = get_fare_tables()
+        effective_trip_cost = tables.trip_cost(user_type, per_trip_cost)
         return Response({
             'user_type': user_type,
             'per_trip_cost': str(effective_trip_cost),
-            'plans': rec,
-            'recommendation': best
+            **quote_passes(tables.plans, history, effective_trip_cost),
         })
     except Exception as e:
         return Response({'error': str(e)}, status=500)
@@ -0,0 +1,110 @@
+"""
+Response cache for read-mostly endpoints.
+
+Cached responses are keyed by a global timetable version that lives in the
+Django cache. ``settings.CACHES`` points at a cache shared by every worker
+and management command, so a bump from an importer or another worker is
+seen by all of them on their next request. A process-local cache
+(``LocMemCache``) would keep each process on its own version. Each entry
+holds the rendered JSON bytes and their ETag, so a hit skips both the
+queries and the serializer, and a matching ``If-None-Match`` returns 304.
+"""
+import functools
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+
+VERSION_KEY = 'timetable:version'
+RESPONSE_KEY = 'response:{version}:{path}?{params}'
+RESPONSE_TIMEOUT = 24 * 60 * 60
+
+
+def timetable_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock, not 1, so entries cached before the version
+        # was evicted can never be served again
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_timetable_version(**kwargs):
+    # incr is not atomic on every backend; two racing bumps may land on the
+    # same value, which still differs from the version readers had cached
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        timetable_version()
+
+
+def make_etag(content):
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+def response_key(request, params):
+    """
+    Cache key for ``request``: the path plus each of ``params`` (a mapping of
+    query parameter to normalizer) that is present, normalized. Raises
+    ValueError or TypeError when a normalizer rejects its value.
+    """
+    values = []
+    for name, normalize in params.items():
+        value = request.GET.get(name, '').strip()
+        if value:
+            values.append((name, normalize(value)))
+    return RESPONSE_KEY.format(version=timetable_version(), path=request.path, params=urlencode(values))
+
+
+def cached_response(view=None, *, params=None):
+    """
+    Serve GET requests to ``view`` from the versioned cache.
+
+    Only the query parameters named in ``params`` are part of the key, so
+    arbitrary query strings cannot fill the cache with copies of the same
+    payload; list every parameter the view reads. Only successful JSON
+    responses are stored; requests asking for HTML (the browsable API),
+    requests with parameters their normalizers reject and other methods go
+    straight to the view.
+    """
+    if view is None:
+        return functools.partial(cached_response, params=params)
+    params = params or {}
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+            return view(request, *args, **kwargs)
+        try:
+            key = response_key(request, params)
+        except (TypeError, ValueError):
+            return view(request, *args, **kwargs)
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            if response.status_code != 200 or not response.get('Content-Type', '').startswith('application/json'):
+                return response
+            entry = (make_etag(response.content), response.content)
+            cache.set(key, entry, RESPONSE_TIMEOUT)
+
+        etag, content = entry
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+    return wrapper
@@ -0,0 +1,67 @@
+"""
+Helpers shared by the ``import_gtfs`` and ``export_gtfs`` management commands.
+
+Both commands read and write the zip members as streams, so ``stop_times.txt``
+never has to fit in memory.
+"""
+import csv
+import io
+from contextlib import contextmanager
+from datetime import time
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def has_member(zf, name):
+    return name in zf.namelist()
+
+
+def read_csv(zf, name):
+    """Yield the rows of ``name`` inside the zip as dicts, one at a time."""
+    with zf.open(name) as raw:
+        # utf-8-sig strips the BOM many feed producers write
+        yield from csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+
+
+@contextmanager
+def write_csv(zf, name, header):
+    with zf.open(name, 'w', force_zip64=True) as raw:
+        with io.TextIOWrapper(raw, encoding='utf-8', newline='') as text:
+            writer = csv.writer(text)
+            writer.writerow(header)
+            yield writer
+
+
+def parse_gtfs_time(value):
+    """Seconds after midnight for an ``HH:MM:SS`` GTFS time, which may exceed 24:00:00."""
+    h, m, s = (int(part) for part in value.strip().split(':'))
+    return h * 3600 + m * 60 + s
+
+
+def seconds_to_time(seconds):
+    seconds %= SECONDS_PER_DAY
+    return time(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def time_to_seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def format_gtfs_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def unwrap_times(times):
+    """
+    Seconds for a trip's ordered ``TimeField`` values, adding a day whenever
+    the clock goes backwards so that trips past midnight stay increasing.
+    """
+    offset, last, result = 0, 0, []
+    for value in times:
+        seconds = time_to_seconds(value) + offset
+        if seconds < last:
+            offset += SECONDS_PER_DAY
+            seconds += SECONDS_PER_DAY
+        result.append(seconds)
+        last = seconds
+    return result
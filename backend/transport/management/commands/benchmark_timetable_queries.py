@@ -0,0 +1,89 @@
+import time
+from datetime import time as clock
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from sroutes.models import TripPattern, TripPatternStop
+from froutes.models import BusTrip, BusTripStopTime
+
+# Indexes added for the timetable hot paths, dropped temporarily by --compare
+TIMETABLE_INDEXES = [
+    (BusTrip, 'froutes_trip_pattern_dep'),
+    (BusTripStopTime, 'froutes_stoptime_pat_stop_dep'),
+    (BusTripStopTime, 'froutes_stoptime_trip_order'),
+    (TripPatternStop, 'sroutes_patstop_pattern_order'),
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Show query plans and timings for the timetable hot-path queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50, help="Executions per query")
+        parser.add_argument(
+            '--compare', action='store_true',
+            help="Also run the pre-index query forms with the timetable indexes dropped (rolled back afterwards)"
+        )
+
+    def handle(self, *args, **options):
+        sample = TripPatternStop.objects.select_related('pattern').order_by('pattern_id', 'stop_order').first()
+        if sample is None:
+            raise CommandError("No timetable data; load some routes first.")
+        self.runs = options['runs']
+        self.pattern_id = sample.pattern_id
+        self.route_id = sample.pattern.route_id
+        self.stop_id = sample.stop_id
+        self.after = clock(8, 0)
+
+        if options['compare']:
+            try:
+                with transaction.atomic():
+                    self.drop_indexes()
+                    self.report("before", legacy=True)
+                    raise _Rollback
+            except _Rollback:
+                pass
+        self.report("after", legacy=False)
+
+    def queries(self, legacy):
+        if legacy:
+            departures = BusTripStopTime.objects.filter(trip__pattern_id=self.pattern_id)
+            route_trips = BusTrip.objects.filter(pattern__route_id=self.route_id).order_by('departure_time')
+        else:
+            departures = BusTripStopTime.objects.filter(pattern_id=self.pattern_id)
+            route_trips = BusTrip.objects.filter(
+                pattern_id__in=TripPattern.objects.filter(route_id=self.route_id).values('id')
+            ).order_by('pattern_id', 'departure_time')
+        return [
+            ("next departures", departures.filter(
+                stop_id=self.stop_id, departure_time__gte=self.after
+            ).order_by('departure_time')[:3]),
+            ("pattern stops", TripPatternStop.objects.filter(pattern_id=self.pattern_id).order_by('stop_order')),
+            ("route trips", route_trips),
+            ("trip stop times", BusTripStopTime.objects.filter(
+                trip_id__in=BusTrip.objects.filter(pattern_id=self.pattern_id).values('id')[:1]
+            ).order_by('stop_order')),
+        ]
+
+    def report(self, label, legacy):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"== {label} =="))
+        for name, queryset in self.queries(legacy):
+            started = time.perf_counter()
+            for _ in range(self.runs):
+                list(queryset.all())
+            elapsed = (time.perf_counter() - started) / self.runs * 1000
+            self.stdout.write(self.style.SUCCESS(f"{name}: {elapsed:.3f} ms/query"))
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"    {line}")
+
+    def drop_indexes(self):
+        template = connection.SchemaEditorClass.sql_delete_index
+        with connection.cursor() as cursor:
+            for model, name in TIMETABLE_INDEXES:
+                cursor.execute(template % {
+                    'table': connection.ops.quote_name(model._meta.db_table),
+                    'name': connection.ops.quote_name(name),
+                })
@@ -0,0 +1,106 @@
+import zipfile
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from home.models import Stop
+from sroutes.models import BusRoute, RouteShape, Fare
+from froutes.models import BusTrip, BusTripStopTime
+from transport.gtfs import write_csv, format_gtfs_time, unwrap_times
+
+AGENCY_ID = 'PTT'
+SERVICE_ID = 'DAILY'
+BUS_ROUTE_TYPE = 3
+
+
+class Command(BaseCommand):
+    help = "Export stops, routes, trips, stop times, shapes and fares as a GTFS static feed (zip)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the GTFS zip file to write")
+        parser.add_argument('--agency-name', default="Public Transport Tracker")
+        parser.add_argument('--agency-url', default="http://localhost:8000/")
+
+    def handle(self, *args, **options):
+        counts = {}
+        with zipfile.ZipFile(options['output'], 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            with write_csv(zf, 'agency.txt', ['agency_id', 'agency_name', 'agency_url', 'agency_timezone']) as w:
+                w.writerow([AGENCY_ID, options['agency_name'], options['agency_url'], settings.TIME_ZONE])
+
+            # The data model has no service calendar: every trip runs daily
+            today = date.today()
+            with write_csv(zf, 'calendar.txt', [
+                'service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
+                'start_date', 'end_date',
+            ]) as w:
+                w.writerow([SERVICE_ID] + [1] * 7 + [today.strftime('%Y%m%d'), (today + timedelta(days=365)).strftime('%Y%m%d')])
+
+            with write_csv(zf, 'stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon']) as w:
+                counts['stops'] = 0
+                for row in Stop.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude').iterator():
+                    w.writerow(row)
+                    counts['stops'] += 1
+
+            with write_csv(zf, 'routes.txt', ['route_id', 'agency_id', 'route_short_name', 'route_type']) as w:
+                counts['routes'] = 0
+                for route_id, name in BusRoute.objects.order_by('id').values_list('id', 'name').iterator():
+                    w.writerow([route_id, AGENCY_ID, name, BUS_ROUTE_TYPE])
+                    counts['routes'] += 1
+
+            shaped_routes = set()
+            with write_csv(zf, 'shapes.txt', ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence']) as w:
+                for route_id, coordinates in RouteShape.objects.values_list('route_id', 'coordinates').iterator():
+                    shaped_routes.add(route_id)
+                    for seq, (lat, lng) in enumerate(coordinates or [], start=1):
+                        w.writerow([route_id, lat, lng, seq])
+
+            with write_csv(zf, 'trips.txt', ['route_id', 'service_id', 'trip_id', 'shape_id']) as w:
+                counts['trips'] = 0
+                for trip_id, route_id in BusTrip.objects.order_by('id').values_list('id', 'pattern__route_id').iterator():
+                    w.writerow([route_id, SERVICE_ID, trip_id, route_id if route_id in shaped_routes else ''])
+                    counts['trips'] += 1
+
+            counts['stop_times'] = self.write_stop_times(zf)
+
+            fares = list(Fare.objects.order_by('id').values_list('id', 'route_id', 'amount'))
+            if fares:
+                with write_csv(zf, 'fare_attributes.txt', [
+                    'fare_id', 'price', 'currency_type', 'payment_method', 'transfers',
+                ]) as w:
+                    for fare_id, _, amount in fares:
+                        w.writerow([fare_id, amount, 'INR', 0, ''])
+                with write_csv(zf, 'fare_rules.txt', ['fare_id', 'route_id']) as w:
+                    for fare_id, route_id, _ in fares:
+                        w.writerow([fare_id, route_id])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {counts['stops']} stops, {counts['routes']} routes, {counts['trips']} trips and "
+            f"{counts['stop_times']} stop times to {options['output']}"
+        ))
+
+    def write_stop_times(self, zf):
+        """Stream stop times trip by trip; times past midnight are written as 24:00:00 and beyond."""
+        count = 0
+        header = ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']
+        rows = (
+            BusTripStopTime.objects.order_by('trip_id', 'stop_order')
+            .values_list('trip_id', 'stop_id', 'stop_order', 'arrival_time', 'departure_time')
+            .iterator(chunk_size=10000)
+        )
+        with write_csv(zf, 'stop_times.txt', header) as w:
+            trip = []
+            for row in rows:
+                if trip and row[0] != trip[0][0]:
+                    count += self.write_trip(w, trip)
+                    trip = []
+                trip.append(row)
+            if trip:
+                count += self.write_trip(w, trip)
+        return count
+
+    def write_trip(self, writer, trip):
+        times = unwrap_times(t for row in trip for t in row[3:5])
+        for i, (trip_id, stop_id, stop_order, _, _) in enumerate(trip):
+            writer.writerow([
+                trip_id, format_gtfs_time(times[2 * i]), format_gtfs_time(times[2 * i + 1]), stop_id, stop_order,
+            ])
+        return len(trip)
@@ -0,0 +1,292 @@
+import zipfile
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from home.models import Stop
+from sroutes.models import BusRoute, TripPattern, TripPatternStop, RouteShape, Fare
+from sroutes.shapes import shape_array, project_stops
+from sroutes.tiles import clear_tile_cache
+from froutes.models import BusTrip, BusTripStopTime
+from transport.cache import bump_timetable_version
+from transport.gtfs import has_member, read_csv, parse_gtfs_time, seconds_to_time
+
+
+def interpolate_times(rows):
+    """
+    Fill untimed intermediate stops in place, spacing them evenly between the
+    surrounding timepoints. Returns False when the first or last stop is untimed.
+    """
+    timed = [i for i, row in enumerate(rows) if row[2] is not None]
+    if not timed or timed[0] != 0 or timed[-1] != len(rows) - 1:
+        return False
+    for a, b in zip(timed, timed[1:]):
+        start, end = rows[a][3], rows[b][2]
+        for i in range(a + 1, b):
+            seconds = start + (end - start) * (i - a) // (b - a)
+            rows[i] = (rows[i][0], rows[i][1], seconds, seconds)
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream-import a GTFS static feed (zip) into stops, routes, patterns, trips and stop times. "
+        "Rows are matched on their GTFS ids, so importing a feed again updates it in place"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', help="Path to the GTFS zip file")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per bulk INSERT")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        try:
+            zf = zipfile.ZipFile(options['feed'])
+        except (OSError, zipfile.BadZipFile) as e:
+            raise CommandError(f"Cannot open GTFS feed: {e}")
+
+        with zf, transaction.atomic():
+            for name in ('stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt'):
+                if not has_member(zf, name):
+                    raise CommandError(f"GTFS feed is missing {name}")
+
+            self.stop_coords = {}
+            self.stop_ids = self.import_stops(zf)
+            self.route_names = {
+                row['route_id']: row.get('route_short_name') or row.get('route_long_name') or row['route_id']
+                for row in read_csv(zf, 'routes.txt')
+            }
+            self.trips = {row['trip_id']: (row['route_id'], row.get('shape_id') or None) for row in read_csv(zf, 'trips.txt')}
+            self.shapes = self.read_shapes(zf) if has_member(zf, 'shapes.txt') else {}
+
+            self.routes = {}
+            self.route_shapes = {}
+            self.patterns = {}
+            self.existing_trips = dict(BusTrip.objects.filter(gtfs_id__isnull=False).values_list('gtfs_id', 'pk'))
+            trip_count, stop_time_count = self.import_stop_times(zf)
+            fare_count = self.import_fares(zf)
+        # Bulk writes send no model signals, so cached responses and tiles are retired here
+        bump_timetable_version()
+        clear_tile_cache()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(self.stop_ids)} stops, {len(self.routes)} routes, {len(self.patterns)} patterns, "
+            f"{trip_count} trips, {stop_time_count} stop times and {fare_count} fares"
+        ))
+
+    # ----------------------
+    # Readers
+    # ----------------------
+    def import_stops(self, zf):
+        stop_ids, batch = {}, []
+
+        def flush():
+            found = {s.gtfs_id: s for s in Stop.objects.filter(gtfs_id__in=[s.gtfs_id for s in batch])}
+            new, changed = [], []
+            for stop in batch:
+                old = found.get(stop.gtfs_id)
+                if old is None:
+                    new.append(stop)
+                    continue
+                if (old.name, old.latitude, old.longitude) != (stop.name, stop.latitude, stop.longitude):
+                    old.name, old.latitude, old.longitude = stop.name, stop.latitude, stop.longitude
+                    changed.append(old)
+                stop.pk = old.pk
+            self.bulk_create(Stop, new)
+            Stop.objects.bulk_update(changed, ['name', 'latitude', 'longitude'], batch_size=self.batch_size)
+            stop_ids.update((s.gtfs_id, s.pk) for s in batch)
+            self.stop_coords.update((s.pk, (s.latitude, s.longitude)) for s in batch)
+            batch.clear()
+
+        for row in read_csv(zf, 'stops.txt'):
+            # Only boarding locations; stations, entrances and nodes are skipped
+            if row.get('location_type') not in (None, '', '0'):
+                continue
+            batch.append(Stop(
+                gtfs_id=row['stop_id'], name=row['stop_name'],
+                latitude=float(row['stop_lat']), longitude=float(row['stop_lon']),
+            ))
+            if len(batch) >= self.batch_size:
+                flush()
+        flush()
+        return stop_ids
+
+    def read_shapes(self, zf):
+        wanted = {shape_id for _, shape_id in self.trips.values() if shape_id}
+        points = {}
+        for row in read_csv(zf, 'shapes.txt'):
+            if row['shape_id'] in wanted:
+                points.setdefault(row['shape_id'], []).append(
+                    (int(row['shape_pt_sequence']), float(row['shape_pt_lat']), float(row['shape_pt_lon']))
+                )
+        return {shape_id: [[lat, lng] for _, lat, lng in sorted(pts)] for shape_id, pts in points.items()}
+
+    def import_stop_times(self, zf):
+        """
+        Stream stop_times.txt one trip at a time. The feed must list each
+        trip's rows contiguously (as virtually all producers do) so only the
+        current trip and one insert batch are held in memory.
+        """
+        pending_trips, pending_times = [], []
+        finished = set()
+        counts = [0, 0]
+
+        def flush():
+            new = [trip for trip in pending_trips if trip.pk is None]
+            updated = [trip for trip in pending_trips if trip.pk is not None]
+            self.bulk_create(BusTrip, new)
+            BusTrip.objects.bulk_update(
+                updated, ['pattern', 'departure_time', 'arrival_time'], batch_size=self.batch_size
+            )
+            # Stop times of trips seen before are replaced wholesale
+            BusTripStopTime.objects.filter(trip_id__in=[trip.pk for trip in updated]).delete()
+            for trip, stop_times in zip(pending_trips, pending_times):
+                for st in stop_times:
+                    st.trip = trip
+            rows = [st for stop_times in pending_times for st in stop_times]
+            BusTripStopTime.objects.bulk_create(rows, batch_size=self.batch_size)
+            counts[0] += len(pending_trips)
+            counts[1] += len(rows)
+            pending_trips.clear()
+            pending_times.clear()
+
+        def add_trip(trip_id, rows):
+            if trip_id in finished:
+                raise CommandError(f"stop_times.txt is not grouped by trip_id (trip {trip_id} appears twice)")
+            finished.add(trip_id)
+            if trip_id not in self.trips:
+                return
+            rows.sort(key=lambda r: r[0])
+            stops = [self.stop_ids.get(stop_id) for _, stop_id, _, _ in rows]
+            if len(stops) < 2 or None in stops or not interpolate_times(rows):
+                return
+            pattern = self.get_pattern(trip_id, stops)
+            stop_times = [
+                BusTripStopTime(
+                    pattern=pattern,
+                    stop_id=stop,
+                    stop_order=order,
+                    arrival_time=seconds_to_time(arrival),
+                    departure_time=seconds_to_time(departure),
+                )
+                for order, (stop, (_, _, arrival, departure)) in enumerate(zip(stops, rows), start=1)
+            ]
+            pending_trips.append(BusTrip(
+                pk=self.existing_trips.get(trip_id),
+                gtfs_id=trip_id,
+                pattern=pattern,
+                departure_time=stop_times[0].departure_time,
+                arrival_time=stop_times[-1].arrival_time,
+            ))
+            pending_times.append(stop_times)
+            if sum(len(t) for t in pending_times) >= self.batch_size:
+                flush()
+
+        current, rows = None, []
+        for row in read_csv(zf, 'stop_times.txt'):
+            if row['trip_id'] != current:
+                if current is not None:
+                    add_trip(current, rows)
+                current, rows = row['trip_id'], []
+            arrival = row.get('arrival_time') or row.get('departure_time')
+            departure = row.get('departure_time') or arrival
+            rows.append((
+                int(row['stop_sequence']),
+                row['stop_id'],
+                parse_gtfs_time(arrival) if arrival else None,
+                parse_gtfs_time(departure) if departure else None,
+            ))
+        if current is not None:
+            add_trip(current, rows)
+        flush()
+        return counts
+
+    def import_fares(self, zf):
+        if not (has_member(zf, 'fare_attributes.txt') and has_member(zf, 'fare_rules.txt')):
+            return 0
+        prices = {row['fare_id']: Decimal(row['price']) for row in read_csv(zf, 'fare_attributes.txt')}
+        fares = []
+        for row in read_csv(zf, 'fare_rules.txt'):
+            route = self.routes.get(row.get('route_id'))
+            if route is not None and row['fare_id'] in prices:
+                fares.append(Fare(route=route, amount=prices[row['fare_id']]))
+        # The feed's fare rules replace the fares of the routes it contains
+        Fare.objects.filter(route__in=self.routes.values()).delete()
+        Fare.objects.bulk_create(fares, batch_size=self.batch_size)
+        return len(fares)
+
+    # ----------------------
+    # Routes and patterns
+    # ----------------------
+    def get_pattern(self, trip_id, stops):
+        gtfs_route_id, shape_id = self.trips[trip_id]
+        key = (gtfs_route_id, tuple(stops))
+        pattern = self.patterns.get(key)
+        if pattern is not None:
+            return pattern
+
+        route = self.routes.get(gtfs_route_id)
+        if route is None:
+            route = self.routes[gtfs_route_id] = self.get_route(gtfs_route_id, shape_id, stops)
+            pattern = self.patterns.get(key)
+            if pattern is not None:
+                return pattern
+
+        pattern = self.patterns[key] = TripPattern.objects.create(route=route)
+        offsets = project_stops(self.route_shapes[route.pk], [self.stop_coords[stop] for stop in stops])
+        TripPatternStop.objects.bulk_create([
+            TripPatternStop(pattern=pattern, stop_id=stop, stop_order=order, shape_index=index, shape_distance_m=distance)
+            for order, (stop, (index, distance)) in enumerate(zip(stops, offsets), start=1)
+        ])
+        return pattern
+
+    def get_route(self, gtfs_route_id, shape_id, stops):
+        """
+        The route for ``gtfs_route_id``, updated from the feed if an earlier
+        import created it, with its existing patterns registered for reuse.
+        """
+        name = self.route_names.get(gtfs_route_id, gtfs_route_id)
+        coordinates = self.shapes.get(shape_id) or []
+        route = BusRoute.objects.filter(gtfs_id=gtfs_route_id).first()
+        if route is None:
+            # BusRoute needs its terminal stops, so routes are created with their first pattern
+            route = BusRoute.objects.create(gtfs_id=gtfs_route_id, name=name, start_stop_id=stops[0], end_stop_id=stops[-1])
+            if coordinates:
+                RouteShape.objects.create(route=route, coordinates=coordinates)
+            self.route_shapes[route.pk] = shape_array(coordinates)
+            return route
+
+        if route.name != name:
+            route.name = name
+            route.save(update_fields=['name'])
+        if coordinates:
+            RouteShape.objects.update_or_create(route=route, defaults={'coordinates': coordinates})
+        else:
+            coordinates = RouteShape.objects.filter(route=route).values_list('coordinates', flat=True).first() or []
+        points = self.route_shapes[route.pk] = shape_array(coordinates)
+
+        # Patterns are reused by stop sequence; their stop offsets follow the (possibly new) shape
+        sequences = {}
+        pattern_stops = TripPatternStop.objects.filter(pattern__route=route).order_by('pattern_id', 'stop_order')
+        for ps in pattern_stops:
+            sequences.setdefault(ps.pattern_id, []).append(ps)
+        changed = []
+        for pattern_id, rows in sequences.items():
+            self.patterns[(gtfs_route_id, tuple(ps.stop_id for ps in rows))] = TripPattern(pk=pattern_id, route=route)
+            offsets = project_stops(points, [self.stop_coords.get(ps.stop_id) or self.stop_position(ps.stop_id) for ps in rows])
+            for ps, (index, distance) in zip(rows, offsets):
+                if (ps.shape_index, ps.shape_distance_m) != (index, distance):
+                    ps.shape_index, ps.shape_distance_m = index, distance
+                    changed.append(ps)
+        TripPatternStop.objects.bulk_update(changed, ['shape_index', 'shape_distance_m'], batch_size=self.batch_size)
+        return route
+
+    def stop_position(self, stop_id):
+        # A pattern stop that is not in this feed keeps its stored position
+        stop = Stop.objects.values_list('latitude', 'longitude').get(pk=stop_id)
+        self.stop_coords[stop_id] = stop
+        return stop
+
+    def bulk_create(self, model, objs):
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        if any(obj.pk is None for obj in objs):
+            raise CommandError("The database backend must return ids from bulk inserts")
@@ -1,102 +1,274 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+import glob
 import os
 import json
-from django.core.management.base import BaseCommand
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from home.models import Stop
 from sroutes.models import BusRoute, TripPattern, TripPatternStop, RouteShape
+from sroutes.shapes import shape_array, project_stops
+from sroutes.tiles import clear_tile_cache
 from froutes.models import BusTrip, BusTripStopTime
+from transport.cache import bump_timetable_version
+
+# Timing configuration
+FIRST_DEPARTURE = "06:00"
+TRIPS_PER_ROUTE = 60
+TRIP_INTERVAL = timedelta(minutes=10)  # Every 10 minutes
+TIME_PER_STOP = timedelta(minutes=3)   # Example gap between stops
+DWELL_TIME = timedelta(seconds=30)     # Stop waiting time
+
+
+def parse_route_file(file_path):
+    """Read one route JSON file into plain data: route code, ordered stops and shape."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    stops_data = sorted(data["Data"], key=lambda x: x["sequenceNumber"])
+
+    stops = [
+        (
+            stop_info["stopName"],
+            float(stop_info["position"]["stopLatitude"]),
+            float(stop_info["position"]["stopLongitude"]),
+        )
+        for stop_info in stops_data
+    ]
+
+    shape_coords = []
+    shape = data['Data'][0]['routeFlow']
+    coords = shape[len('LINESTRING ('):-1]
+    for pair in coords.split(', '):
+        lng, lat = pair.split(' ')
+        shape_coords.append([float(lat), float(lng)])
+
+    return {
+        'path': file_path,
+        'route_code': stops_data[0]["routeCode"],
+        'stops': stops,
+        'shape': shape_coords,
+    }
+
+
+def safe_parse_route_file(file_path):
+    try:
+        return parse_route_file(file_path)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        return {'path': file_path, 'error': f"{type(e).__name__}: {e}"}
+
+
+def expand_paths(paths):
+    """Route JSON files named by ``paths``: files, directories (every *.json inside) or glob patterns."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path, recursive=True)))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def generate_trips(n_stops):
+    """(departure, arrival, [(arrival, departure) per stop]) for every generated trip."""
+    start_time = datetime.strptime(FIRST_DEPARTURE, "%H:%M")
+    trip_duration = TIME_PER_STOP * (n_stops - 1) + DWELL_TIME
+
+    trips = []
+    for i in range(TRIPS_PER_ROUTE):
+        current_time = start_time + i * TRIP_INTERVAL
+        departure_time = current_time.time()
+        arrival_time = (current_time + trip_duration).time()
+        stop_times = []
+        for _ in range(n_stops):
+            stop_times.append((current_time.time(), (current_time + DWELL_TIME).time()))
+            current_time += TIME_PER_STOP
+        trips.append((departure_time, arrival_time, stop_times))
+    return trips
+
 
 class Command(BaseCommand):
-    help = "Load route once, generate multiple trips with per-stop timings"
-
-    def handle(self, *args, **kwargs):
-        base_dir = os.path.join("transport", "data")
-        file_path = os.path.join(base_dir, "s.json")  # Base file for stops
-
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            # print('HIiiiiiiiii', data['Data'])
-            stops_data = sorted(data["Data"], key=lambda x: x["sequenceNumber"])
-        
-        
-            
-        # Create stops
-        stop_objects = []
-        for stop_info in stops_data:
-            stop_obj, _ = Stop.objects.get_or_create(
-                name=stop_info["stopName"],
-                latitude=stop_info["position"]["stopLatitude"],
-                longitude=stop_info["position"]["stopLongitude"]
-            )
-            stop_objects.append(stop_obj)
+    help = "Load routes from JSON files, generate multiple trips with per-stop timings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*', default=[os.path.join("transport", "data", "s.json")],
+            help="Route JSON files, directories of them, or glob patterns (default: transport/data/s.json)"
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processes used to parse files")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk INSERT/UPDATE")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        files = expand_paths(options['paths'])
+        if not files:
+            raise CommandError("No route files matched.")
+
+        started = time.perf_counter()
+        routes = rows = failed = 0
+        workers = max(1, min(options['workers'], len(files)))
+
+        # Parsing runs in worker processes; this process is the only database writer.
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            parsed = executor.map(safe_parse_route_file, files, chunksize=max(1, len(files) // (workers * 4)))
+        else:
+            executor = None
+            parsed = map(safe_parse_route_file, files)
+
+        try:
+            with transaction.atomic():
+                for route in parsed:
+                    if 'error' in route:
+                        failed += 1
+                        self.stderr.write(f"Skipped {route['path']}: {route['error']}")
+                        continue
+                    rows += self.write_route(route)
+                    routes += 1
+                    self.stdout.write(
+                        f"Loaded route {route['route_code']} with {TRIPS_PER_ROUTE} trips and stop-wise timings"
+                    )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        # Bulk writes send no model signals, so cached responses and tiles are retired here
+        bump_timetable_version()
+        clear_tile_cache()
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {routes} route(s) from {len(files)} file(s) ({failed} failed), {rows} rows written "
+            f"in {elapsed:.2f}s: {routes / elapsed:.1f} routes/s, {rows / elapsed:.0f} rows/s"
+        ))
+
+    # ----------------------
+    # Writers
+    # ----------------------
+    def write_route(self, route):
+        """Upsert one parsed route and return the number of rows inserted or updated."""
+        stop_objects, rows = self.upsert_stops(route['stops'])
 
-        # Create route
-        route_code = stops_data[0]["routeCode"]
         route_obj, _ = BusRoute.objects.get_or_create(
-            name=route_code,
+            name=route['route_code'],
             start_stop=stop_objects[0],
             end_stop=stop_objects[-1]
         )
-        
-        
-        shape_coords = []    
-        shape = data['Data'][0]['routeFlow']
-
-        coords = shape[len('LINESTRING ('):-1]
-        pair = coords.split(', ')
-        for i in pair:
-            lng, lat = i.split(' ')
-            shape_coords.append([lat,lng])
-            
         RouteShape.objects.update_or_create(
-            route = route_obj,
-            defaults={'coordinates':shape_coords}
+            route=route_obj,
+            defaults={'coordinates': route['shape']}
         )
-        
 
-        # Create trip pattern
         pattern_obj, _ = TripPattern.objects.get_or_create(route=route_obj)
-        TripPatternStop.objects.filter(pattern=pattern_obj).delete()
-        for order, stop in enumerate(stop_objects, start=1):
-            TripPatternStop.objects.create(
-                pattern=pattern_obj,
-                stop=stop,
-                stop_order=order
-            )
-
-        # Timing configuration
-        start_time = datetime.strptime("06:00", "%H:%M")
-        trip_interval = timedelta(minutes=10)  # Every 10 minutes
-        time_per_stop = timedelta(minutes=3)   # Example gap between stops
-        dwell_time = timedelta(seconds=30)     # Stop waiting time
-
-        total_stops_time = time_per_stop * (len(stop_objects) - 1) + dwell_time
-        trip_duration = total_stops_time
+        rows += self.upsert_pattern_stops(pattern_obj, stop_objects, route['shape'])
+        rows += self.upsert_trips(pattern_obj, stop_objects)
+        return rows
 
-        # Generate trips
-        for i in range(60):  # 106 trips
-            departure_time = (start_time + i * trip_interval).time()
-            arrival_time = (datetime.combine(datetime.today(), departure_time) + trip_duration).time()
-
-            trip, _ = BusTrip.objects.get_or_create(
-                pattern=pattern_obj,
-                departure_time=departure_time,
-                arrival_time=arrival_time
+    def upsert_stops(self, stops):
+        """Stop objects for ``stops`` in order (inserting only the missing ones) and the insert count."""
+        names = {name for name, _, _ in stops}
+        existing = {
+            (s.name, s.latitude, s.longitude): s
+            for s in Stop.objects.filter(name__in=names)
+        }
+        missing = {key: Stop(name=key[0], latitude=key[1], longitude=key[2]) for key in stops if key not in existing}
+        if missing:
+            Stop.objects.bulk_create(missing.values(), batch_size=self.batch_size)
+            existing.update(
+                ((s.name, s.latitude, s.longitude), s)
+                for s in Stop.objects.filter(name__in={key[0] for key in missing})
             )
+        return [existing[key] for key in stops], len(missing)
 
-            # Clear any existing stop times for this trip (avoid duplicates if re-run)
-            BusTripStopTime.objects.filter(trip=trip).delete()
+    def upsert_pattern_stops(self, pattern_obj, stop_objects, shape_coords):
+        # Snap every stop onto the shape once so requests never search it again
+        offsets = project_stops(shape_array(shape_coords), [(s.latitude, s.longitude) for s in stop_objects])
+        existing = {ps.stop_order: ps for ps in TripPatternStop.objects.filter(pattern=pattern_obj)}
 
-            # Create stop-level times
-            current_time = datetime.combine(datetime.today(), departure_time)
-            for order, stop in enumerate(stop_objects, start=1):
-                BusTripStopTime.objects.create(
-                    trip=trip,
+        to_create, to_update = [], []
+        for order, (stop, (shape_index, shape_distance)) in enumerate(zip(stop_objects, offsets), start=1):
+            ps = existing.pop(order, None)
+            if ps is None:
+                to_create.append(TripPatternStop(
+                    pattern=pattern_obj,
                     stop=stop,
                     stop_order=order,
-                    arrival_time=current_time.time(),
-                    departure_time=(current_time + dwell_time).time()
+                    shape_index=shape_index,
+                    shape_distance_m=shape_distance
+                ))
+            elif (ps.stop_id, ps.shape_index, ps.shape_distance_m) != (stop.pk, shape_index, shape_distance):
+                ps.stop = stop
+                ps.shape_index = shape_index
+                ps.shape_distance_m = shape_distance
+                to_update.append(ps)
+
+        TripPatternStop.objects.bulk_create(to_create, batch_size=self.batch_size)
+        TripPatternStop.objects.bulk_update(
+            to_update, ['stop', 'shape_index', 'shape_distance_m'], batch_size=self.batch_size
+        )
+        if existing:
+            TripPatternStop.objects.filter(pk__in=[ps.pk for ps in existing.values()]).delete()
+        return len(to_create) + len(to_update)
+
+    def upsert_trips(self, pattern_obj, stop_objects):
+        generated = generate_trips(len(stop_objects))
+
+        trips = {t.departure_time: t for t in BusTrip.objects.filter(pattern=pattern_obj)}
+        new_trips, changed_trips = [], []
+        for departure_time, arrival_time, _ in generated:
+            trip = trips.get(departure_time)
+            if trip is None:
+                trip = trips[departure_time] = BusTrip(
+                    pattern=pattern_obj,
+                    departure_time=departure_time,
+                    arrival_time=arrival_time
                 )
-                current_time += time_per_stop
+                new_trips.append(trip)
+            elif trip.arrival_time != arrival_time:
+                trip.arrival_time = arrival_time
+                changed_trips.append(trip)
+        BusTrip.objects.bulk_create(new_trips, batch_size=self.batch_size)
+        if any(trip.pk is None for trip in new_trips):
+            # Backends that cannot return ids from a bulk INSERT
+            trips = {t.departure_time: t for t in BusTrip.objects.filter(pattern=pattern_obj)}
+        BusTrip.objects.bulk_update(changed_trips, ['arrival_time'], batch_size=self.batch_size)
+        # Trips of an earlier timetable for this route (their stop times cascade)
+        BusTrip.objects.filter(pattern=pattern_obj).exclude(departure_time__in=[d for d, _, _ in generated]).delete()
+
+        trip_ids = [trips[departure_time].pk for departure_time, _, _ in generated]
+        existing = {
+            (st.trip_id, st.stop_order): st
+            for st in BusTripStopTime.objects.filter(trip_id__in=trip_ids)
+        }
 
-        self.stdout.write(self.style.SUCCESS(f"Created route {route_code} with 60 trips and stop-wise timings"))
+        to_create, to_update = [], []
+        for departure_time, _, stop_times in generated:
+            trip = trips[departure_time]
+            for order, (stop, (arrival, departure)) in enumerate(zip(stop_objects, stop_times), start=1):
+                st = existing.pop((trip.pk, order), None)
+                if st is None:
+                    to_create.append(BusTripStopTime(
+                        trip=trip,
+                        pattern=pattern_obj,
+                        stop=stop,
+                        stop_order=order,
+                        arrival_time=arrival,
+                        departure_time=departure
+                    ))
+                elif (st.stop_id, st.pattern_id, st.arrival_time, st.departure_time) != \
+                        (stop.pk, pattern_obj.pk, arrival, departure):
+                    st.stop = stop
+                    st.pattern = pattern_obj
+                    st.arrival_time = arrival
+                    st.departure_time = departure
+                    to_update.append(st)
+
+        BusTripStopTime.objects.bulk_create(to_create, batch_size=self.batch_size)
+        BusTripStopTime.objects.bulk_update(
+            to_update, ['stop', 'pattern', 'arrival_time', 'departure_time'], batch_size=self.batch_size
+        )
+        # Stop times left over from a longer version of this route
+        if existing:
+            BusTripStopTime.objects.filter(pk__in=[st.pk for st in existing.values()]).delete()
+        return len(new_trips) + len(changed_trips) + len(to_create) + len(to_update)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sroutes.models import RouteShape
+from transport.cache import bump_timetable_version
+
+
+class Command(BaseCommand):
+    help = "Rewrite RouteShape.coordinates stored as strings by older imports as [float, float] pairs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Shapes per bulk UPDATE")
+
+    def handle(self, *args, **options):
+        changed = []
+        with transaction.atomic():
+            for shape in RouteShape.objects.only('id', 'coordinates').iterator(chunk_size=options['batch_size']):
+                coordinates = [[float(lat), float(lng)] for lat, lng in shape.coordinates or []]
+                if coordinates != shape.coordinates:
+                    shape.coordinates = coordinates
+                    changed.append(shape)
+            RouteShape.objects.bulk_update(changed, ['coordinates'], batch_size=options['batch_size'])
+        if changed:
+            bump_timetable_version()
+        self.stdout.write(self.style.SUCCESS(f"Normalized {len(changed)} route shape(s)"))
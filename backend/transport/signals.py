@@ -0,0 +1,19 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from home.models import Stop
+from sroutes.models import BusRoute, TripPattern, TripPatternStop, RouteShape, Fare, FareBand, PassPlan, UserTypeDiscount
+from froutes.models import BusTrip, BusTripStopTime
+from .cache import bump_timetable_version
+
+# Models behind the cached bus routes, stop coordinates, schedules and pass
+# options, and behind the process-local timetable and fare tables
+VERSIONED_MODELS = [
+    Stop, BusRoute, TripPattern, TripPatternStop, RouteShape, BusTrip, BusTripStopTime, Fare, FareBand, PassPlan,
+    UserTypeDiscount,
+]
+
+
+@receiver([post_save, post_delete], dispatch_uid='transport.bump_timetable_version')
+def timetable_written(sender, **kwargs):
+    if sender in VERSIONED_MODELS:
+        bump_timetable_version()
@@ -0,0 +1,7 @@
+"""Test helpers shared by the apps' test suites."""
+from django.test import override_settings
+
+# The configured cache is shared with the development server; tests get their own
+isolated_cache = override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+})
@@ -1,3 +1,347 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+import zipfile
+from datetime import time
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from froutes.models import BusTrip, BusTripStopTime
+from home.models import Stop
+from sroutes.models import BusRoute, PassPlan, RouteShape, TripPattern, TripPatternStop, Fare
+from sroutes.tests import create_route
+from .management.commands import load_all_routes
+from .management.commands.load_all_routes import TRIPS_PER_ROUTE, expand_paths
+from .cache import bump_timetable_version, timetable_version
+from .testing import isolated_cache
 
-# Create your tests here.
+
+@isolated_cache
+class CachedResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_route("1D")
+
+    def test_hit_skips_the_database(self):
+        first = self.client.get(reverse('bus-route-list'))
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(reverse('bus-route-list'))
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_matching_etag_returns_304(self):
+        etag = self.client.get(reverse('passes-options'))['ETag']
+        response = self.client.get(reverse('passes-options'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_model_save_retires_cached_responses(self):
+        etag = self.client.get(reverse('passes-options'))['ETag']
+        PassPlan.objects.create(name="Day", period='daily', price='50.00')
+        response = self.client.get(reverse('passes-options'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_version_bump_from_another_process_retires_cached_responses(self):
+        self.assertEqual(len(self.client.get(reverse('bus-route-list')).json()), 1)
+        # A bulk write elsewhere sends no signal here; only the shared version moves
+        route = BusRoute.objects.get()
+        BusRoute.objects.bulk_create([BusRoute(name="2D", start_stop=route.start_stop, end_stop=route.end_stop)])
+        self.assertEqual(len(self.client.get(reverse('bus-route-list')).json()), 1)
+        bump_timetable_version()
+        self.assertEqual(len(self.client.get(reverse('bus-route-list')).json()), 2)
+
+    def test_version_survives_eviction_without_reuse(self):
+        version = timetable_version()
+        cache.clear()
+        self.assertNotEqual(timetable_version(), version)
+
+    def test_unread_query_parameters_share_one_entry(self):
+        url = reverse('bus-route-list')
+        first = self.client.get(url, {'x': 1})
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {'x': 2, 'shape_format': ' ', 'tolerance': ''})
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_read_parameters_are_normalized_into_the_key(self):
+        url = reverse('bus-route-list')
+        plain = self.client.get(url)['ETag']
+        self.client.get(url, {'shape_format': 'polyline', 'tolerance': '10'})
+        with self.assertNumQueries(0):
+            polyline = self.client.get(url, {'tolerance': '10.0', 'shape_format': 'polyline'})['ETag']
+        self.assertNotEqual(polyline, plain)
+
+    def test_rejected_parameters_bypass_the_cache(self):
+        response = self.client.get(reverse('bus-route-list'), {'tolerance': 'far'})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('ETag', response)
+
+
+FEED = {
+    'stops.txt': [
+        ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'location_type'],
+        ['S1', "Alpha", '23.0', '72.5', '0'],
+        ['S2', "Beta", '23.01', '72.5', ''],
+        ['S3', "Gamma", '23.02', '72.5', '0'],
+        ['ST', "Alpha Station", '23.0', '72.5', '1'],
+    ],
+    'routes.txt': [
+        ['route_id', 'route_short_name', 'route_long_name', 'route_type'],
+        ['R1', "1D", "Alpha - Gamma", '3'],
+    ],
+    'trips.txt': [
+        ['route_id', 'service_id', 'trip_id', 'shape_id'],
+        ['R1', 'WK', 'T1', 'SH1'],
+        ['R1', 'WK', 'T2', 'SH1'],
+    ],
+    'stop_times.txt': [
+        ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'],
+        ['T1', '08:00:00', '08:00:00', 'S1', '1'],
+        ['T1', '08:10:00', '08:11:00', 'S2', '2'],
+        ['T1', '08:20:00', '08:20:00', 'S3', '3'],
+        # Past midnight, with an untimed stop to interpolate
+        ['T2', '23:50:00', '23:50:00', 'S1', '1'],
+        ['T2', '', '', 'S2', '2'],
+        ['T2', '24:10:00', '24:10:00', 'S3', '3'],
+    ],
+    'shapes.txt': [
+        ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'],
+        ['SH1', '23.02', '72.5', '3'],
+        ['SH1', '23.0', '72.5', '1'],
+        ['SH1', '23.01', '72.5', '2'],
+    ],
+    'fare_attributes.txt': [['fare_id', 'price', 'currency_type'], ['F1', '15.00', 'INR']],
+    'fare_rules.txt': [['fare_id', 'route_id'], ['F1', 'R1']],
+}
+
+
+def write_feed(path, feed):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, rows in feed.items():
+            text = io.StringIO()
+            csv.writer(text).writerows(rows)
+            zf.writestr(name, text.getvalue())
+
+
+def read_feed(path):
+    with zipfile.ZipFile(path) as zf:
+        return {name: list(csv.DictReader(io.TextIOWrapper(zf.open(name), encoding='utf-8'))) for name in zf.namelist()}
+
+
+@isolated_cache
+class GtfsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(TILE_CACHE_DIR=self.dir / 'tiles'))
+        self.feed = self.dir / 'feed.zip'
+        write_feed(self.feed, FEED)
+
+    def import_feed(self, path=None):
+        call_command('import_gtfs', str(path or self.feed), stdout=StringIO())
+
+    def snapshot(self):
+        return {
+            model.__name__: sorted(model.objects.values_list('pk', flat=True))
+            for model in (Stop, BusRoute, RouteShape, TripPattern, TripPatternStop, Fare, BusTrip, BusTripStopTime)
+        }
+
+    def test_import(self):
+        self.import_feed()
+        self.assertEqual(sorted(Stop.objects.values_list('gtfs_id', 'name')), [('S1', "Alpha"), ('S2', "Beta"), ('S3', "Gamma")])
+        route = BusRoute.objects.get()
+        self.assertEqual((route.gtfs_id, route.name), ('R1', "1D"))
+        self.assertEqual(route.shape.coordinates, [[23.0, 72.5], [23.01, 72.5], [23.02, 72.5]])
+        self.assertEqual(route.fares.get().amount, Decimal('15.00'))
+        self.assertEqual(TripPattern.objects.count(), 1)
+        night = BusTrip.objects.get(gtfs_id='T2')
+        self.assertEqual(
+            [(st.arrival_time, st.pattern_id) for st in night.stop_times.all()],
+            [(time(23, 50), night.pattern_id), (time(0, 0), night.pattern_id), (time(0, 10), night.pattern_id)],
+        )
+
+    def test_reimport_updates_in_place(self):
+        self.import_feed()
+        before = self.snapshot()
+        self.import_feed()
+        after = self.snapshot()
+        # Fares and stop times are replaced wholesale; everything else keeps its id
+        for model in ('Fare', 'BusTripStopTime'):
+            self.assertEqual(len(after.pop(model)), len(before.pop(model)), model)
+        self.assertEqual(after, before)
+
+        changed = dict(FEED, **{'stops.txt': [row[:] for row in FEED['stops.txt']]})
+        changed['stops.txt'][1][1] = "Alpha Depot"
+        write_feed(self.feed, changed)
+        self.import_feed()
+        self.assertEqual(Stop.objects.get(gtfs_id='S1').name, "Alpha Depot")
+        self.assertEqual(self.snapshot()['Stop'], before['Stop'])
+
+    def test_import_retires_cached_data(self):
+        version = timetable_version()
+        self.import_feed()
+        self.assertNotEqual(timetable_version(), version)
+
+    def test_invalid_feeds(self):
+        (self.dir / 'broken.zip').write_bytes(b'not a zip')
+        with self.assertRaises(CommandError):
+            self.import_feed(self.dir / 'broken.zip')
+        write_feed(self.dir / 'partial.zip', {'stops.txt': FEED['stops.txt']})
+        with self.assertRaises(CommandError):
+            self.import_feed(self.dir / 'partial.zip')
+        shuffled = dict(FEED, **{'stop_times.txt': [FEED['stop_times.txt'][i] for i in (0, 1, 4, 2, 3, 5, 6)]})
+        write_feed(self.dir / 'shuffled.zip', shuffled)
+        with self.assertRaises(CommandError):
+            self.import_feed(self.dir / 'shuffled.zip')
+        self.assertFalse(Stop.objects.exists())
+
+    def test_export_round_trip(self):
+        self.import_feed()
+        exported = self.dir / 'export.zip'
+        call_command('export_gtfs', str(exported), stdout=StringIO())
+        feed = read_feed(exported)
+
+        stop_names = {row['stop_id']: row['stop_name'] for row in feed['stops.txt']}
+        self.assertEqual(
+            sorted((row['stop_name'], float(row['stop_lat']), float(row['stop_lon'])) for row in feed['stops.txt']),
+            [("Alpha", 23.0, 72.5), ("Beta", 23.01, 72.5), ("Gamma", 23.02, 72.5)],
+        )
+        self.assertEqual([row['route_short_name'] for row in feed['routes.txt']], ["1D"])
+        self.assertEqual(len(feed['trips.txt']), 2)
+        trips = {}
+        for row in feed['stop_times.txt']:
+            trips.setdefault(row['trip_id'], []).append(
+                (stop_names[row['stop_id']], row['arrival_time'], row['departure_time'])
+            )
+        self.assertEqual(sorted(trips.values()), [
+            [("Alpha", '08:00:00', '08:00:00'), ("Beta", '08:10:00', '08:11:00'), ("Gamma", '08:20:00', '08:20:00')],
+            [("Alpha", '23:50:00', '23:50:00'), ("Beta", '24:00:00', '24:00:00'), ("Gamma", '24:10:00', '24:10:00')],
+        ])
+        self.assertEqual([row['price'] for row in feed['fare_attributes.txt']], ['15.00'])
+
+        # The export imports cleanly into an empty database
+        for model in (BusTripStopTime, BusTrip, BusRoute, Stop):
+            model.objects.all().delete()
+        self.import_feed(exported)
+        self.assertEqual((Stop.objects.count(), BusTrip.objects.count(), BusTripStopTime.objects.count()), (3, 2, 6))
+
+
+def route_file(path, code, stops):
+    """Write a route JSON file in the scraper's format for ``stops`` [(name, lat, lng)]."""
+    flow = "LINESTRING (" + ", ".join(f"{lng} {lat}" for _, lat, lng in stops) + ")"
+    data = [
+        {
+            'sequenceNumber': i, 'stopName': name, 'routeCode': code, 'routeFlow': flow,
+            'position': {'stopLatitude': str(lat), 'stopLongitude': str(lng)},
+        }
+        for i, (name, lat, lng) in enumerate(stops, start=1)
+    ]
+    Path(path).write_text(json.dumps({'Data': data}), encoding='utf-8')
+    return str(path)
+
+
+@isolated_cache
+class LoadAllRoutesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(TILE_CACHE_DIR=self.dir / 'tiles'))
+        self.stops = [(f"Stop {i}", 23.0 + i / 100, 72.5) for i in range(4)]
+        self.file = route_file(self.dir / '1d.json', "1D", self.stops)
+
+    def load(self, *paths, workers=1):
+        out, err = StringIO(), StringIO()
+        call_command('load_all_routes', *paths, workers=workers, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def counts(self):
+        return {
+            model.__name__: model.objects.count()
+            for model in (Stop, BusRoute, RouteShape, TripPattern, TripPatternStop, BusTrip, BusTripStopTime)
+        }
+
+    def test_load(self):
+        self.load(self.file)
+        route = BusRoute.objects.get()
+        self.assertEqual((route.name, route.start_stop.name, route.end_stop.name), ("1D", "Stop 0", "Stop 3"))
+        self.assertEqual(BusTrip.objects.count(), TRIPS_PER_ROUTE)
+        trip = BusTrip.objects.order_by('departure_time').first()
+        self.assertEqual(
+            [(st.stop.name, st.arrival_time, st.departure_time) for st in trip.stop_times.order_by('stop_order')],
+            [("Stop 0", time(6, 0), time(6, 0, 30)), ("Stop 1", time(6, 3), time(6, 3, 30)),
+             ("Stop 2", time(6, 6), time(6, 6, 30)), ("Stop 3", time(6, 9), time(6, 9, 30))],
+        )
+        self.assertEqual(
+            list(TripPatternStop.objects.order_by('stop_order').values_list('shape_index', flat=True)), [0, 1, 2, 3]
+        )
+
+    def test_reloading_the_same_file_changes_nothing(self):
+        self.load(self.file)
+        before = self.counts()
+        trip_ids = sorted(BusTrip.objects.values_list('pk', flat=True))
+        out, _ = self.load(self.file)
+        self.assertEqual(self.counts(), before)
+        self.assertEqual(sorted(BusTrip.objects.values_list('pk', flat=True)), trip_ids)
+        self.assertIn("0 rows written", out)
+
+    def test_reloading_a_shorter_route_deletes_stale_rows(self):
+        self.load(self.file)
+        route_file(self.file, "1D", self.stops[:2] + [("Stop 9", 23.025, 72.5), self.stops[3]])
+        with patch.object(load_all_routes, 'TRIPS_PER_ROUTE', 2):
+            self.load(self.file)
+        self.assertEqual(BusTrip.objects.count(), 2)
+        self.assertEqual(BusTripStopTime.objects.count(), 2 * 4)
+        self.assertEqual(TripPatternStop.objects.count(), 4)
+        self.assertEqual(BusTripStopTime.objects.filter(stop__name="Stop 9").count(), 2)
+
+        # Same ends, one stop fewer
+        route_file(self.file, "1D", [self.stops[0], self.stops[1], self.stops[3]])
+        self.load(self.file)
+        self.assertEqual(BusRoute.objects.count(), 1)
+        self.assertEqual(BusTrip.objects.count(), TRIPS_PER_ROUTE)
+        self.assertEqual(BusTripStopTime.objects.count(), TRIPS_PER_ROUTE * 3)
+        self.assertFalse(BusTripStopTime.objects.filter(stop_order__gt=3).exists())
+        self.assertEqual(TripPatternStop.objects.count(), 3)
+
+    def test_directories_and_globs(self):
+        other = route_file(self.dir / '2d.json', "2D", self.stops[::-1])
+        (self.dir / 'notes.txt').write_text("not a route")
+        self.assertEqual(expand_paths([str(self.dir)]), [self.file, other])
+        self.assertEqual(expand_paths([str(self.dir / '2*.json'), other, self.file]), [other, self.file])
+        self.load(str(self.dir))
+        self.assertEqual(sorted(BusRoute.objects.values_list('name', flat=True)), ["1D", "2D"])
+        # Both directions share their stops
+        self.assertEqual(Stop.objects.count(), 4)
+
+    def test_no_matching_files(self):
+        with self.assertRaises(CommandError):
+            self.load(str(self.dir / '*.geojson'))
+
+    def test_bad_files_are_skipped_by_the_workers(self):
+        (self.dir / 'broken.json').write_text("{")
+        (self.dir / 'empty.json').write_text('{"Data": []}')
+        other = route_file(self.dir / '2d.json', "2D", self.stops[::-1])
+        out, err = self.load(
+            str(self.dir / 'broken.json'), self.file, str(self.dir / 'empty.json'),
+            str(self.dir / 'missing.json'), other, workers=3,
+        )
+        self.assertEqual(sorted(BusRoute.objects.values_list('name', flat=True)), ["1D", "2D"])
+        self.assertEqual(err.count("Skipped"), 3)
+        self.assertIn("broken.json: JSONDecodeError", err)
+        self.assertIn("missing.json: FileNotFoundError", err)
+        self.assertIn("Loaded 2 route(s) from 5 file(s) (3 failed)", out)
+
+    def test_load_retires_cached_data(self):
+        version = timetable_version()
+        self.load(self.file)
+        self.assertNotEqual(timetable_version(), version)